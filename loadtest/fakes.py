@@ -0,0 +1,403 @@
+"""
+Local stand-ins for GCS, Speech, Translate, yt-dlp and MongoDB.
+
+install() patches the client libraries before the Cloud Function modules are
+imported, so the real handler code runs unchanged against in-memory services.
+Each fake call sleeps for a configurable latency to approximate network time.
+"""
+import os
+import sys
+import json
+import time
+import wave
+import shutil
+import zlib
+import base64
+import threading
+import tempfile
+import importlib
+from datetime import datetime, timezone
+
+LATENCY_SECONDS = {
+    "gcs": 0.015,
+    "translate": 0.040,
+    "speech": 0.030,
+    "yt_dlp": 0.200,
+}
+# Per-stream GCS upload bandwidth; 0 means unlimited. Real GCS caps a single
+# stream well below the VM's NIC, which is what parallel uploads work around.
+GCS_STREAM_BYTES_PER_SECOND = 0
+AUDIO_SECONDS = 10
+SAMPLE_RATE = 16000
+
+
+def _sleep(dependency):
+    delay = LATENCY_SECONDS.get(dependency, 0)
+    if delay:
+        time.sleep(delay)
+
+
+class FakeCredentials:
+    service_account_email = "loadtest@localhost"
+
+    @classmethod
+    def from_service_account_file(cls, *args, **kwargs):
+        return cls()
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+
+    @property
+    def size(self):
+        data = self.bucket.objects.get(self.name)
+        return len(data) if data is not None else None
+
+    @property
+    def time_created(self):
+        return self.bucket.meta.get(self.name, {}).get("time_created")
+
+    @property
+    def storage_class(self):
+        return self.bucket.meta.get(self.name, {}).get("storage_class")
+
+    def _store(self, data):
+        self.bucket.objects[self.name] = data
+        self.bucket.meta[self.name] = {"time_created": datetime.now(timezone.utc), "storage_class": "STANDARD"}
+
+    def update_storage_class(self, new_class, timeout=None):
+        _sleep("gcs")
+        self._require()
+        self.bucket.meta.setdefault(self.name, {})["storage_class"] = new_class
+
+    @property
+    def crc32c(self):
+        import google_crc32c
+        data = self.bucket.objects.get(self.name)
+        if data is None:
+            return None
+        return base64.b64encode(google_crc32c.Checksum(data).digest()).decode("utf-8")
+
+    def exists(self, timeout=None):
+        _sleep("gcs")
+        return self.name in self.bucket.objects
+
+    def reload(self, timeout=None):
+        _sleep("gcs")
+        self._require()
+
+    def _require(self):
+        from google.api_core.exceptions import NotFound
+        if self.name not in self.bucket.objects:
+            raise NotFound(f"gs://{self.bucket.name}/{self.name}")
+        return self.bucket.objects[self.name]
+
+    def upload_from_string(self, data, content_type=None, timeout=None):
+        _sleep("gcs")
+        self._store(data.encode("utf-8") if isinstance(data, str) else bytes(data))
+
+    def upload_from_filename(self, filename, content_type=None, timeout=None):
+        with open(filename, "rb") as source:
+            self.upload_from_file(source, timeout=timeout)
+
+    def upload_from_file(self, file_obj, rewind=False, size=None, content_type=None, timeout=None, checksum=None):
+        _sleep("gcs")
+        if rewind:
+            file_obj.seek(0)
+        data = file_obj.read() if size is None else file_obj.read(size)
+        if GCS_STREAM_BYTES_PER_SECOND:
+            time.sleep(len(data) / GCS_STREAM_BYTES_PER_SECOND)
+        self._store(data)
+
+    def compose(self, sources, timeout=None):
+        _sleep("gcs")
+        if len(sources) > 32:
+            raise ValueError("compose accepts at most 32 source objects")
+        self._store(b"".join(source._require() for source in sources))
+
+    def download_as_bytes(self, start=None, end=None, timeout=None):
+        _sleep("gcs")
+        data = self._require()
+        if start is not None or end is not None:
+            return data[start or 0:(end + 1) if end is not None else None]
+        return data
+
+    def download_to_filename(self, filename, timeout=None):
+        data = self.download_as_bytes()
+        with open(filename, "wb") as target:
+            target.write(data)
+
+    def delete(self, timeout=None):
+        _sleep("gcs")
+        self._require()
+        del self.bucket.objects[self.name]
+        self.bucket.meta.pop(self.name, None)
+
+    def generate_signed_url(self, *args, **kwargs):
+        return f"http://localhost/fake-gcs/{self.bucket.name}/{self.name}?signature=loadtest"
+
+
+class FakeBucket:
+    def __init__(self, name):
+        self.name = name
+        self.objects = {}
+        self.meta = {}
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def get_blob(self, name):
+        return FakeBlob(self, name) if name in self.objects else None
+
+    def list_blobs(self, prefix=""):
+        return [FakeBlob(self, name) for name in list(self.objects) if name.startswith(prefix)]
+
+
+class FakeStorageClient:
+    buckets = {}
+    _lock = threading.Lock()
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def bucket(self, name):
+        with self._lock:
+            if name not in self.buckets:
+                self.buckets[name] = FakeBucket(name)
+            return self.buckets[name]
+
+    def list_blobs(self, bucket_name, prefix=""):
+        return self.bucket(bucket_name).list_blobs(prefix=prefix)
+
+
+class FakeSpeechClient:
+    """Unused when RECOGNIZER_BACKEND=local; present so module-level clients construct."""
+    def __init__(self, *args, **kwargs):
+        pass
+
+
+class FakeTranslateClient:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def translate(self, values, target_language=None, source_language=None, **kwargs):
+        _sleep("translate")
+        if isinstance(values, str):
+            return {"translatedText": f"[{target_language}] {values}"}
+        return [{"translatedText": f"[{target_language}] {value}"} for value in values]
+
+
+def write_synthetic_wav(path, video_id, seconds=None):
+    """Write deterministic 16 kHz mono audio whose tones depend on the video id."""
+    import numpy as np
+    seconds = seconds or AUDIO_SECONDS
+    rng = np.random.default_rng(zlib.crc32(video_id.encode("utf-8")))
+    step = SAMPLE_RATE // 4
+    t = np.arange(step) / SAMPLE_RATE
+    tones = rng.uniform(200, 4000, size=seconds * 4)
+    signal = 0.5 * np.sin(2 * np.pi * tones[:, None] * t[None, :]).reshape(-1)
+    signal += rng.uniform(-0.05, 0.05, size=signal.shape)
+    with wave.open(path, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(SAMPLE_RATE)
+        wav_file.writeframes((signal * 20000).astype("<i2").tobytes())
+
+
+class FakeYoutubeDL:
+    """Minimal yt_dlp.YoutubeDL: writes synthetic audio instead of downloading."""
+    _template_cache = {}
+    _lock = threading.Lock()
+
+    def __init__(self, params=None):
+        self.params = params or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    @staticmethod
+    def _video_id(url):
+        from urllib.parse import urlparse, parse_qs
+        parsed = urlparse(url)
+        return parse_qs(parsed.query).get("v", [parsed.path.strip("/")])[0]
+
+    def _formats(self):
+        return [
+            {"format_id": "139", "ext": "m4a", "acodec": "mp4a.40.5", "vcodec": "none", "abr": 48, "filesize": 600_000},
+            {"format_id": "249", "ext": "webm", "acodec": "opus", "vcodec": "none", "abr": 50, "filesize": 620_000},
+            {"format_id": "140", "ext": "m4a", "acodec": "mp4a.40.2", "vcodec": "none", "abr": 128, "filesize": 1_600_000},
+        ]
+
+    def extract_info(self, url, download=True):
+        _sleep("yt_dlp")
+        if "list=" in url and "v=" not in url:
+            return {"_type": "playlist", "entries": [{"id": f"pl{i:04d}"} for i in range(5)]}
+        video_id = self._video_id(url)
+        info = {
+            "id": video_id,
+            "webpage_url": url,
+            "title": f"Load test video {video_id}",
+            "duration": AUDIO_SECONDS,
+            "is_live": False,
+            "formats": self._formats(),
+            "subtitles": {},
+            "automatic_captions": {},
+        }
+        if video_id.startswith("cap"):
+            # Videos whose id starts with "cap" have an uploader-provided English track.
+            info["subtitles"] = {"en": [
+                {"ext": "vtt", "url": f"https://fake-youtube/captions/{video_id}.vtt"},
+                {"ext": "json3", "url": f"https://fake-youtube/captions/{video_id}.json3"},
+            ]}
+        if video_id.startswith("live"):
+            info["is_live"] = True
+        if video_id.startswith("long"):
+            info["duration"] = 24 * 3600
+        if download:
+            self.download([url])
+        return info
+
+    def process_ie_result(self, info, download=True):
+        if download:
+            self.download([info.get("webpage_url") or info["id"]])
+        return info
+
+    def urlopen(self, url):
+        import io
+        _sleep("yt_dlp")
+        events = [
+            {"tStartMs": i * 2000, "dDurationMs": 1800,
+             "segs": [{"utf8": f"caption line {i} for the load test video"}]}
+            for i in range(AUDIO_SECONDS // 2)
+        ]
+        return io.BytesIO(json.dumps({"events": events}).encode("utf-8"))
+
+    def download(self, urls):
+        for url in urls:
+            _sleep("yt_dlp")
+            video_id = self._video_id(url)
+            path = self.params["outtmpl"]
+            if isinstance(path, dict):
+                path = path["default"]
+            with self._lock:
+                template = self._template_cache.get(video_id)
+                if template is None:
+                    template = os.path.join(tempfile.gettempdir(), f"loadtest-{video_id}.wav")
+                    write_synthetic_wav(template, video_id)
+                    self._template_cache[video_id] = template
+            shutil.copyfile(template, path)
+            size = os.path.getsize(path)
+            for hook in self.params.get("progress_hooks", []):
+                hook({"status": "finished", "total_bytes": size, "elapsed": LATENCY_SECONDS["yt_dlp"],
+                      "filename": path, "info_dict": {"format_id": "139"}})
+        return 0
+
+
+def fake_convert_audio_to_wav(input_path, output_path):
+    """The fake download already produces 16 kHz mono WAV, so conversion is a copy."""
+    shutil.copyfile(input_path, output_path)
+
+
+class FakeAsyncCollection:
+    """Awaitable facade over a mongomock collection for pymongo.AsyncMongoClient callers."""
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        method = getattr(self._collection, name)
+
+        async def run(*args, **kwargs):
+            return method(*args, **kwargs)
+        return run
+
+
+class FakeAsyncMongoClient:
+    def __init__(self, client):
+        self._client = client
+
+    def __getitem__(self, db_name):
+        database = self._client[db_name]
+
+        class Database:
+            def __getitem__(self, collection_name):
+                return FakeAsyncCollection(database[collection_name])
+        return Database()
+
+
+_mongo_client = None
+
+
+def install(mongo_uri=None, workdir=None):
+    """
+    Patch client libraries and prepare a working directory with config.json.
+    With `mongo_uri` the functions talk to a real (local) mongod; otherwise
+    every MongoClient shares one mongomock instance.
+    """
+    global _mongo_client
+    os.environ["RECOGNIZER_BACKEND"] = "local"
+    os.environ.setdefault("LOCAL_RECOGNIZER_AUDIO_SECONDS", str(AUDIO_SECONDS))
+    os.environ.setdefault("LOCAL_RECOGNIZER_POLL_LATENCY", str(LATENCY_SECONDS["speech"]))
+
+    from google.oauth2 import service_account
+    from google.cloud import storage, speech_v1, speech_v1p1beta1, translate_v2
+    import pymongo
+    import yt_dlp
+
+    service_account.Credentials = FakeCredentials
+    storage.Client = FakeStorageClient
+    speech_v1.SpeechClient = FakeSpeechClient
+    speech_v1p1beta1.SpeechClient = FakeSpeechClient
+    translate_v2.Client = FakeTranslateClient
+    yt_dlp.YoutubeDL = FakeYoutubeDL
+
+    if mongo_uri:
+        os.environ["MONGO_URI"] = mongo_uri
+    else:
+        import mongomock
+        _mongo_client = mongomock.MongoClient()
+        pymongo.MongoClient = lambda *args, **kwargs: _mongo_client
+        pymongo.AsyncMongoClient = lambda *args, **kwargs: FakeAsyncMongoClient(_mongo_client)
+        os.environ["MONGO_URI"] = "mongodb://loadtest"
+
+    workdir = workdir or tempfile.mkdtemp(prefix="loadtest-")
+    # The transcript disk cache outlives a run; stale entries would hide the fake bucket.
+    os.environ["TRANSCRIPT_CACHE_DIR"] = os.path.join(workdir, "transcripts")
+    with open(os.path.join(workdir, "config.json"), "w") as config_file:
+        json.dump({"MONGO_URI": os.environ["MONGO_URI"], "GCS_BUCKET_NAME": "tube_genius"}, config_file)
+    os.chdir(workdir)
+    return workdir
+
+
+FUNCTION_MODULES = (
+    "main", "task_process", "helper", "recognizer", "resilience", "subtitle_cache", "profiling", "checkpoints", "eta", "stt_scheduler", "async_status", "captions",
+    "transcript_store", "workspace", "fingerprint", "video_metadata", "language_detection", "object_lifecycle", "prefetch",
+)
+
+
+def load_function(source_dir, target):
+    """
+    Import a Cloud Function directory and return its handler.
+    Both functions use the same module names, so each is imported in isolation
+    and its modules are taken out of sys.modules afterwards.
+    """
+    source_dir = os.path.abspath(source_dir)
+    stale = {name for name in sys.modules if name in FUNCTION_MODULES or name.split(".")[0] in FUNCTION_MODULES}
+    for name in stale:
+        del sys.modules[name]
+    sys.path.insert(0, source_dir)
+    try:
+        main = importlib.import_module("main")
+        modules = {name: sys.modules[name] for name in list(sys.modules) if name in FUNCTION_MODULES}
+    finally:
+        sys.path.remove(source_dir)
+        for name in list(sys.modules):
+            if name in FUNCTION_MODULES:
+                del sys.modules[name]
+    if "task_process" in modules and hasattr(modules["task_process"], "convert_audio_to_wav"):
+        modules["task_process"].convert_audio_to_wav = fake_convert_audio_to_wav
+    return getattr(main, target), modules
@@ -0,0 +1,297 @@
+"""
+Concurrent load generator for the start_transcription and subtitle_task_status functions.
+
+Runs both handlers against the local stand-ins in loadtest/fakes.py, either
+in-process or behind a local HTTP server, replays a weighted request mix at
+increasing concurrency and reports throughput and p50/p95/p99 latency per route.
+
+    python loadtest/harness.py --concurrency 1,8,32 --requests 400 \
+        --mix cache_hit=3,new_video=1,hot_poll=4,finished=2
+
+--status-handler async drives subtitle_task_status_async on one event loop
+instead of one thread per request (in-process only), for comparing the two:
+
+    python loadtest/harness.py --mix hot_poll=4,finished=1 --concurrency 64,512,2048 \
+        --requests 4000 --status-handler async
+
+mongomock has no indexes, so fingerprint lookups on new_video slow down as the
+index grows; pass --mongo-uri mongodb://localhost:27017/loadtest for numbers
+that reflect a real database.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import itertools
+import threading
+import urllib.request
+from datetime import datetime
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fakes
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUCKET_NAME = "tube_genius"
+USER_ID = "677e9bb7eb111b87ea1893d2"
+SEED_VIDEOS = 50
+ROUTES = {
+    "cache_hit": "start_transcription",
+    "new_video": "start_transcription",
+    "hot_poll": "subtitle_task_status",
+    "finished": "subtitle_task_status",
+}
+
+
+class FakeRequest:
+    """The subset of flask.Request the handlers use."""
+    def __init__(self, payload, method="POST", headers=None):
+        self.method = method
+        self.headers = headers or {}
+        self.args = {}
+        self._payload = payload
+
+    def get_json(self, silent=False):
+        return self._payload
+
+    async def json(self):
+        return self._payload
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        fakes.LATENCY_SECONDS.update({
+            "gcs": args.gcs_latency_ms / 1000.0,
+            "translate": args.translate_latency_ms / 1000.0,
+            "yt_dlp": args.yt_dlp_latency_ms / 1000.0,
+        })
+        fakes.install(mongo_uri=args.mongo_uri)
+        self.handlers = {}
+        self.modules = {}
+        for name, directory in (("start_transcription", "start_transcription"),
+                                ("subtitle_task_status", "subtitle-task-status")):
+            handler, modules = fakes.load_function(os.path.join(REPO_ROOT, directory), name)
+            self.handlers[name] = handler
+            self.modules[name] = modules
+        self.async_status = self.modules["subtitle_task_status"]["main"].subtitle_task_status_async
+        self.counter = itertools.count()
+        self.counter_lock = threading.Lock()
+        self.server = None
+        self.base_url = None
+        self.seed()
+        if args.transport == "http":
+            self.start_http_server()
+
+    def next_id(self):
+        with self.counter_lock:
+            return next(self.counter)
+
+    def seed(self):
+        """Create a subscribed user, finished tasks with subtitles, and long-running tasks."""
+        task_process = self.modules["start_transcription"]["task_process"]
+        db = task_process.db
+        db.users.delete_many({})
+        db.users.insert_one({
+            "_id": task_process.ObjectId(USER_ID),
+            "issubscribed": True,
+            "coins": 10 ** 12,
+        })
+        bucket = fakes.FakeStorageClient().bucket(BUCKET_NAME)
+        recognizer = self.modules["subtitle_task_status"]["recognizer"]
+        never_done = recognizer.LocalRecognizer(latency="fixed:86400")
+
+        collection = task_process.collection
+        for i in range(SEED_VIDEOS):
+            video_id = f"done{i:05d}"
+            bucket.blob(f"subtitles/{video_id}_en_hi.vtt").upload_from_string(
+                "WEBVTT\n\n1\n00:00:00.000 --> 00:00:02.000\n[hi] hello\n\n"
+            )
+            collection.insert_one({
+                "task_id": f"finished-{i}", "video_id": video_id, "source_language": "en",
+                "target_language": "hi", "operation_id": f"done-{i}", "status": "completed",
+                "created_at": datetime.now(),
+            })
+            collection.insert_one({
+                "task_id": f"polling-{i}", "video_id": f"poll{i:05d}", "source_language": "en",
+                "target_language": "hi", "status": "in_progress", "created_at": datetime.now(),
+                "operation_id": never_done.submit(f"gs://{BUCKET_NAME}/audio/poll{i:05d}.wav", "en-US"),
+            })
+
+    def start_http_server(self):
+        from flask import Flask, request
+        from werkzeug.serving import make_server
+
+        app = Flask("loadtest")
+        for name, handler in self.handlers.items():
+            app.add_url_rule(f"/{name}", name, (lambda h: lambda: h(request))(handler), methods=["POST", "OPTIONS"])
+        self.server = make_server("127.0.0.1", self.args.port, app, threaded=True)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.args.port}"
+
+    def build_request(self, scenario):
+        i = random.randrange(SEED_VIDEOS)
+        if scenario == "cache_hit":
+            return {"task_id": f"hit-{self.next_id()}", "video_url": f"https://www.youtube.com/watch?v=done{i:05d}",
+                    "user_id": USER_ID, "source_language": "en", "target_language": "hi"}
+        if scenario == "new_video":
+            n = self.next_id()
+            return {"task_id": f"new-{n}", "video_url": f"https://www.youtube.com/watch?v=new{n:07d}",
+                    "user_id": USER_ID, "source_language": "en", "target_language": "hi"}
+        if scenario == "hot_poll":
+            return {"task_id": f"polling-{i}"}
+        return {"task_id": f"finished-{i}"}
+
+    def send(self, route, payload):
+        if self.base_url:
+            body = json.dumps(payload).encode("utf-8")
+            http_request = urllib.request.Request(
+                f"{self.base_url}/{route}", data=body, headers={"Content-Type": "application/json"}
+            )
+            try:
+                with urllib.request.urlopen(http_request, timeout=120) as response:
+                    response.read()
+                    return response.status
+            except urllib.error.HTTPError as e:
+                return e.code
+        result = self.handlers[route](FakeRequest(payload))
+        return result[1] if isinstance(result, tuple) else 200
+
+    def run_level(self, concurrency, scenarios, weights):
+        latencies = defaultdict(list)
+        errors = defaultdict(int)
+        lock = threading.Lock()
+        plan = random.choices(scenarios, weights=weights, k=self.args.requests)
+        peak_threads = [threading.active_count()]
+
+        def one(scenario):
+            route = ROUTES[scenario]
+            payload = self.build_request(scenario)
+            started = time.perf_counter()
+            status = self.send(route, payload)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies[scenario].append(elapsed)
+                if status >= 500:
+                    errors[scenario] += 1
+                peak_threads[0] = max(peak_threads[0], threading.active_count())
+
+        async def one_async(scenario, slots):
+            async with slots:
+                route = ROUTES[scenario]
+                payload = self.build_request(scenario)
+                started = time.perf_counter()
+                if route == "subtitle_task_status":
+                    status = (await self.async_status(FakeRequest(payload))).status_code
+                else:
+                    # One thread per start request, as in the sync mode and in production.
+                    status = await asyncio.get_running_loop().run_in_executor(
+                        start_executor, self.send, route, payload
+                    )
+                elapsed = time.perf_counter() - started
+                latencies[scenario].append(elapsed)
+                if status >= 500:
+                    errors[scenario] += 1
+                peak_threads[0] = max(peak_threads[0], threading.active_count())
+
+        async def run_async():
+            slots = asyncio.Semaphore(concurrency)
+            await asyncio.gather(*(one_async(scenario, slots) for scenario in plan))
+
+        started = time.perf_counter()
+        if self.args.status_handler == "async":
+            with ThreadPoolExecutor(max_workers=concurrency) as start_executor:
+                asyncio.run(run_async())
+        else:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                list(executor.map(one, plan))
+        wall = time.perf_counter() - started
+
+        report = {"concurrency": concurrency, "status_handler": self.args.status_handler,
+                  "wall_seconds": round(wall, 3), "throughput_rps": round(len(plan) / wall, 2),
+                  "peak_threads": peak_threads[0], "routes": {}}
+        for scenario, samples in sorted(latencies.items()):
+            report["routes"][scenario] = {
+                "route": ROUTES[scenario],
+                "requests": len(samples),
+                "errors": errors[scenario],
+                "throughput_rps": round(len(samples) / wall, 2),
+                "p50_ms": round(percentile(samples, 0.50) * 1000, 2),
+                "p95_ms": round(percentile(samples, 0.95) * 1000, 2),
+                "p99_ms": round(percentile(samples, 0.99) * 1000, 2),
+            }
+        return report
+
+    def close(self):
+        if self.server:
+            self.server.shutdown()
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ROUTES:
+            raise SystemExit(f"Unknown scenario {name!r}; choose from {', '.join(ROUTES)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def print_report(report):
+    print(f"\nconcurrency={report['concurrency']}  status_handler={report['status_handler']}  "
+          f"{report['throughput_rps']} req/s  ({report['wall_seconds']}s, peak {report['peak_threads']} threads)")
+    print(f"  {'scenario':<10} {'route':<22} {'reqs':>6} {'err':>4} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for scenario, row in report["routes"].items():
+        print(f"  {scenario:<10} {row['route']:<22} {row['requests']:>6} {row['errors']:>4} {row['throughput_rps']:>8} "
+              f"{row['p50_ms']:>9} {row['p95_ms']:>9} {row['p99_ms']:>9}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transport", choices=("inproc", "http"), default="inproc")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--status-handler", choices=("sync", "async"), default="sync")
+    parser.add_argument("--concurrency", default="1,4,16,64", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="requests per concurrency level")
+    parser.add_argument("--mix", default="cache_hit=3,new_video=1,hot_poll=4,finished=2")
+    parser.add_argument("--mongo-uri", default=None, help="use a local mongod instead of mongomock")
+    parser.add_argument("--gcs-latency-ms", type=float, default=15)
+    parser.add_argument("--translate-latency-ms", type=float, default=40)
+    parser.add_argument("--yt-dlp-latency-ms", type=float, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", dest="json_path", help="also write the reports to this file")
+    args = parser.parse_args(argv)
+    if args.status_handler == "async" and args.transport == "http":
+        parser.error("--status-handler async runs in-process only")
+
+    random.seed(args.seed)
+    mix = parse_mix(args.mix)
+    load_test = LoadTest(args)
+    reports = []
+    try:
+        for concurrency in [int(level) for level in args.concurrency.split(",")]:
+            report = load_test.run_level(concurrency, list(mix), list(mix.values()))
+            print_report(report)
+            reports.append(report)
+    finally:
+        load_test.close()
+
+    if args.json_path:
+        with open(args.json_path, "w") as output:
+            json.dump(reports, output, indent=2)
+    return reports
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Run the audio/subtitle eviction job offline against the in-memory GCS stand-in.
+
+The bucket is seeded with audio, transcripts and subtitles of assorted ages;
+some objects are hit through check_audio_exists / check_subtitle_exists so the
+access log sees them, and one cold video still has a recognition job running.
+Some subtitles have no stored transcript to re-render them from. The job runs as
+a dry run first, then for real, and the run fails if it touched a transcript, a
+hot object, audio that recognition still needs or subtitles it could not re-render.
+
+    python loadtest/lifecycle_sim.py --videos 200 --audio-action delete
+"""
+import os
+import sys
+import json
+import random
+import argparse
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fakes
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUCKET_NAME = "tube_genius"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--videos", type=int, default=200)
+    parser.add_argument("--audio-bytes", type=int, default=256 * 1024, help="size of each seeded WAV")
+    parser.add_argument("--max-age-days", type=float, default=180)
+    parser.add_argument("--transcribed", type=float, default=0.8, help="share of videos with a stored transcript")
+    parser.add_argument("--hot", type=float, default=0.2, help="share of videos requested again just now")
+    parser.add_argument("--audio-action", default="delete", choices=["delete", "nearline", "coldline", "archive"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", dest="json_path")
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    for dependency in fakes.LATENCY_SECONDS:
+        fakes.LATENCY_SECONDS[dependency] = 0
+    fakes.install()
+    _, modules = fakes.load_function(os.path.join(REPO_ROOT, "start_transcription"), "start_transcription")
+    task_process = modules["task_process"]
+    lifecycle = modules["object_lifecycle"]
+    bucket = task_process.storage_client.bucket(BUCKET_NAME)
+    db = task_process.db
+    now = datetime.now(timezone.utc)
+
+    def seed(name, data, age_days):
+        bucket.blob(name).upload_from_string(data)
+        bucket.meta[name]["time_created"] = now - timedelta(days=age_days)
+
+    videos = []
+    for index in range(args.videos):
+        video_id = f"life{index:05d}"
+        age = random.uniform(0, args.max_age_days)
+        transcribed = random.random() < args.transcribed
+        hot = random.random() < args.hot
+        videos.append({"video_id": video_id, "age": age, "transcribed": transcribed, "hot": hot})
+        seed(f"audio/{video_id}.wav", os.urandom(args.audio_bytes), age)
+        if transcribed:
+            seed(f"transcripts/{video_id}_en.tsw", b"TSW1" + os.urandom(2048), age)
+            seed(f"subtitles/{video_id}_en_hi.vtt", b"WEBVTT\n\n" + os.urandom(4096), age)
+        else:
+            # e.g. rendered from an STT operation that has since expired
+            seed(f"subtitles/{video_id}_en_es.vtt", b"WEBVTT\n\n" + os.urandom(4096), age)
+        if hot:
+            task_process.check_audio_exists(BUCKET_NAME, video_id)
+            if transcribed:
+                task_process.check_subtitle_exists(BUCKET_NAME, video_id, "en", "hi")
+
+    # A cold, transcribed video whose audio is being recognized again, e.g. for another language.
+    busy = next((video for video in videos if video["transcribed"] and not video["hot"] and video["age"] > 60), None)
+    if busy:
+        db["SttQueue"].insert_one({"task_id": "busy", "state": "inflight",
+                                   "gcs_uri": f"gs://{BUCKET_NAME}/audio/{busy['video_id']}.wav"})
+
+    stt_queue = db["SttQueue"]
+    dry_report, plan = lifecycle.run_eviction(bucket, task_process.access_log, stt_queue, dry_run=True,
+                                              audio_action=args.audio_action)
+    before = {name: len(data) for name, data in bucket.objects.items()}
+    report, _ = lifecycle.run_eviction(bucket, task_process.access_log, stt_queue, dry_run=False,
+                                       audio_action=args.audio_action)
+    after_report, _ = lifecycle.run_eviction(bucket, task_process.access_log, stt_queue, dry_run=True,
+                                             audio_action=args.audio_action)
+
+    violations = []
+    for video in videos:
+        audio = f"audio/{video['video_id']}.wav"
+        if video["transcribed"] and f"transcripts/{video['video_id']}_en.tsw" not in bucket.objects:
+            violations.append(f"transcript of {video['video_id']} was removed")
+        if video["hot"] and audio not in bucket.objects:
+            violations.append(f"hot audio {audio} was removed")
+        if not video["transcribed"] and audio not in bucket.objects:
+            violations.append(f"untranscribed audio {audio} was removed")
+        if not video["transcribed"] and f"subtitles/{video['video_id']}_en_es.vtt" not in bucket.objects:
+            violations.append(f"subtitles of {video['video_id']} without a transcript were removed")
+    if busy and f"audio/{busy['video_id']}.wav" not in bucket.objects:
+        violations.append("audio still being recognized was removed")
+
+    removed_bytes = sum(size for name, size in before.items() if name not in bucket.objects)
+    result = {
+        "dry_run": dry_report,
+        "applied": report["applied"],
+        "removed_bytes": removed_bytes,
+        "bytes_before": sum(before.values()),
+        "bytes_after": sum(len(data) for data in bucket.objects.values()),
+        "reclaimable_after": after_report["reclaimable_bytes"],
+        "violations": violations,
+    }
+    print(json.dumps(result, indent=2))
+    if args.json_path:
+        with open(args.json_path, "w") as output:
+            json.dump(result, output, indent=2)
+    if violations or removed_bytes != dry_report["reclaimable_bytes"] or after_report["reclaimable_bytes"]:
+        raise SystemExit("Eviction did not match its dry run or removed objects it should have kept")
+    return result
+
+
+if __name__ == "__main__":
+    main()
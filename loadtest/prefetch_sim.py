@@ -0,0 +1,156 @@
+"""
+Simulate off-peak prefetching against the local stand-ins.
+
+SubtitledVideos is seeded with a request history: a few popular videos requested
+many times and a long tail requested once; an admin also submits a video. While
+some user jobs occupy STT slots, the prefetch runner ticks until its queue is
+drained, polling its tasks through the real status function. Then a burst of
+user requests for the popular videos in the common languages is replayed, and
+the report shows how many landed on the check_subtitle_exists fast path, the
+prefetch hit rate and how much of the spare STT capacity prefetch used.
+
+    python loadtest/prefetch_sim.py --popular 8 --long-tail 30 --user-jobs 3
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fakes
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUCKET_NAME = "tube_genius"
+
+
+class Request:
+    def __init__(self, payload):
+        self.method = "POST"
+        self.payload = payload
+
+    def get_json(self, silent=False):
+        return self.payload
+
+
+def video_url(video_id):
+    return f"https://www.youtube.com/watch?v={video_id}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--popular", type=int, default=8, help="videos requested repeatedly")
+    parser.add_argument("--long-tail", type=int, default=30, help="videos requested once")
+    parser.add_argument("--requests-per-popular", type=int, default=5)
+    parser.add_argument("--user-jobs", type=int, default=3, help="user STT jobs running while prefetch starts")
+    parser.add_argument("--max-inflight", type=int, default=6)
+    parser.add_argument("--latency", default="uniform:0.2,0.5", help="recognizer latency distribution")
+    parser.add_argument("--tick", type=float, default=0.1)
+    parser.add_argument("--max-ticks", type=int, default=600)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", dest="json_path")
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    os.environ["LOCAL_RECOGNIZER_LATENCY"] = args.latency
+    os.environ["LANGUAGE_DETECTION_ENABLED"] = "0"
+    for dependency in fakes.LATENCY_SECONDS:
+        fakes.LATENCY_SECONDS[dependency] /= 10
+    fakes.install()
+    _, start = fakes.load_function(os.path.join(REPO_ROOT, "start_transcription"), "start_transcription")
+    status_handler, _ = fakes.load_function(os.path.join(REPO_ROOT, "subtitle-task-status"), "subtitle_task_status")
+    task_process = start["task_process"]
+    prefetch = start["prefetch"]
+    scheduler = task_process.stt_scheduler
+    scheduler.max_inflight = args.max_inflight
+    db = task_process.db
+
+    # Request history
+    now = datetime.now()
+    popular = [f"pop{index:03d}" for index in range(args.popular)]
+    for video_id in popular:
+        for index in range(args.requests_per_popular):
+            task_process.collection.insert_one({
+                "task_id": f"hist-{video_id}-{index}", "video_id": video_id, "video_url": video_url(video_id),
+                "user_id": f"user{index}", "source_language": "en", "target_language": "hi",
+                "status": "completed", "created_at": now - timedelta(hours=random.uniform(0, 24)),
+            })
+    for index in range(args.long_tail):
+        video_id = f"tail{index:03d}"
+        task_process.collection.insert_one({
+            "task_id": f"hist-{video_id}", "video_id": video_id, "video_url": video_url(video_id),
+            "user_id": "user0", "source_language": "en", "target_language": "hi",
+            "status": "completed", "created_at": now - timedelta(hours=random.uniform(0, 24)),
+        })
+
+    queue = task_process.prefetch_queue
+    seeded = queue.seed_from_requests(task_process.collection)
+    queue.add("admin001", video_url("admin001"), "en", ["hi", "es"], prefetch.PREFETCH_ADMIN_SCORE, "admin")
+
+    # User jobs holding STT slots while prefetch starts
+    for index in range(args.user_jobs):
+        task_id = f"user-job-{index}"
+        task_process.collection.insert_one({"task_id": task_id, "status": "processing"})
+        scheduler.enqueue(task_id, "someuser", f"gs://{BUCKET_NAME}/audio/userjob{index}.wav", "en-US",
+                          audio_seconds=60)
+    scheduler.dispatch()
+
+    def poll_status(task_id):
+        body, _, _ = status_handler(Request({"task_id": task_id}))
+        return json.loads(body)
+
+    runner = prefetch.PrefetchRunner(
+        queue, scheduler, task_process.process_youtube_audio, task_process.check_subtitle_exists,
+        poll_status, BUCKET_NAME
+    )
+    started = time.monotonic()
+    ticks = 0
+    while ticks < args.max_ticks:
+        for job in db["SttQueue"].find({"state": "inflight", "user_id": "someuser"}):
+            if task_process.recognizer.poll(job["operation_id"])["done"]:
+                scheduler.release(job["operation_id"])
+        runner.tick()
+        ticks += 1
+        if not queue.collection.count_documents({"state": {"$in": ["candidate", *prefetch.ACTIVE_STATES]}}):
+            break
+        time.sleep(args.tick)
+    prefetch_seconds = time.monotonic() - started
+
+    # Burst of user requests after prefetching
+    targets = prefetch.PREFETCH_TARGET_LANGUAGES
+    burst = [(video_id, target) for video_id in popular + ["admin001"] for target in targets if target != "en"]
+    burst += [(f"tail{index:03d}", "es") for index in range(min(5, args.long_tail))]
+    latencies = {"fast_path": [], "cold": []}
+    for index, (video_id, target) in enumerate(burst):
+        request_started = time.monotonic()
+        result = task_process.process_youtube_audio(
+            video_url(video_id), BUCKET_NAME, "en", target, "65f000000000000000000001", f"burst-{index}"
+        )
+        path = "fast_path" if result.get("message") == "Audio already exists." else "cold"
+        latencies[path].append(time.monotonic() - request_started)
+    fast_path = len(latencies["fast_path"])
+
+    report = {
+        "seeded_candidates": seeded,
+        "prefetch_ticks": ticks,
+        "prefetch_seconds": round(prefetch_seconds, 2),
+        "burst_requests": len(burst),
+        "burst_fast_path": fast_path,
+        "burst_fast_path_rate": round(fast_path / len(burst), 3),
+        "burst_mean_latency_ms": {
+            path: round(1000 * sum(samples) / len(samples), 1) if samples else None
+            for path, samples in latencies.items()
+        },
+        "prefetch": queue.report(),
+    }
+    print(json.dumps(report, indent=2))
+    if args.json_path:
+        with open(args.json_path, "w") as output:
+            json.dump(report, output, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Simulate the STT submission scheduler against the local recognizer with a quota.
+
+One heavy user floods the queue with a bulk upload while light users trickle in
+short jobs. Jobs are released and dispatched the way subtitle_task_status does
+when it sees an operation finish. The report shows each user's queue wait and
+the peak number of running operations; the run fails if the global limit or the
+recognizer quota is exceeded.
+
+    python loadtest/scheduler_sim.py --quota 8 --max-inflight 6 --heavy-jobs 60
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fakes
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quota", type=int, default=8, help="recognizer concurrent-operation quota")
+    parser.add_argument("--max-inflight", type=int, default=6, help="scheduler global in-flight limit")
+    parser.add_argument("--latency", default="uniform:0.2,0.6", help="recognizer latency distribution")
+    parser.add_argument("--heavy-jobs", type=int, default=60)
+    parser.add_argument("--light-users", type=int, default=4)
+    parser.add_argument("--light-jobs", type=int, default=5)
+    parser.add_argument("--light-delay", type=float, default=0.5, help="seconds before light users arrive")
+    parser.add_argument("--tick", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", dest="json_path")
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    fakes.install()
+    _, modules = fakes.load_function(os.path.join(REPO_ROOT, "subtitle-task-status"), "subtitle_task_status")
+    task_process = modules["task_process"]
+    recognizer = modules["recognizer"].LocalRecognizer(latency=args.latency, quota=args.quota)
+    db = task_process.db
+    for name in ("SttQueue", "SttSlots", "SubtitledVideos"):
+        db[name].delete_many({})
+    scheduler = modules["stt_scheduler"].SttScheduler(
+        db["SttQueue"], db["SttSlots"], db["SubtitledVideos"], recognizer, max_inflight=args.max_inflight
+    )
+
+    quota_errors = [0]
+    submit = recognizer.submit
+
+    def counting_submit(*submit_args, **kwargs):
+        try:
+            return submit(*submit_args, **kwargs)
+        except Exception:
+            quota_errors[0] += 1
+            raise
+    recognizer.submit = counting_submit
+
+    def enqueue(user, index, audio_seconds, subscribed):
+        task_id = f"{user}-{index}"
+        db["SubtitledVideos"].insert_one({"task_id": task_id, "status": "processing"})
+        scheduler.enqueue(task_id, user, f"gs://sim/audio/{task_id}.wav", "en-US",
+                          audio_seconds=audio_seconds, subscribed=subscribed)
+
+    started = time.monotonic()
+    for index in range(args.heavy_jobs):
+        enqueue("heavy", index, random.uniform(1200, 3600), subscribed=True)
+    pending_light = [
+        (f"light{user}", index, random.uniform(60, 900), user % 2 == 0)
+        for user in range(args.light_users) for index in range(args.light_jobs)
+    ]
+
+    peak_running = 0
+    total = args.heavy_jobs + len(pending_light)
+    scheduler.dispatch()
+    while db["SttQueue"].count_documents({"state": "done"}) < total:
+        if pending_light and time.monotonic() - started >= args.light_delay:
+            for job in pending_light:
+                enqueue(*job)
+            pending_light = []
+            scheduler.dispatch()
+        for job in db["SttQueue"].find({"state": "inflight"}):
+            if recognizer.poll(job["operation_id"])["done"] and scheduler.release(job["operation_id"]):
+                scheduler.dispatch()
+        peak_running = max(peak_running, recognizer.running_operations())
+        time.sleep(args.tick)
+
+    waits = defaultdict(list)
+    for job in db["SttQueue"].find({}):
+        user = "heavy" if job["user_id"] == "heavy" else "light"
+        waits[user].append((job["submitted_at"] - job["enqueued_at"]).total_seconds())
+    report = {
+        "wall_seconds": round(time.monotonic() - started, 2),
+        "max_inflight": args.max_inflight,
+        "quota": args.quota,
+        "peak_running": peak_running,
+        "quota_errors": quota_errors[0],
+        "users": {
+            user: {
+                "jobs": len(samples),
+                "mean_wait_seconds": round(sum(samples) / len(samples), 3),
+                "max_wait_seconds": round(max(samples), 3),
+            }
+            for user, samples in waits.items()
+        },
+    }
+    print(json.dumps(report, indent=2))
+    if args.json_path:
+        with open(args.json_path, "w") as output:
+            json.dump(report, output, indent=2)
+
+    limit = min(args.max_inflight, args.quota)
+    if peak_running > limit or (args.max_inflight <= args.quota and quota_errors[0]):
+        raise SystemExit("Scheduler exceeded its in-flight limit or the recognizer quota")
+    return report
+
+
+if __name__ == "__main__":
+    main()
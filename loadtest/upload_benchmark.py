@@ -0,0 +1,125 @@
+"""
+Benchmark single-stream against parallel composite uploads of start_transcription.helper.upload_to_gcs.
+
+By default it runs against the in-memory GCS stand-in from loadtest/fakes.py with a
+per-stream bandwidth cap. Pass --emulator-host to target a local GCS emulator instead,
+for example fake-gcs-server:
+
+    docker run -d -p 4443:4443 fsouza/fake-gcs-server -scheme http
+    python loadtest/upload_benchmark.py --emulator-host http://localhost:4443 \
+        --sizes 16M,128M,512M --concurrency 1,4,8,16
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fakes
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUCKET_NAME = "tube_genius"
+UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+
+def parse_size(spec):
+    spec = spec.strip().upper()
+    if spec[-1] in UNITS:
+        return int(float(spec[:-1]) * UNITS[spec[-1]])
+    return int(spec)
+
+
+def load_helper(args):
+    """Import start_transcription's helper against the fakes or the emulator."""
+    fakes.LATENCY_SECONDS["gcs"] = args.gcs_latency_ms / 1000.0
+    fakes.GCS_STREAM_BYTES_PER_SECOND = args.stream_mbps * 1024 * 1024 / 8
+    fakes.install()
+    sys.path.insert(0, os.path.join(REPO_ROOT, "start_transcription"))
+    import helper
+
+    if args.emulator_host:
+        from google.auth.credentials import AnonymousCredentials
+        from google.cloud import storage
+        import importlib
+        os.environ["STORAGE_EMULATOR_HOST"] = args.emulator_host
+        real_storage = importlib.reload(storage)
+        helper.storage_client = real_storage.Client(project="loadtest", credentials=AnonymousCredentials())
+        try:
+            helper.storage_client.create_bucket(BUCKET_NAME)
+        except Exception:
+            pass  # already exists
+    return helper
+
+
+def write_file(directory, size):
+    path = os.path.join(directory, f"audio-{size}.bin")
+    with open(path, "wb") as target:
+        remaining = size
+        while remaining:
+            chunk = os.urandom(min(remaining, 8 * 1024 * 1024))
+            target.write(chunk)
+            remaining -= len(chunk)
+    return path
+
+
+def time_upload(helper, path, mode, concurrency, part_size, repeat):
+    if mode == "single":
+        helper.COMPOSITE_UPLOAD_THRESHOLD_BYTES = float("inf")
+    else:
+        helper.COMPOSITE_UPLOAD_THRESHOLD_BYTES = 0
+        helper.COMPOSITE_UPLOAD_CONCURRENCY = concurrency
+        helper.COMPOSITE_UPLOAD_PART_BYTES = part_size
+    samples = []
+    for attempt in range(repeat):
+        started = time.perf_counter()
+        uri = helper.upload_to_gcs(BUCKET_NAME, path, f"benchmark/{os.path.basename(path)}-{mode}-{concurrency}")
+        samples.append(time.perf_counter() - started)
+        if uri is None:
+            raise SystemExit(f"Upload failed for {path} ({mode}, concurrency={concurrency})")
+    return min(samples)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="8M,64M,256M", help="comma-separated file sizes")
+    parser.add_argument("--concurrency", default="1,4,8,16", help="comma-separated part concurrency levels")
+    parser.add_argument("--part-size", default="8M")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per cell; the fastest is reported")
+    parser.add_argument("--emulator-host", default=None, help="GCS emulator endpoint, e.g. http://localhost:4443")
+    parser.add_argument("--stream-mbps", type=float, default=400, help="per-stream bandwidth of the in-memory stand-in")
+    parser.add_argument("--gcs-latency-ms", type=float, default=20, help="per-request latency of the in-memory stand-in")
+    parser.add_argument("--json", dest="json_path", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    helper = load_helper(args)
+    part_size = parse_size(args.part_size)
+    levels = [int(level) for level in args.concurrency.split(",")]
+    results = []
+    with tempfile.TemporaryDirectory(prefix="upload-benchmark-") as directory:
+        print(f"  {'size':>10} {'mode':<10} {'conc':>5} {'seconds':>9} {'MB/s':>8} {'speedup':>8}")
+        for size in [parse_size(spec) for spec in args.sizes.split(",")]:
+            path = write_file(directory, size)
+            baseline = time_upload(helper, path, "single", 1, part_size, args.repeat)
+            rows = [("single", 1, baseline)]
+            rows += [("composite", level, time_upload(helper, path, "composite", level, part_size, args.repeat))
+                     for level in levels]
+            for mode, concurrency, seconds in rows:
+                row = {
+                    "size_bytes": size, "mode": mode, "concurrency": concurrency, "seconds": round(seconds, 3),
+                    "mb_per_second": round(size / seconds / 1024 ** 2, 1), "speedup": round(baseline / seconds, 2),
+                }
+                results.append(row)
+                print(f"  {size:>10} {mode:<10} {concurrency:>5} {row['seconds']:>9} "
+                      f"{row['mb_per_second']:>8} {row['speedup']:>8}")
+            os.remove(path)
+
+    if args.json_path:
+        with open(args.json_path, "w") as output:
+            json.dump(results, output, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import os
+import re
+import json
+import html
+import logging
+import yt_dlp
+from resilience import call
+
+logger = logging.getLogger(__name__)
+
+# Uploader-provided tracks are always used when present. Automatic (ASR) tracks
+# are opt-in and limited to the listed languages, since their quality varies.
+CAPTIONS_ENABLED = os.getenv("CAPTIONS_ENABLED", "1") == "1"
+CAPTIONS_USE_AUTOMATIC = os.getenv("CAPTIONS_USE_AUTOMATIC", "0") == "1"
+CAPTIONS_AUTOMATIC_LANGUAGES = [
+    language for language in os.getenv("CAPTIONS_AUTOMATIC_LANGUAGES", "en").split(",") if language
+]
+# Tracks sparser than this, or mostly "[Music]"-style tags, are not worth skipping STT for.
+CAPTIONS_MIN_WORDS_PER_MINUTE = float(os.getenv("CAPTIONS_MIN_WORDS_PER_MINUTE", "30"))
+CAPTIONS_MAX_NON_SPEECH_RATIO = float(os.getenv("CAPTIONS_MAX_NON_SPEECH_RATIO", "0.5"))
+CAPTION_FORMATS = ("json3", "vtt")
+
+NON_SPEECH = re.compile(r"^\s*[\[(♪].*[\])♪]\s*$")
+VTT_TIMING = re.compile(r"(\d+:)?(\d{2}):(\d{2})\.(\d{3})\s+-->\s+(\d+:)?(\d{2}):(\d{2})\.(\d{3})")
+TAG = re.compile(r"<[^>]+>")
+
+
+def _matches_language(track_language, source_language):
+    track_language = track_language.lower()
+    source_language = source_language.lower()
+    return track_language == source_language or track_language.startswith(source_language + "-")
+
+
+def select_caption_track(info, source_language):
+    """
+    Pick a caption track in the source language from yt-dlp metadata.
+    Returns (kind, format dict) with kind "manual" or "automatic", or None.
+    """
+    candidates = [("manual", info.get("subtitles") or {})]
+    if CAPTIONS_USE_AUTOMATIC and (
+        not CAPTIONS_AUTOMATIC_LANGUAGES or source_language in CAPTIONS_AUTOMATIC_LANGUAGES
+    ):
+        candidates.append(("automatic", info.get("automatic_captions") or {}))
+
+    for kind, tracks in candidates:
+        for track_language, formats in tracks.items():
+            if track_language == "live_chat" or not _matches_language(track_language, source_language):
+                continue
+            by_ext = {}
+            for caption_format in formats or []:
+                # Automatic tracks with tlang are machine translations of another language.
+                if kind == "automatic" and "tlang=" in (caption_format.get("url") or ""):
+                    continue
+                by_ext.setdefault(caption_format.get("ext"), caption_format)
+            for ext in CAPTION_FORMATS:
+                if ext in by_ext:
+                    return kind, by_ext[ext]
+    return None
+
+
+def _words_over(text, start, end):
+    """Spread a cue's words over its duration by character length; captions carry no word timings."""
+    tokens = text.split()
+    total = sum(len(token) for token in tokens) or 1
+    words, position = [], start
+    for token in tokens:
+        duration = (end - start) * len(token) / total
+        words.append({"word": token, "start_time": round(position, 3), "end_time": round(position + duration, 3)})
+        position += duration
+    return words
+
+
+def parse_json3(content, confidence=1.0):
+    """Parse a YouTube json3 caption track into recognizer-style results with cue timings."""
+    results = []
+    for event in json.loads(content).get("events", []):
+        segs = event.get("segs")
+        if not segs or event.get("aAppend"):
+            continue
+        start = event.get("tStartMs", 0) / 1000.0
+        end = start + event.get("dDurationMs", 0) / 1000.0
+        text = " ".join("".join(seg.get("utf8", "") for seg in segs).split())
+        if not text:
+            continue
+        if len(segs) > 1 and any("tOffsetMs" in seg for seg in segs):
+            # Automatic tracks time each word.
+            offsets = [start + seg.get("tOffsetMs", 0) / 1000.0 for seg in segs]
+            words = []
+            for index, seg in enumerate(segs):
+                word = seg.get("utf8", "").strip()
+                if not word:
+                    continue
+                word_end = offsets[index + 1] if index + 1 < len(segs) else end
+                words.append({"word": word, "start_time": offsets[index], "end_time": max(word_end, offsets[index])})
+        else:
+            words = _words_over(text, start, end)
+        results.append({
+            "transcript": text, "confidence": confidence, "words": words,
+            "start_time": start, "end_time": end,
+        })
+    return results
+
+
+def _vtt_seconds(hours, minutes, seconds, millis):
+    return int((hours or "0:")[:-1]) * 3600 + int(minutes) * 60 + int(seconds) + int(millis) / 1000.0
+
+
+def parse_vtt(content, confidence=1.0):
+    """Parse a WebVTT caption track, dropping the lines automatic tracks repeat while scrolling."""
+    results = []
+    previous_lines = []
+    for block in re.split(r"\n\s*\n", content.replace("\r\n", "\n")):
+        lines = block.strip().split("\n")
+        timing_index = next((i for i, line in enumerate(lines) if VTT_TIMING.search(line)), None)
+        if timing_index is None:
+            continue
+        match = VTT_TIMING.search(lines[timing_index])
+        start = _vtt_seconds(*match.groups()[:4])
+        end = _vtt_seconds(*match.groups()[4:])
+        text_lines = [html.unescape(TAG.sub("", line)).strip() for line in lines[timing_index + 1:]]
+        text_lines = [line for line in text_lines if line]
+        new_lines = [line for line in text_lines if line not in previous_lines]
+        previous_lines = text_lines
+        text = " ".join(" ".join(new_lines).split())
+        if not text or end - start < 0.05:
+            continue
+        results.append({
+            "transcript": text, "confidence": confidence, "words": _words_over(text, start, end),
+            "start_time": start, "end_time": end,
+        })
+    return results
+
+
+def is_usable(results, duration):
+    """Reject tracks that are too sparse or mostly non-speech tags."""
+    if not results:
+        return False
+    non_speech = sum(1 for result in results if NON_SPEECH.match(result["transcript"]))
+    if non_speech / len(results) > CAPTIONS_MAX_NON_SPEECH_RATIO:
+        return False
+    if duration:
+        words = sum(len(result["words"]) for result in results)
+        if words / (duration / 60.0) < CAPTIONS_MIN_WORDS_PER_MINUTE:
+            return False
+    return True
+
+
+def fetch_caption_results(video_url, source_language, info=None):
+    """
+    Fetch and parse a usable caption track for the video.
+    Returns (kind, results) or None when the audio has to go through STT.
+    `info` is yt-dlp metadata from extract_info(download=False), fetched if not given.
+    """
+    if not CAPTIONS_ENABLED:
+        return None
+    try:
+        with yt_dlp.YoutubeDL({"skip_download": True, "quiet": True}) as ydl:
+            if info is None:
+                info = call("youtube", ydl.extract_info, video_url, download=False, idempotent=True)
+            track = select_caption_track(info, source_language)
+            if not track:
+                return None
+            kind, caption_format = track
+            response = call("youtube", ydl.urlopen, caption_format["url"], idempotent=True)
+            content = response.read().decode("utf-8")
+    except Exception as e:
+        logger.error(f"Error fetching captions for {video_url}: {e}")
+        return None
+
+    confidence = 1.0 if kind == "manual" else 0.0
+    parse = parse_json3 if caption_format.get("ext") == "json3" else parse_vtt
+    try:
+        results = parse(content, confidence=confidence)
+    except (ValueError, KeyError) as e:
+        logger.error(f"Error parsing {kind} captions for {video_url}: {e}")
+        return None
+    if not is_usable(results, info.get("duration")):
+        logger.info(f"{kind.capitalize()} captions for {video_url} are not usable, falling back to STT")
+        return None
+    return kind, results
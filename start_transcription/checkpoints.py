@@ -0,0 +1,48 @@
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Pipeline stages in order. Each completed stage is recorded on the task document
+# under "stages" together with the artifacts it produced, and "stage" holds the
+# latest one, so a retried task resumes after its last completed stage.
+STAGES = (
+    "downloaded",
+    "converted",
+    "detected",
+    "uploaded",
+    "submitted",
+    "transcribed",
+    "translated",
+    "rendered",
+)
+
+
+def stage_index(stage):
+    return STAGES.index(stage) if stage in STAGES else -1
+
+
+def stage_reached(task, stage):
+    """True when the task has completed `stage` or a later one."""
+    if not task:
+        return False
+    return stage_index(task.get("stage")) >= stage_index(stage)
+
+
+def stage_artifacts(task, stage):
+    """Artifacts recorded for a completed stage, e.g. {"audio_uri": ...}."""
+    return ((task or {}).get("stages") or {}).get(stage) or {}
+
+
+def record_stage(collection, task_id, stage, **artifacts):
+    """
+    Mark `stage` complete for a task and store its artifacts.
+    The stage pointer only moves forward, so replaying a handler is harmless.
+    """
+    update = {f"stages.{stage}": {"completed_at": datetime.now(), **artifacts}}
+    collection.update_one({"task_id": task_id}, {"$set": update}, upsert=True)
+    collection.update_one(
+        {"task_id": task_id, "stage": {"$nin": list(STAGES[stage_index(stage):])}},
+        {"$set": {"stage": stage}}
+    )
+    logger.info(f"Task {task_id} reached stage {stage}")
@@ -0,0 +1,223 @@
+import os
+import wave
+import logging
+import numpy as np
+from pymongo import InsertOne
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+FRAME_SIZE = 2048
+HOP_SIZE = 1024  # 64 ms per frame
+FREQ_BANDS = (0, 16, 32, 64, 128, 256, 512, 1025)
+PEAK_THRESHOLD_DB = float(os.getenv("FINGERPRINT_PEAK_THRESHOLD_DB", "10"))
+FAN_OUT = 5
+MAX_DELTA_FRAMES = 63
+CHUNK_FRAMES = 4096
+
+# Matching configuration
+FINGERPRINT_QUERY_HASHES = int(os.getenv("FINGERPRINT_QUERY_HASHES", "4000"))
+FINGERPRINT_MIN_MATCHES = int(os.getenv("FINGERPRINT_MIN_MATCHES", "25"))
+FINGERPRINT_MIN_MATCH_RATIO = float(os.getenv("FINGERPRINT_MIN_MATCH_RATIO", "0.15"))
+# Share of the new audio that must lie inside the reference recording for its transcript to be reused.
+FINGERPRINT_MIN_COVERAGE = float(os.getenv("FINGERPRINT_MIN_COVERAGE", "0.95"))
+# Hashes kept per second of audio. The cap is on a content-derived ranking, so an
+# upload and its reference keep the same hashes wherever they line up.
+FINGERPRINT_HASHES_PER_SECOND = int(os.getenv("FINGERPRINT_HASHES_PER_SECOND", "32"))
+FINGERPRINT_MAX_CANDIDATES = int(os.getenv("FINGERPRINT_MAX_CANDIDATES", "100000"))
+FINGERPRINT_INSERT_BATCH = 5000
+FRAMES_PER_SECOND = SAMPLE_RATE / float(HOP_SIZE)
+
+
+def iter_pcm(wav_path, frames_per_block=CHUNK_FRAMES):
+    """
+    Yield (first_frame, samples) blocks of float32 samples from a 16-bit mono WAV.
+    Each block holds `frames_per_block` whole analysis frames; the tail that the
+    next frame still needs is carried over, so the file is never read in full.
+    """
+    with wave.open(wav_path, "rb") as wav_file:
+        if wav_file.getsampwidth() != 2 or wav_file.getnchannels() != 1:
+            raise ValueError("Fingerprinting expects 16-bit mono PCM.")
+        carry = np.empty(0, dtype=np.float32)
+        first_frame = 0
+        while True:
+            data = wav_file.readframes(frames_per_block * HOP_SIZE)
+            if not data:
+                break
+            samples = np.concatenate([carry, np.frombuffer(data, dtype="<i2").astype(np.float32) / 32768.0])
+            frame_count = (len(samples) - FRAME_SIZE) // HOP_SIZE + 1 if len(samples) >= FRAME_SIZE else 0
+            if not frame_count:
+                carry = samples
+                continue
+            yield first_frame, samples[:(frame_count - 1) * HOP_SIZE + FRAME_SIZE]
+            first_frame += frame_count
+            carry = samples[frame_count * HOP_SIZE:]
+
+
+def find_peaks(samples):
+    """
+    Return (frame_index, frequency_bin) arrays of spectral peaks.
+    Takes the loudest bin in each frequency band of each frame and keeps it when it
+    stands PEAK_THRESHOLD_DB above that frame's mean. The spectrogram is built in
+    chunks of CHUNK_FRAMES frames.
+    """
+    if len(samples) < FRAME_SIZE:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+
+    window = np.hanning(FRAME_SIZE).astype(np.float32)
+    frames = np.lib.stride_tricks.sliding_window_view(samples, FRAME_SIZE)[::HOP_SIZE]
+
+    peak_times = []
+    peak_freqs = []
+    for start in range(0, len(frames), CHUNK_FRAMES):
+        chunk = frames[start:start + CHUNK_FRAMES] * window
+        spectrum = 20 * np.log10(np.abs(np.fft.rfft(chunk, axis=1)) + 1e-10)
+        frame_mean = spectrum.mean(axis=1, keepdims=True)
+
+        for low, high in zip(FREQ_BANDS[:-1], FREQ_BANDS[1:]):
+            band = spectrum[:, low:high]
+            bins = band.argmax(axis=1)
+            values = band[np.arange(len(band)), bins]
+            keep = values > frame_mean[:, 0] + PEAK_THRESHOLD_DB
+            peak_times.append(np.nonzero(keep)[0] + start)
+            peak_freqs.append(bins[keep] + low)
+
+    times = np.concatenate(peak_times).astype(np.int32)
+    freqs = np.concatenate(peak_freqs).astype(np.int32)
+    order = np.lexsort((freqs, times))
+    return times[order], freqs[order]
+
+
+def hash_peaks(times, freqs):
+    """
+    Pair each peak with the next FAN_OUT peaks and hash (f1, f2, dt).
+    Returns (hashes, anchor_frames) as int64 arrays.
+    """
+    hashes = []
+    anchors = []
+    for k in range(1, FAN_OUT + 1):
+        if len(times) <= k:
+            break
+        delta = times[k:] - times[:-k]
+        keep = (delta > 0) & (delta <= MAX_DELTA_FRAMES)
+        f1 = freqs[:-k][keep].astype(np.int64)
+        f2 = freqs[k:][keep].astype(np.int64)
+        hashes.append((f1 << 17) | (f2 << 6) | delta[keep].astype(np.int64))
+        anchors.append(times[:-k][keep].astype(np.int64))
+    if not hashes:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(hashes), np.concatenate(anchors)
+
+
+def _rank(hashes):
+    """A well-mixed ordering of hash values, used to pick the same hashes on both sides of a match."""
+    return hashes.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+
+
+def cap_hashes(hashes, anchors, per_second=FINGERPRINT_HASHES_PER_SECOND):
+    """Keep at most `per_second` hashes anchored in each second, lowest rank first."""
+    if len(hashes) == 0 or not per_second:
+        return hashes, anchors
+    seconds = (anchors / FRAMES_PER_SECOND).astype(np.int64)
+    order = np.lexsort((_rank(hashes), seconds))
+    seconds = seconds[order]
+    starts = np.searchsorted(seconds, seconds, side="left")
+    keep = order[np.arange(len(order)) - starts < per_second]
+    keep.sort()
+    return hashes[keep], anchors[keep]
+
+
+def fingerprint_file(wav_path):
+    """
+    Fingerprint a 16 kHz mono WAV file. Returns (hashes, anchor_frames, duration_seconds).
+    Audio is read in blocks and hashes are capped per second, so memory and index
+    size grow with FINGERPRINT_HASHES_PER_SECOND rather than with the raw signal.
+    """
+    peak_times = []
+    peak_freqs = []
+    for first_frame, samples in iter_pcm(wav_path):
+        times, freqs = find_peaks(samples)
+        peak_times.append(times + first_frame)
+        peak_freqs.append(freqs)
+    if not peak_times:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), 0.0
+    hashes, anchors = hash_peaks(np.concatenate(peak_times), np.concatenate(peak_freqs))
+    hashes, anchors = cap_hashes(hashes, anchors)
+    with wave.open(wav_path, "rb") as wav_file:
+        duration = wav_file.getnframes() / float(wav_file.getframerate())
+    return hashes, anchors, duration
+
+
+def frames_to_seconds(frames):
+    return frames * HOP_SIZE / float(SAMPLE_RATE)
+
+
+def span_coverage(offset, duration, reference_duration):
+    """
+    Share of audio starting `offset` seconds into a reference recording and lasting
+    `duration` seconds that falls inside the reference's [0, reference_duration].
+    """
+    if not duration or not reference_duration or duration <= 0:
+        return 0.0
+    overlap = min(offset + duration, reference_duration) - max(offset, 0.0)
+    return max(0.0, overlap) / duration
+
+
+def index_fingerprints(fingerprint_collection, video_id, hashes, anchors):
+    """Store the fingerprints of a video so later uploads can be matched against it."""
+    fingerprint_collection.delete_many({"v": video_id})
+    for start in range(0, len(hashes), FINGERPRINT_INSERT_BATCH):
+        fingerprint_collection.bulk_write([
+            InsertOne({"h": int(h), "v": video_id, "t": int(t)})
+            for h, t in zip(hashes[start:start + FINGERPRINT_INSERT_BATCH],
+                            anchors[start:start + FINGERPRINT_INSERT_BATCH])
+        ], ordered=False)
+    logger.info(f"Indexed {len(hashes)} fingerprints for {video_id}")
+
+
+def match_fingerprints(fingerprint_collection, hashes, anchors, exclude_video_id=None):
+    """
+    Match fingerprints against the index.
+    Returns {"video_id", "offset", "matches", "ratio"} for the best aligned
+    match, where `offset` is the reference time (seconds) at which this audio
+    starts, or None when nothing clears the thresholds.
+    """
+    if len(hashes) == 0:
+        return None
+
+    unique_hashes, first = np.unique(hashes, return_index=True)
+    if len(unique_hashes) > FINGERPRINT_QUERY_HASHES:
+        step = len(unique_hashes) / float(FINGERPRINT_QUERY_HASHES)
+        pick = (np.arange(FINGERPRINT_QUERY_HASHES) * step).astype(np.int64)
+        unique_hashes, first = unique_hashes[pick], first[pick]
+    query_anchor = dict(zip(unique_hashes.tolist(), anchors[first].tolist()))
+
+    query = {"h": {"$in": list(query_anchor)}}
+    if exclude_video_id:
+        query["v"] = {"$ne": exclude_video_id}
+    candidates = list(
+        fingerprint_collection.find(query, {"_id": 0, "h": 1, "v": 1, "t": 1}).limit(FINGERPRINT_MAX_CANDIDATES)
+    )
+    if not candidates:
+        return None
+
+    video_ids = np.array([doc["v"] for doc in candidates])
+    deltas = np.array([doc["t"] - query_anchor[doc["h"]] for doc in candidates], dtype=np.int64)
+
+    best = None
+    for video_id in np.unique(video_ids):
+        video_deltas = deltas[video_ids == video_id]
+        offsets, counts = np.unique(video_deltas, return_counts=True)
+        top = counts.argmax()
+        if best is None or counts[top] > best["matches"]:
+            best = {"video_id": str(video_id), "offset_frames": int(offsets[top]), "matches": int(counts[top])}
+
+    ratio = best["matches"] / float(len(query_anchor))
+    if best["matches"] < FINGERPRINT_MIN_MATCHES or ratio < FINGERPRINT_MIN_MATCH_RATIO:
+        return None
+    return {
+        "video_id": best["video_id"],
+        "offset": frames_to_seconds(best["offset_frames"]),
+        "matches": best["matches"],
+        "ratio": round(ratio, 4),
+    }
@@ -1,7 +1,15 @@
 import os
+import uuid
+import base64
 import logging
 import subprocess
+import wave
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait
+import google_crc32c
 from google.cloud import storage
+from google.api_core.exceptions import NotFound
+from resilience import call
 from google.oauth2 import service_account
 
 logging.basicConfig(level=logging.INFO)
@@ -12,6 +20,13 @@ logger = logging.getLogger()
 
 SERVICE_ACCOUNT_KEY_FILE = os.getenv("GOOGLE_APPLICATION_CREDENTIALS", "service-account-key.json")
 
+# Files above the threshold are uploaded as parallel parts and composed server-side.
+COMPOSITE_UPLOAD_THRESHOLD_BYTES = int(os.getenv("COMPOSITE_UPLOAD_THRESHOLD_BYTES", str(150 * 1024 * 1024)))
+COMPOSITE_UPLOAD_PART_BYTES = int(os.getenv("COMPOSITE_UPLOAD_PART_BYTES", str(32 * 1024 * 1024)))
+COMPOSITE_UPLOAD_CONCURRENCY = int(os.getenv("COMPOSITE_UPLOAD_CONCURRENCY", "8"))
+COMPOSE_MAX_SOURCES = 32  # GCS limit per compose request
+CHECKSUM_CHUNK_BYTES = 4 * 1024 * 1024
+
 
 try:
     credentials = service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_KEY_FILE)
@@ -24,16 +39,181 @@ except Exception as e:
 storage_client = storage.Client(credentials=credentials)
 
 
+class UploadChecksumError(Exception):
+    """The uploaded object's CRC32C does not match the local file."""
+
+
+class FileSlice:
+    """Read-only view of `length` bytes of a file starting at `offset`."""
+    def __init__(self, path, offset, length):
+        self._file = open(path, "rb")
+        self._file.seek(offset)
+        self._offset = offset
+        self._remaining = length
+        self.length = length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._file.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def tell(self):
+        return self.length - self._remaining
+
+    def seek(self, position, whence=0):
+        if whence == 1:
+            position += self.tell()
+        elif whence == 2:
+            position += self.length
+        position = min(max(position, 0), self.length)
+        self._file.seek(self._offset + position)
+        self._remaining = self.length - position
+        return position
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def file_crc32c(path):
+    """Base64 big-endian CRC32C of a file, the format GCS reports in blob.crc32c."""
+    checksum = google_crc32c.Checksum()
+    with open(path, "rb") as source:
+        for chunk in iter(lambda: source.read(CHECKSUM_CHUNK_BYTES), b""):
+            checksum.update(chunk)
+    return base64.b64encode(checksum.digest()).decode("utf-8")
+
+
+def verify_upload(blob, expected_crc32c):
+    """Compare the stored object's CRC32C with the local file's before anything consumes it."""
+    call("gcs", blob.reload, idempotent=True, pass_timeout=True)
+    if blob.crc32c != expected_crc32c:
+        raise UploadChecksumError(
+            f"CRC32C mismatch for gs://{blob.bucket.name}/{blob.name}: expected {expected_crc32c}, got {blob.crc32c}"
+        )
+
+
+def plan_parts(file_size, part_size):
+    """(offset, length) pairs covering the file; part size grows so two compose levels always suffice."""
+    max_parts = COMPOSE_MAX_SOURCES * COMPOSE_MAX_SOURCES
+    part_size = max(part_size, -(-file_size // max_parts))
+    return [(offset, min(part_size, file_size - offset)) for offset in range(0, file_size, part_size)]
+
+
+def _upload_part(bucket, source_file_path, name, offset, length):
+    blob = bucket.blob(name)
+    with FileSlice(source_file_path, offset, length) as part:
+        # checksum="crc32c" makes the client verify each part in transit.
+        call("gcs", blob.upload_from_file, part, size=length, rewind=True,
+             checksum="crc32c", idempotent=True, pass_timeout=True)
+    return blob
+
+
+def _compose(bucket, destination_blob_name, sources, prefix, temporary):
+    """
+    Compose sources into the destination, in a second level when there are more than 32.
+    Intermediate objects are added to `temporary` as they are created, so a compose
+    that fails partway still leaves them for cleanup.
+    """
+    if len(sources) > COMPOSE_MAX_SOURCES:
+        intermediates = []
+        for index in range(0, len(sources), COMPOSE_MAX_SOURCES):
+            intermediate = bucket.blob(f"{prefix}/compose-{index // COMPOSE_MAX_SOURCES:05d}")
+            temporary.append(intermediate)
+            call("gcs", intermediate.compose, sources[index:index + COMPOSE_MAX_SOURCES],
+                 idempotent=True, pass_timeout=True)
+            intermediates.append(intermediate)
+        sources = intermediates
+    destination = bucket.blob(destination_blob_name)
+    call("gcs", destination.compose, sources, idempotent=True, pass_timeout=True)
+    return destination
+
+
+def _delete_quietly(blobs, executor=None):
+    def delete(blob):
+        try:
+            call("gcs", blob.delete, idempotent=True, pass_timeout=True)
+        except NotFound:
+            pass
+        except Exception as e:
+            logger.warning(f"Could not delete temporary object {blob.name}: {e}")
+    if executor is None:
+        for blob in blobs:
+            delete(blob)
+    else:
+        futures = [executor.submit(contextvars.copy_context().run, delete, blob) for blob in blobs]
+        for future in futures:
+            future.result()
+
+
+def composite_upload(bucket, source_file_path, destination_blob_name, part_size=None, concurrency=None):
+    """
+    Upload a large file as concurrent parts and compose them into one object.
+    Temporary parts are removed whether or not the compose succeeds.
+    """
+    part_size = part_size or COMPOSITE_UPLOAD_PART_BYTES
+    concurrency = concurrency or COMPOSITE_UPLOAD_CONCURRENCY
+    parts = plan_parts(os.path.getsize(source_file_path), part_size)
+    prefix = f"{destination_blob_name}.parts/{uuid.uuid4().hex}"
+    uploaded = []
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        try:
+            futures = [
+                executor.submit(
+                    contextvars.copy_context().run, _upload_part, bucket, source_file_path,
+                    f"{prefix}/{index:05d}", offset, length
+                )
+                for index, (offset, length) in enumerate(parts)
+            ]
+            # Wait for every part, so parts that land after a failed one are cleaned up too.
+            wait(futures)
+            errors = []
+            for future in futures:
+                if future.exception() is None:
+                    uploaded.append(future.result())
+                else:
+                    errors.append(future.exception())
+            if errors:
+                raise errors[0]
+            parts_uploaded = list(uploaded)
+            destination = _compose(bucket, destination_blob_name, parts_uploaded, prefix, uploaded)
+            logger.info(f"Composed {len(parts)} parts into gs://{bucket.name}/{destination_blob_name}")
+            return destination
+        finally:
+            _delete_quietly(uploaded, executor)
+
+
 def upload_to_gcs(bucket_name, source_file_path, destination_blob_name):
     """
     Uploads a file to Google Cloud Storage.
+    Large files use a parallel composite upload. The object's CRC32C is checked
+    against the local file, so a URI is only returned for an intact upload.
     """
     try:
         bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(destination_blob_name)
-        blob.upload_from_filename(source_file_path)
+        file_size = os.path.getsize(source_file_path)
+        with ThreadPoolExecutor(max_workers=1) as checksum_executor:
+            # Checksumming overlaps with the upload instead of adding to it.
+            expected_crc32c = checksum_executor.submit(file_crc32c, source_file_path)
+            if file_size > COMPOSITE_UPLOAD_THRESHOLD_BYTES:
+                blob = composite_upload(bucket, source_file_path, destination_blob_name)
+            else:
+                blob = bucket.blob(destination_blob_name)
+                call("gcs", blob.upload_from_filename, source_file_path, idempotent=True, pass_timeout=True)
+            verify_upload(blob, expected_crc32c.result())
         logger.info(f"File uploaded to gs://{bucket_name}/{destination_blob_name}")
         return f"gs://{bucket_name}/{destination_blob_name}"
+    except UploadChecksumError as e:
+        logger.error(f"Error uploading to GCS: {e}")
+        _delete_quietly([bucket.blob(destination_blob_name)])
+        return None
     except Exception as e:
         logger.error(f"Error uploading to GCS: {e}")
         return None
@@ -60,8 +240,29 @@ def convert_audio_to_wav(input_path, output_path):
         raise RuntimeError("FFmpeg conversion failed.")
 
 
+def probe_audio_duration(audio_path):
+    """
+    Return the duration of an audio file in seconds.
+    Reads only the WAV header when possible and falls back to ffprobe.
+    """
+    try:
+        with wave.open(audio_path, "rb") as wav_file:
+            frame_rate = wav_file.getframerate()
+            if frame_rate:
+                return wav_file.getnframes() / float(frame_rate)
+    except (wave.Error, EOFError) as e:
+        logger.info(f"WAV header probe failed for {audio_path}, using ffprobe: {e}")
 
-
-
-
-
+    command = [
+        "ffprobe",
+        "-v", "error",
+        "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        audio_path
+    ]
+    try:
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        return float(output.strip())
+    except (subprocess.CalledProcessError, OSError, ValueError) as e:
+        logger.error(f"FFprobe error: {e}")
+        raise RuntimeError("Could not determine audio duration.")
@@ -0,0 +1,103 @@
+import os
+import wave
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Short samples of the converted audio are recognized with the requested language
+# plus candidate alternatives before the full long_running_recognize is submitted.
+LANGUAGE_DETECTION_ENABLED = os.getenv("LANGUAGE_DETECTION_ENABLED", "1") == "1"
+LANGUAGE_DETECTION_SAMPLES = int(os.getenv("LANGUAGE_DETECTION_SAMPLES", "3"))
+LANGUAGE_DETECTION_SAMPLE_SECONDS = float(os.getenv("LANGUAGE_DETECTION_SAMPLE_SECONDS", "8"))
+# Source languages tried besides the requested one; Speech accepts at most 3 alternatives.
+LANGUAGE_DETECTION_CANDIDATES = [
+    language for language in os.getenv("LANGUAGE_DETECTION_CANDIDATES", "en,hi,es").split(",") if language
+]
+MAX_ALTERNATIVE_LANGUAGES = 3
+# Share of the total score another language needs before it overrides the request.
+LANGUAGE_DETECTION_MIN_SHARE = float(os.getenv("LANGUAGE_DETECTION_MIN_SHARE", "0.6"))
+
+
+def read_samples(wav_path, count=LANGUAGE_DETECTION_SAMPLES, seconds=LANGUAGE_DETECTION_SAMPLE_SECONDS):
+    """
+    Raw PCM of `count` windows spread over the middle of a WAV file, skipping the
+    first and last tenth where intros and outros are often music.
+    Returns (samples, sample_rate).
+    """
+    with wave.open(wav_path, "rb") as wav_file:
+        sample_rate = wav_file.getframerate()
+        total_frames = wav_file.getnframes()
+        window = int(seconds * sample_rate)
+        if total_frames <= window:
+            return [wav_file.readframes(total_frames)], sample_rate
+
+        start, end = int(total_frames * 0.1), int(total_frames * 0.9) - window
+        if end <= start:
+            start, end = 0, total_frames - window
+        step = (end - start) / max(1, count - 1)
+        samples = []
+        for index in range(count):
+            wav_file.setpos(int(start + index * step))
+            samples.append(wav_file.readframes(window))
+    return samples, sample_rate
+
+
+def _short_code(language_code, language_codes):
+    """Map a Speech language code such as "hi-in" back to the app's code ("hi")."""
+    language_code = language_code.lower()
+    for short, code in language_codes.items():
+        if code.lower() == language_code:
+            return short
+    return language_code.split("-")[0]
+
+
+def detect_language(recognizer, samples, requested_language, language_codes,
+                    candidates=LANGUAGE_DETECTION_CANDIDATES, sample_rate=16000):
+    """
+    Score the requested language against the candidates on each sample; a result
+    counts for the language Speech attributed it to, weighted by its confidence
+    and word count. Another language is chosen only when it clearly wins.
+
+    Returns {"requested", "detected", "chosen", "scores", "share"} with app language codes.
+    """
+    primary = language_codes.get(requested_language, "en-US")
+    alternatives = []
+    for candidate in candidates:
+        code = language_codes.get(candidate)
+        if code and code != primary and code not in alternatives:
+            alternatives.append(code)
+    alternatives = alternatives[:MAX_ALTERNATIVE_LANGUAGES]
+
+    def identify(sample):
+        try:
+            return recognizer.identify_language(sample, primary, alternatives, sample_rate=sample_rate)
+        except Exception as e:
+            logger.warning(f"Language detection sample failed: {e}")
+            return []
+
+    with ThreadPoolExecutor(max_workers=max(1, len(samples))) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, identify, sample) for sample in samples]
+        sample_results = [future.result() for future in futures]
+
+    scores = {}
+    for results in sample_results:
+        for result in results:
+            language = _short_code(result["language_code"], language_codes)
+            scores[language] = scores.get(language, 0.0) + result["confidence"] * result["words"]
+
+    total = sum(scores.values())
+    if not total:
+        return {"requested": requested_language, "detected": None, "chosen": requested_language,
+                "scores": {}, "share": 0.0}
+    detected = max(scores, key=scores.get)
+    share = scores[detected] / total
+    chosen = detected if share >= LANGUAGE_DETECTION_MIN_SHARE else requested_language
+    return {
+        "requested": requested_language,
+        "detected": detected,
+        "chosen": chosen,
+        "scores": {language: round(score, 3) for language, score in scores.items()},
+        "share": round(share, 3),
+    }
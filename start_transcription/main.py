@@ -1,15 +1,88 @@
 import json
 import logging
+import os
 import functions_framework  # Required for Google Cloud Functions
 from task_process import process_youtube_audio
 from task_process import db
+from task_process import (
+    BULK_MAX_CONCURRENCY,
+    BULK_MAX_VIDEOS,
+    bulk_job_cost,
+    create_bulk_job,
+    expand_playlist,
+    get_playlist_id,
+    get_video_id,
+    plan_bulk_job,
+    process_bulk_youtube_audio,
+)
 from bson.objectid import ObjectId
+from resilience import deadline
+from profiling import profiled
 
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "530"))
+
+
+def is_bulk_request(request_json):
+    """
+    A request is a bulk request when it carries a list of URLs, explicitly asks
+    for the playlist, or points at a playlist without a single video.
+    """
+    if request_json.get("video_urls"):
+        return True
+    video_url = request_json.get("video_url")
+    if not video_url or not get_playlist_id(video_url):
+        return False
+    return bool(request_json.get("playlist")) or not get_video_id(video_url)
+
+
+def start_bulk_transcription(request_json, user_object_id, BUCKET_NAME, headers):
+    """
+    Expand a playlist or URL list, debit the user once for the whole batch
+    and fan the videos out through the pipeline. Children that fail are refunded.
+    """
+    task_id = request_json["task_id"]
+    source_language = request_json.get("source_language", "en")
+    target_language = request_json["target_language"]
+
+    video_urls = list(request_json.get("video_urls") or [])
+    if request_json.get("video_url"):
+        if get_playlist_id(request_json["video_url"]):
+            video_urls.extend(expand_playlist(request_json["video_url"]))
+        else:
+            video_urls.append(request_json["video_url"])
+    video_urls = video_urls[:BULK_MAX_VIDEOS]
+
+    items = plan_bulk_job(video_urls, BUCKET_NAME, source_language, target_language)
+    if not items:
+        return json.dumps({"error": "No valid YouTube videos found."}), 400, headers
+    if all(item["status"] == "rejected" for item in items):
+        rejected = [{"video_id": item["video_id"], "error": item["error"]} for item in items]
+        return json.dumps({"error": "None of the videos can be processed.", "rejected": rejected}), 422, headers
+
+    cost = bulk_job_cost(items)
+    debit = db.users.update_one(
+        {"_id": user_object_id, "issubscribed": True, "coins": {"$gte": cost}},
+        {"$inc": {"coins": -cost}}
+    )
+    if debit.modified_count == 0:
+        return json.dumps({"error": "Insufficient coins for this batch.", "coins_required": cost}), 402, headers
+
+    job = create_bulk_job(task_id, str(user_object_id), source_language, target_language, items)
+    max_concurrency = min(int(request_json.get("concurrency", BULK_MAX_CONCURRENCY)), BULK_MAX_CONCURRENCY)
+    result = process_bulk_youtube_audio(job, BUCKET_NAME, max_concurrency=max_concurrency)
+    result["tokens_used"] = cost - result["refunded"]
+
+    if result["status"] == "failed":
+        return json.dumps(result, default=str), 400, headers
+    return json.dumps(result, default=str), 200, headers
+
+
 @functions_framework.http
+@profiled("start_transcription")
 def start_transcription(request):
     """
     Cloud Function to download YouTube audio and upload it to GCS.
@@ -20,7 +93,7 @@ def start_transcription(request):
         headers = {
             "Access-Control-Allow-Origin": "*",
             "Access-Control-Allow-Methods": "POST, OPTIONS",
-            "Access-Control-Allow-Headers": "Content-Type",
+            "Access-Control-Allow-Headers": "Content-Type, X-Profile",
             "Content-Type": "application/json"
         }
 
@@ -30,23 +103,26 @@ def start_transcription(request):
 
         # Parse JSON request
         request_json = request.get_json(silent=True)
-        
-        task_id = request_json["task_id"]
-        video_url = request_json["video_url"]
-        user_id = request_json["user_id"]
-        source_language = request_json("source_language", "en")  
-        target_language = request_json["target_language"]  
-        
-
 
-        if not request_json or "video_url" not in request_json:
+        if not request_json or ("video_url" not in request_json and "video_urls" not in request_json):
             return json.dumps({"error": "Invalid input. 'video_url' is required."}), 400, headers
-        
+
+        task_id = request_json["task_id"]
+        user_id = request_json.get("user_id")
+        source_language = request_json.get("source_language", "en")
+        target_language = request_json["target_language"]
+
         if not user_id:
             return json.dumps({"error": "Invalid input. 'user_id' is required."}), 401, headers
 
         
         user_object_id = ObjectId(user_id)
+        BUCKET_NAME = "tube_genius"
+
+        if is_bulk_request(request_json):
+            with deadline(REQUEST_DEADLINE_SECONDS):
+                return start_bulk_transcription(request_json, user_object_id, BUCKET_NAME, headers)
+
         query = {
             "_id": user_object_id,
             "issubscribed": True,
@@ -58,21 +134,27 @@ def start_transcription(request):
             return json.dumps({"error": "Unauthorized"}), 401, headers
         # Extract video URL
         video_url = request_json["video_url"]
-        BUCKET_NAME = "tube_genius"  
 
         # Process the YouTube audio
-        result = process_youtube_audio(video_url, BUCKET_NAME,source_language,target_language,user_id,task_id)
+        with deadline(REQUEST_DEADLINE_SECONDS):
+            result = process_youtube_audio(video_url, BUCKET_NAME,source_language,target_language,user_id,task_id,
+                                           available_coins=user["coins"])
+
+        # Return the response
+        if "coins_required" in result:
+            return json.dumps(result, default=str), 402, headers
+        if result.get("rejected"):
+            return json.dumps(result, default=str), 422, headers
+        if "error" in result:
+            return json.dumps(result, default=str), 400, headers
 
+        # Deduct the price of the video, known from its metadata before downloading
         db.users.update_one(
             {"_id": user_object_id},
-            {"$inc": {"coins": -100}}  # Deduct 100 coins
+            {"$inc": {"coins": -result.get("tokens_used", 0)}}
         )
 
-        # Return the response
-        if "error" in result:
-            return json.dumps(result), 400, headers
-
-        return json.dumps(result), 200, headers
+        return json.dumps(result, default=str), 200, headers
 
     except Exception as e:
         logging.error(f"Error in download_audio: {str(e)}")
@@ -0,0 +1,231 @@
+"""
+Access log and eviction policy for the audio and subtitle objects in the bucket.
+
+Hits on audio/{video_id}.wav and subtitles/{video_id}_{src}_{tgt}.vtt are
+recorded in ObjectAccess, at most once per object per ACCESS_LOG_RESOLUTION_SECONDS
+from each instance. The eviction job lists both prefixes, takes the last access
+(or the upload time of objects never hit again) and:
+
+- deletes or down-tiers audio colder than AUDIO_COLD_DAYS once a transcript of
+  the video is stored and no recognition job still reads it;
+- deletes subtitles colder than SUBTITLE_COLD_DAYS once a transcript of the
+  video is stored, so the status function can re-render them if they are
+  requested again.
+
+Transcripts and translations are never touched.
+
+    python object_lifecycle.py --dry-run
+    python object_lifecycle.py --audio-action coldline
+"""
+import os
+import json
+import time
+import logging
+import argparse
+import threading
+from datetime import datetime
+from google.api_core.exceptions import NotFound
+
+logger = logging.getLogger(__name__)
+
+ACCESS_LOG_ENABLED = os.getenv("ACCESS_LOG_ENABLED", "1") == "1"
+ACCESS_LOG_RESOLUTION_SECONDS = float(os.getenv("ACCESS_LOG_RESOLUTION_SECONDS", "3600"))
+AUDIO_COLD_DAYS = float(os.getenv("AUDIO_COLD_DAYS", "14"))
+SUBTITLE_COLD_DAYS = float(os.getenv("SUBTITLE_COLD_DAYS", "90"))
+# "delete", or a storage class to move cold audio to such as "coldline" or "archive".
+AUDIO_EVICTION_ACTION = os.getenv("AUDIO_EVICTION_ACTION", "delete")
+EVICTION_BUCKET_NAME = os.getenv("EVICTION_BUCKET_NAME", "tube_genius")
+
+AUDIO_PREFIX = "audio/"
+SUBTITLE_PREFIX = "subtitles/"
+TRANSCRIPT_PREFIX = "transcripts/"
+STORAGE_CLASSES = {"nearline": "NEARLINE", "coldline": "COLDLINE", "archive": "ARCHIVE"}
+ACTIVE_STT_STATES = ["queued", "submitting", "inflight"]
+
+
+class AccessLog:
+    """
+    Last access time and hit count per object, in `collection`.
+    Writes are throttled in-process so hot objects cost one update per resolution window.
+    """
+    def __init__(self, collection, resolution_seconds=ACCESS_LOG_RESOLUTION_SECONDS,
+                 enabled=ACCESS_LOG_ENABLED, clock=time.monotonic):
+        self.collection = collection
+        self.resolution_seconds = resolution_seconds
+        self.enabled = enabled
+        self.clock = clock
+        self._recorded = {}
+        self._lock = threading.Lock()
+
+    def record(self, blob_name):
+        if not self.enabled:
+            return
+        now = self.clock()
+        with self._lock:
+            last = self._recorded.get(blob_name)
+            if last is not None and now - last < self.resolution_seconds:
+                return
+            self._recorded[blob_name] = now
+        try:
+            self.collection.update_one(
+                {"_id": blob_name},
+                {"$max": {"last_accessed": datetime.now()}, "$inc": {"hits": 1}},
+                upsert=True
+            )
+        except Exception as e:
+            logger.warning(f"Could not record access to {blob_name}: {e}")
+
+    def last_accessed(self, blob_names):
+        """{blob_name: last access datetime} for the names that were ever hit."""
+        accessed = {}
+        names = list(blob_names)
+        for start in range(0, len(names), 1000):
+            for document in self.collection.find({"_id": {"$in": names[start:start + 1000]}}, {"last_accessed": 1}):
+                accessed[document["_id"]] = document["last_accessed"]
+        return accessed
+
+
+def _naive(moment):
+    """Blob timestamps are UTC-aware; the access log stores naive local times."""
+    if moment is not None and moment.tzinfo is not None:
+        return moment.astimezone().replace(tzinfo=None)
+    return moment
+
+
+def _audio_video_id(blob_name):
+    return os.path.splitext(blob_name[len(AUDIO_PREFIX):])[0]
+
+
+def _subtitle_transcript_key(blob_name):
+    """subtitles/{video_id}_{src}_{tgt}.vtt -> (video_id, src), matching transcripts/{video_id}_{src}.tsw."""
+    parts = os.path.splitext(blob_name[len(SUBTITLE_PREFIX):])[0].rsplit("_", 2)
+    return (parts[0], parts[1]) if len(parts) == 3 else (parts[0], None)
+
+
+def plan_eviction(bucket, access_log, stt_queue=None, now=None, audio_cold_days=AUDIO_COLD_DAYS,
+                  subtitle_cold_days=SUBTITLE_COLD_DAYS, audio_action=AUDIO_EVICTION_ACTION):
+    """
+    Decide what the job would do without changing anything.
+    Returns a list of {"name", "kind", "size", "last_used", "action", "reason"};
+    action is "delete", a storage class name, or "keep".
+    """
+    now = now or datetime.now()
+    transcripts = {
+        tuple(os.path.splitext(blob.name[len(TRANSCRIPT_PREFIX):])[0].rsplit("_", 1))
+        for blob in bucket.list_blobs(prefix=TRANSCRIPT_PREFIX)
+    }
+    transcribed = {key[0] for key in transcripts}
+    busy_audio = set()
+    if stt_queue is not None:
+        for job in stt_queue.find({"state": {"$in": ACTIVE_STT_STATES}}, {"gcs_uri": 1}):
+            busy_audio.add(job["gcs_uri"].split("/", 3)[-1])
+
+    blobs = list(bucket.list_blobs(prefix=AUDIO_PREFIX)) + list(bucket.list_blobs(prefix=SUBTITLE_PREFIX))
+    accessed = access_log.last_accessed(blob.name for blob in blobs)
+
+    plan = []
+    for blob in blobs:
+        kind = "audio" if blob.name.startswith(AUDIO_PREFIX) else "subtitles"
+        created = _naive(getattr(blob, "time_created", None))
+        last_used = max(filter(None, [accessed.get(blob.name), created]), default=None)
+        idle_days = (now - last_used).total_seconds() / 86400 if last_used else None
+        cold_days = audio_cold_days if kind == "audio" else subtitle_cold_days
+        entry = {"name": blob.name, "kind": kind, "size": blob.size or 0, "last_used": last_used,
+                 "action": "keep", "reason": "hot"}
+        plan.append(entry)
+
+        if idle_days is None or idle_days < cold_days:
+            continue
+        if kind == "subtitles":
+            # Only subtitles that can be re-rendered from a stored transcript are disposable.
+            if _subtitle_transcript_key(blob.name) not in transcripts:
+                entry["reason"] = "no stored transcript"
+            else:
+                entry.update(action="delete", reason=f"idle {idle_days:.0f} days")
+            continue
+        if blob.name in busy_audio:
+            entry["reason"] = "recognition in progress"
+        elif _audio_video_id(blob.name) not in transcribed:
+            entry["reason"] = "no stored transcript"
+        elif audio_action != "delete" and (getattr(blob, "storage_class", None) or "").upper() == STORAGE_CLASSES[audio_action]:
+            entry["reason"] = f"already {audio_action}"
+        else:
+            entry.update(action=audio_action, reason=f"idle {idle_days:.0f} days")
+    return plan
+
+
+def summarize(plan):
+    """Object and byte totals per kind and action, plus reclaimable bytes."""
+    report = {"objects": len(plan), "bytes": 0, "reclaimable_bytes": 0, "down_tiered_bytes": 0, "by_kind": {}}
+    for entry in plan:
+        kind = report["by_kind"].setdefault(entry["kind"], {"objects": 0, "bytes": 0, "actions": {}})
+        kind["objects"] += 1
+        kind["bytes"] += entry["size"]
+        action = kind["actions"].setdefault(entry["action"], {"objects": 0, "bytes": 0})
+        action["objects"] += 1
+        action["bytes"] += entry["size"]
+        report["bytes"] += entry["size"]
+        if entry["action"] == "delete":
+            report["reclaimable_bytes"] += entry["size"]
+        elif entry["action"] != "keep":
+            report["down_tiered_bytes"] += entry["size"]
+    return report
+
+
+def apply_eviction(bucket, plan, call=None):
+    """Carry out a plan. Objects deleted since it was made are skipped."""
+    call = call or (lambda dependency, fn, *args, **kwargs: fn(*args))
+    applied = 0
+    for entry in plan:
+        if entry["action"] == "keep":
+            continue
+        blob = bucket.blob(entry["name"])
+        try:
+            if entry["action"] == "delete":
+                call("gcs", blob.delete, idempotent=True)
+            else:
+                call("gcs", blob.update_storage_class, STORAGE_CLASSES[entry["action"]], idempotent=True)
+            applied += 1
+        except NotFound:
+            continue
+        except Exception as e:
+            logger.error(f"Could not {entry['action']} {entry['name']}: {e}")
+    return applied
+
+
+def run_eviction(bucket, access_log, stt_queue=None, dry_run=True, call=None, **policy):
+    """Plan and, unless `dry_run`, apply an eviction pass. Returns (report, plan)."""
+    plan = plan_eviction(bucket, access_log, stt_queue, **policy)
+    report = summarize(plan)
+    report["dry_run"] = dry_run
+    if not dry_run:
+        report["applied"] = apply_eviction(bucket, plan, call=call)
+    return report, plan
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bucket", default=EVICTION_BUCKET_NAME)
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be evicted")
+    parser.add_argument("--audio-cold-days", type=float, default=AUDIO_COLD_DAYS)
+    parser.add_argument("--subtitle-cold-days", type=float, default=SUBTITLE_COLD_DAYS)
+    parser.add_argument("--audio-action", default=AUDIO_EVICTION_ACTION, choices=["delete", *STORAGE_CLASSES])
+    parser.add_argument("--list", action="store_true", help="print every object's decision")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    import task_process
+    report, plan = run_eviction(
+        task_process.storage_client.bucket(args.bucket), task_process.access_log, task_process.db["SttQueue"],
+        dry_run=args.dry_run, call=task_process.call, audio_cold_days=args.audio_cold_days,
+        subtitle_cold_days=args.subtitle_cold_days, audio_action=args.audio_action,
+    )
+    if args.list:
+        for entry in plan:
+            print(json.dumps(entry, default=str))
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+"""
+Off-peak precomputation of subtitles for videos likely to be requested soon.
+
+Candidates are (video, source language) pairs with a set of target languages,
+kept in PrefetchQueue by score. They come from recent request counts in
+SubtitledVideos and from an admin-submitted list. Each tick of the runner:
+
+1. measures spare recognition capacity from the STT scheduler; there is none
+   while user jobs are queued, and prefetch never takes more than
+   PREFETCH_IDLE_SHARE of the slots;
+2. advances running candidates by polling their tasks through the status
+   function, which renders them. Once the first target is done, the transcript
+   is stored, so the remaining targets only need translation;
+3. starts the best-scoring candidates that fit in the spare capacity.
+
+Later requests for a prefetched pair land on the check_subtitle_exists fast
+path; those hits are counted on the candidate so the hit rate can be reported.
+
+    python prefetch.py --seed --ticks 1               # from cron / Cloud Scheduler
+    python prefetch.py --add https://www.youtube.com/watch?v=... --targets hi,es
+    python prefetch.py --report
+"""
+import os
+import json
+import time
+import uuid
+import logging
+import argparse
+import urllib.request
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+# Tasks started by prefetch belong to this user and are left out of request statistics.
+PREFETCH_USER_ID = os.getenv("PREFETCH_USER_ID", "000000000000000000000000")
+PREFETCH_TARGET_LANGUAGES = [
+    language for language in os.getenv("PREFETCH_TARGET_LANGUAGES", "hi,es,en").split(",") if language
+]
+PREFETCH_MAX_TARGETS = int(os.getenv("PREFETCH_MAX_TARGETS", "4"))
+PREFETCH_WINDOW_HOURS = float(os.getenv("PREFETCH_WINDOW_HOURS", "48"))
+PREFETCH_MIN_REQUESTS = int(os.getenv("PREFETCH_MIN_REQUESTS", "2"))
+PREFETCH_SEED_LIMIT = int(os.getenv("PREFETCH_SEED_LIMIT", "200"))
+PREFETCH_ADMIN_SCORE = float(os.getenv("PREFETCH_ADMIN_SCORE", "1000"))
+# Share of the STT slots prefetch may occupy, and its fair-share weight next to users.
+PREFETCH_IDLE_SHARE = float(os.getenv("PREFETCH_IDLE_SHARE", "0.5"))
+PREFETCH_STT_WEIGHT = float(os.getenv("PREFETCH_STT_WEIGHT", "0.25"))
+# Candidates translating at once; translation uses no STT slot but does use Translate quota.
+PREFETCH_MAX_ACTIVE = int(os.getenv("PREFETCH_MAX_ACTIVE", "20"))
+PREFETCH_MAX_ATTEMPTS = int(os.getenv("PREFETCH_MAX_ATTEMPTS", "3"))
+PREFETCH_TICK_SECONDS = float(os.getenv("PREFETCH_TICK_SECONDS", "30"))
+PREFETCH_STATUS_URL = os.getenv("PREFETCH_STATUS_URL", "")
+
+ACTIVE_STATES = ["transcribing", "translating"]
+STATS_ID = "stats"
+
+
+def candidate_id(video_id, source_language):
+    return f"{video_id}:{source_language}"
+
+
+def _targets(source_language, observed=()):
+    targets = []
+    for language in [*observed, *PREFETCH_TARGET_LANGUAGES]:
+        if language and language != source_language and language not in targets:
+            targets.append(language)
+    return targets[:PREFETCH_MAX_TARGETS]
+
+
+class PrefetchQueue:
+    """Candidates in `collection`, one per (video_id, source_language); counters in `stats_collection`."""
+    def __init__(self, collection, stats_collection):
+        self.collection = collection
+        self.stats_collection = stats_collection
+        self.collection.create_index([("state", 1), ("score", -1)])
+        self.collection.create_index([("video_id", 1), ("source_language", 1)])
+
+    def add(self, video_id, video_url, source_language, target_languages, score, origin):
+        """Insert a candidate or raise the score and targets of an existing one."""
+        self.collection.update_one(
+            {"_id": candidate_id(video_id, source_language)},
+            {
+                "$setOnInsert": {
+                    "video_id": video_id,
+                    "video_url": video_url,
+                    "source_language": source_language,
+                    "state": "candidate",
+                    "tasks": {},
+                    "hits": {},
+                    "attempts": 0,
+                    "enqueued_at": datetime.now(),
+                },
+                "$max": {"score": score},
+                "$addToSet": {"target_languages": {"$each": list(target_languages)}, "origins": origin},
+            },
+            upsert=True
+        )
+
+    def seed_from_requests(self, tasks_collection, now=None, window_hours=PREFETCH_WINDOW_HOURS,
+                           min_requests=PREFETCH_MIN_REQUESTS, limit=PREFETCH_SEED_LIMIT):
+        """
+        Add the videos requested most often in the recent window. The score is the
+        request count with each request weighted down linearly by its age.
+        """
+        now = now or datetime.now()
+        since = now - timedelta(hours=window_hours)
+        pipeline = [
+            {"$match": {
+                "created_at": {"$gte": since},
+                "video_id": {"$exists": True},
+                "prefetch": {"$ne": True},
+                "user_id": {"$ne": PREFETCH_USER_ID},
+            }},
+            {"$group": {
+                "_id": {"video_id": "$video_id", "source_language": "$source_language"},
+                "video_url": {"$first": "$video_url"},
+                "requests": {"$sum": 1},
+                "targets": {"$addToSet": "$target_language"},
+                "created_at": {"$push": "$created_at"},
+            }},
+            {"$match": {"requests": {"$gte": min_requests}}},
+            {"$sort": {"requests": -1}},
+            {"$limit": limit},
+        ]
+        seeded = 0
+        for row in tasks_collection.aggregate(pipeline):
+            window = window_hours * 3600
+            score = sum(max(0.0, 1 - (now - created).total_seconds() / window) for created in row["created_at"])
+            source_language = row["_id"]["source_language"] or "en"
+            self.add(row["_id"]["video_id"], row["video_url"], source_language,
+                     _targets(source_language, row["targets"]), round(score, 3), "requests")
+            seeded += 1
+        return seeded
+
+    def claim(self, from_state, to_state, **fields):
+        """Move the best-scoring candidate in `from_state` to `to_state`, or return None."""
+        return self.collection.find_one_and_update(
+            {"state": from_state},
+            {"$set": {"state": to_state, "updated_at": datetime.now(), **fields}, "$inc": {"attempts": 1}},
+            sort=[("score", -1), ("enqueued_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def record_hit(self, video_id, source_language, target_language):
+        """Count a request served from subtitles that prefetch produced."""
+        self.collection.update_one(
+            {"_id": candidate_id(video_id, source_language), f"tasks.{target_language}.status": "completed"},
+            {"$inc": {f"hits.{target_language}": 1}}
+        )
+
+    def record_capacity(self, spare_slots, used_slots):
+        """Accumulate, per tick, the STT slots that were spare and the ones prefetch held."""
+        self.stats_collection.update_one(
+            {"_id": STATS_ID},
+            {"$inc": {"ticks": 1, "spare_slot_ticks": spare_slots, "prefetch_slot_ticks": used_slots}},
+            upsert=True
+        )
+
+    def report(self):
+        states = {row["_id"]: row["count"] for row in self.collection.aggregate(
+            [{"$group": {"_id": "$state", "count": {"$sum": 1}}}]
+        )}
+        prefetched = hit = hits = 0
+        for candidate in self.collection.find({}, {"tasks": 1, "hits": 1}):
+            for target, task in (candidate.get("tasks") or {}).items():
+                if task.get("status") == "completed":
+                    prefetched += 1
+                    count = (candidate.get("hits") or {}).get(target, 0)
+                    hits += count
+                    hit += 1 if count else 0
+        capacity = self.stats_collection.find_one({"_id": STATS_ID}) or {}
+        spare = capacity.get("spare_slot_ticks", 0)
+        return {
+            "candidates": states,
+            "prefetched_pairs": prefetched,
+            "pairs_hit": hit,
+            "hit_rate": round(hit / prefetched, 3) if prefetched else None,
+            "requests_served": hits,
+            "ticks": capacity.get("ticks", 0),
+            "spare_capacity_used": round(capacity.get("prefetch_slot_ticks", 0) / spare, 3) if spare else None,
+        }
+
+
+def http_status_poller(url=PREFETCH_STATUS_URL, timeout=60):
+    """Poll a task through the deployed subtitle_task_status function, as a client would."""
+    def poll(task_id):
+        request = urllib.request.Request(
+            url, data=json.dumps({"task_id": task_id}).encode("utf-8"),
+            headers={"Content-Type": "application/json"}, method="POST"
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                return json.loads(response.read().decode("utf-8"))
+        except urllib.error.HTTPError as e:
+            return json.loads(e.read().decode("utf-8") or "{}")
+    return poll
+
+
+class PrefetchRunner:
+    """
+    One tick at a time: advance running candidates, then start new ones in spare
+    STT capacity. `start` is process_youtube_audio; `subtitle_exists` is
+    check_subtitle_exists; `poll_status` returns the status function's JSON for a task id.
+    """
+    def __init__(self, queue, scheduler, start, subtitle_exists, poll_status, bucket_name,
+                 idle_share=PREFETCH_IDLE_SHARE, max_active=PREFETCH_MAX_ACTIVE):
+        self.queue = queue
+        self.scheduler = scheduler
+        self.start = start
+        self.subtitle_exists = subtitle_exists
+        self.poll_status = poll_status
+        self.bucket_name = bucket_name
+        self.idle_share = idle_share
+        self.max_active = max_active
+
+    def spare_slots(self):
+        """STT slots prefetch may take now: none while users wait, at most idle_share of the total."""
+        stats = self.scheduler.stats(user_id=PREFETCH_USER_ID)
+        user_queued = stats["queued"] - stats["user_queued"]
+        if user_queued > 0:
+            return 0, stats
+        budget = int(stats["max_inflight"] * self.idle_share) - stats["user_inflight"] - stats["user_queued"]
+        free = stats["max_inflight"] - stats["inflight"]
+        return max(0, min(budget, free)), stats
+
+    def _start_target(self, candidate, target_language):
+        task_id = f"prefetch-{uuid.uuid4().hex[:16]}"
+        result = self.start(
+            candidate["video_url"], self.bucket_name, candidate["source_language"], target_language,
+            PREFETCH_USER_ID, task_id, prefetch=True
+        )
+        status = "failed" if "error" in result else "running"
+        if result.get("message") == "Audio already exists.":
+            status = "existing"
+        update = {f"tasks.{target_language}": {"task_id": task_id, "status": status, "error": result.get("error")}}
+        self.queue.collection.update_one({"_id": candidate["_id"]}, {"$set": update})
+        return status
+
+    def _advance(self, candidate):
+        """Poll a running candidate's tasks and move it along when they finish."""
+        tasks = candidate.get("tasks") or {}
+        for target_language, task in tasks.items():
+            if task["status"] != "running":
+                continue
+            response = self.poll_status(task["task_id"]) or {}
+            if response.get("status") == "completed":
+                task["status"] = "completed"
+            elif response.get("status") == "error" or (response.get("error") and not response.get("status")):
+                task["status"] = "failed"
+                task["error"] = response.get("message") or response.get("error")
+        self.queue.collection.update_one({"_id": candidate["_id"]}, {"$set": {"tasks": tasks}})
+
+        if any(task["status"] == "running" for task in tasks.values()):
+            return candidate["state"]
+        if candidate["state"] == "transcribing":
+            first = next(iter(tasks.values()), {})
+            if first.get("status") == "failed":
+                state = "candidate" if candidate["attempts"] < PREFETCH_MAX_ATTEMPTS else "failed"
+                self.queue.collection.update_one({"_id": candidate["_id"]}, {"$set": {"state": state, "tasks": {}}})
+                return state
+            # The transcript is stored now; the other targets only translate and render.
+            for target_language in candidate["target_languages"]:
+                if target_language not in tasks:
+                    self._start_target(candidate, target_language)
+            self.queue.collection.update_one({"_id": candidate["_id"]}, {"$set": {"state": "translating"}})
+            return "translating"
+        self.queue.collection.update_one(
+            {"_id": candidate["_id"]}, {"$set": {"state": "done", "finished_at": datetime.now()}}
+        )
+        return "done"
+
+    def tick(self):
+        """Run one round. Returns a summary of what happened."""
+        summary = {"advanced": 0, "started": 0, "skipped": 0, "spare_slots": 0}
+        active = list(self.queue.collection.find({"state": {"$in": ACTIVE_STATES}}))
+        for candidate in active:
+            try:
+                self._advance(candidate)
+                summary["advanced"] += 1
+            except Exception as e:
+                logger.error(f"Error advancing prefetch of {candidate['_id']}: {e}")
+
+        spare, stats = self.spare_slots()
+        summary["spare_slots"] = spare
+        running = self.queue.collection.count_documents({"state": {"$in": ACTIVE_STATES}})
+        while spare > 0 and running < self.max_active:
+            candidate = self.queue.claim("candidate", "transcribing")
+            if candidate is None:
+                break
+            pending = [
+                language for language in candidate["target_languages"]
+                if not self.subtitle_exists(self.bucket_name, candidate["video_id"],
+                                            candidate["source_language"], language)
+            ]
+            if not pending:
+                self.queue.collection.update_one({"_id": candidate["_id"]}, {"$set": {"state": "done"}})
+                summary["skipped"] += 1
+                continue
+            candidate["target_languages"] = pending
+            self.queue.collection.update_one({"_id": candidate["_id"]}, {"$set": {"target_languages": pending}})
+            status = self._start_target(candidate, pending[0])
+            if status == "failed":
+                state = "candidate" if candidate["attempts"] < PREFETCH_MAX_ATTEMPTS else "failed"
+                self.queue.collection.update_one({"_id": candidate["_id"]}, {"$set": {"state": state, "tasks": {}}})
+                continue
+            summary["started"] += 1
+            running += 1
+            spare -= 1
+
+        after = self.scheduler.stats(user_id=PREFETCH_USER_ID)
+        self.queue.record_capacity(summary["spare_slots"] + stats["user_inflight"], after["user_inflight"])
+        return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed", action="store_true", help="add candidates from recent request counts")
+    parser.add_argument("--add", nargs="*", default=[], help="admin-submitted video URLs")
+    parser.add_argument("--source-language", default="en")
+    parser.add_argument("--targets", help="comma-separated targets for --add (default PREFETCH_TARGET_LANGUAGES)")
+    parser.add_argument("--ticks", type=int, default=0, help="runner ticks to run, 0 for none")
+    parser.add_argument("--interval", type=float, default=PREFETCH_TICK_SECONDS)
+    parser.add_argument("--bucket", default="tube_genius")
+    parser.add_argument("--report", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    import task_process
+    queue = task_process.prefetch_queue
+    if args.seed:
+        print(json.dumps({"seeded": queue.seed_from_requests(task_process.collection)}))
+    for video_url in args.add:
+        video_id = task_process.get_video_id(video_url)
+        if not video_id:
+            logger.error(f"Not a YouTube video URL: {video_url}")
+            continue
+        targets = args.targets.split(",") if args.targets else _targets(args.source_language)
+        queue.add(video_id, video_url, args.source_language, targets, PREFETCH_ADMIN_SCORE, "admin")
+
+    if args.ticks:
+        if not PREFETCH_STATUS_URL:
+            raise SystemExit("PREFETCH_STATUS_URL must point at the subtitle_task_status function")
+        runner = PrefetchRunner(
+            queue, task_process.stt_scheduler, task_process.process_youtube_audio,
+            task_process.check_subtitle_exists, http_status_poller(), args.bucket
+        )
+        for tick in range(args.ticks):
+            if tick:
+                time.sleep(args.interval)
+            print(json.dumps(runner.tick()), flush=True)
+    if args.report:
+        print(json.dumps(queue.report(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+import os
+import abc
+import random
+import asyncio
+import time
+import zlib
+import logging
+import threading
+from datetime import datetime
+from google.api_core.exceptions import ResourceExhausted
+from google.cloud import speech_v1
+from resilience import call, call_async
+
+logger = logging.getLogger(__name__)
+
+RECOGNIZER_BACKEND = os.getenv("RECOGNIZER_BACKEND", "gcp")
+
+# Local engine configuration
+LOCAL_RECOGNIZER_LATENCY = os.getenv("LOCAL_RECOGNIZER_LATENCY", "lognormal:1.0,0.5")
+LOCAL_RECOGNIZER_AUDIO_SECONDS = float(os.getenv("LOCAL_RECOGNIZER_AUDIO_SECONDS", "60"))
+LOCAL_RECOGNIZER_ERROR_RATE = float(os.getenv("LOCAL_RECOGNIZER_ERROR_RATE", "0"))
+LOCAL_RECOGNIZER_QUOTA = int(os.getenv("LOCAL_RECOGNIZER_QUOTA", "0"))  # concurrent operations, 0 = unlimited
+LOCAL_RECOGNIZER_POLL_LATENCY = float(os.getenv("LOCAL_RECOGNIZER_POLL_LATENCY", "0"))  # seconds per poll RPC
+# Language the synthetic audio is "spoken" in; empty means whatever language was requested.
+LOCAL_RECOGNIZER_SPOKEN_LANGUAGE = os.getenv("LOCAL_RECOGNIZER_SPOKEN_LANGUAGE", "")
+
+LOCAL_VOCABULARY = [
+    "the", "video", "shows", "how", "a", "network", "learns", "to", "recognize",
+    "digits", "with", "layers", "of", "neurons", "and", "weights", "that", "change",
+    "during", "training", "we", "will", "see", "each", "step", "in", "detail",
+]
+
+
+class Recognizer(abc.ABC):
+    """
+    Speech recognition backend used by the transcription pipeline.
+
+    submit() starts recognition of audio stored at a GCS URI and returns an operation id.
+    poll() returns {"done": bool, "error": str or None, "completed_at": datetime or None}
+    for that operation, where completed_at is when the engine finished it (local
+    naive time, like the task checkpoints) if known; poll_async() is the same for
+    asyncio callers.
+    fetch_results() returns the results of a finished operation as a list of
+    {"transcript", "confidence", "words": [{"word", "start_time", "end_time"}]}.
+    identify_language() recognizes a short LINEAR16 sample synchronously and returns
+    one {"language_code", "confidence", "words"} per result, where language_code
+    is whichever of the candidate languages the engine judged was spoken.
+    """
+    @abc.abstractmethod
+    def submit(self, gcs_uri, language_code, audio_seconds=None):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def poll(self, operation_id):
+        raise NotImplementedError
+
+    async def poll_async(self, operation_id):
+        return await asyncio.to_thread(self.poll, operation_id)
+
+    @abc.abstractmethod
+    def fetch_results(self, operation_id):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def identify_language(self, content, language_code, alternative_language_codes, sample_rate=16000):
+        raise NotImplementedError
+
+
+class GcpRecognizer(Recognizer):
+    """
+    Google Cloud Speech-to-Text long-running recognition.
+    `async_client_factory` builds a SpeechAsyncClient for poll_async(); it is
+    called lazily because gRPC asyncio channels belong to the running event loop.
+    """
+    def __init__(self, speech_client, model="video", async_client_factory=None):
+        self.speech_client = speech_client
+        self.model = model
+        self.async_client_factory = async_client_factory
+        self._async_client = None
+
+    def submit(self, gcs_uri, language_code, audio_seconds=None):
+        audio = speech_v1.RecognitionAudio(uri=gcs_uri)
+        config = speech_v1.RecognitionConfig(
+            encoding=speech_v1.RecognitionConfig.AudioEncoding.LINEAR16,
+            sample_rate_hertz=16000,
+            language_code=language_code,
+            enable_automatic_punctuation=True,
+            enable_word_time_offsets=True,
+            model=self.model
+        )
+        operation = call("speech", self.speech_client.long_running_recognize, config=config, audio=audio)
+        return operation.operation.name
+
+    def identify_language(self, content, language_code, alternative_language_codes, sample_rate=16000):
+        config = speech_v1.RecognitionConfig(
+            encoding=speech_v1.RecognitionConfig.AudioEncoding.LINEAR16,
+            sample_rate_hertz=sample_rate,
+            language_code=language_code,
+            alternative_language_codes=list(alternative_language_codes),
+            model="default"
+        )
+        response = call(
+            "speech", self.speech_client.recognize,
+            config=config, audio=speech_v1.RecognitionAudio(content=content), idempotent=True
+        )
+        return [
+            {
+                "language_code": result.language_code or language_code,
+                "confidence": result.alternatives[0].confidence,
+                "words": len(result.alternatives[0].transcript.split()),
+            }
+            for result in response.results if result.alternatives
+        ]
+
+    def _get_operation(self, operation_id):
+        return call(
+            "speech_operations", self.speech_client.transport.operations_client.get_operation, operation_id,
+            idempotent=True, hedge=True, pass_timeout=True
+        )
+
+    @staticmethod
+    def _completed_at(operation):
+        """The operation's last update time from its metadata, which for a done operation is when it finished."""
+        try:
+            metadata = speech_v1.LongRunningRecognizeMetadata.deserialize(operation.metadata.value)
+            if not metadata.last_update_time:
+                return None
+            return datetime.fromtimestamp(metadata.last_update_time.timestamp())
+        except Exception as e:
+            logger.warning(f"Could not read operation metadata: {e}")
+            return None
+
+    def _operation_status(self, operation):
+        if not operation.done:
+            return {"done": False, "error": None, "completed_at": None}
+        if operation.error.code:
+            return {"done": True, "error": operation.error.message, "completed_at": self._completed_at(operation)}
+        return {"done": True, "error": None, "completed_at": self._completed_at(operation)}
+
+    def poll(self, operation_id):
+        return self._operation_status(self._get_operation(operation_id))
+
+    async def poll_async(self, operation_id):
+        if self.async_client_factory is None:
+            return await super().poll_async(operation_id)
+        if self._async_client is None:
+            self._async_client = self.async_client_factory()
+        operation = await call_async(
+            "speech_operations", self._async_client.transport.operations_client.get_operation, operation_id,
+            idempotent=True
+        )
+        return self._operation_status(operation)
+
+    def fetch_results(self, operation_id):
+        operation = self._get_operation(operation_id)
+        if not operation.done:
+            return None
+        response = speech_v1.LongRunningRecognizeResponse.deserialize(operation.response.value)
+
+        results = []
+        for result in response.results:
+            if not result.alternatives:
+                continue
+            alternative = result.alternatives[0]
+            results.append({
+                "transcript": alternative.transcript,
+                "confidence": alternative.confidence,
+                "words": [
+                    {
+                        "word": word.word,
+                        "start_time": word.start_time.total_seconds(),
+                        "end_time": word.end_time.total_seconds(),
+                    }
+                    for word in alternative.words
+                ],
+            })
+        return results
+
+
+def parse_latency_distribution(spec):
+    """
+    Parse a latency distribution such as "fixed:2", "uniform:1,5",
+    "exponential:3" or "lognormal:1.0,0.5" into a sampler taking a random.Random.
+    All values are in seconds.
+    """
+    kind, _, params = spec.partition(":")
+    values = [float(value) for value in params.split(",") if value]
+    if kind == "fixed":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "exponential":
+        return lambda rng: rng.expovariate(1.0 / values[0])
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(values[0], values[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class LocalRecognizer(Recognizer):
+    """
+    Deterministic CPU-only recognizer for load testing and profiling.
+
+    The operation id encodes the seed, submit time, sampled latency and audio
+    length, so any process can poll or fetch it without shared state. The same
+    audio URI and language always produce the same words and latency.
+
+    With a quota, submit() raises ResourceExhausted while that many operations
+    are running, like the Speech concurrent-operation quota. Running operations
+    are counted per process, across all instances.
+    """
+    _running = []
+    _running_lock = threading.Lock()
+
+    def __init__(self, latency=LOCAL_RECOGNIZER_LATENCY, audio_seconds=LOCAL_RECOGNIZER_AUDIO_SECONDS,
+                 error_rate=LOCAL_RECOGNIZER_ERROR_RATE, quota=LOCAL_RECOGNIZER_QUOTA,
+                 poll_latency=LOCAL_RECOGNIZER_POLL_LATENCY, spoken_language=LOCAL_RECOGNIZER_SPOKEN_LANGUAGE,
+                 clock=time.time):
+        self.sample_latency = parse_latency_distribution(latency)
+        self.audio_seconds = audio_seconds
+        self.error_rate = error_rate
+        self.quota = quota
+        self.poll_latency = poll_latency
+        self.spoken_language = spoken_language
+        self.clock = clock
+
+    def running_operations(self):
+        now_ms = self.clock() * 1000
+        with self._running_lock:
+            self._running[:] = [done_ms for done_ms in self._running if done_ms > now_ms]
+            return len(self._running)
+
+    def submit(self, gcs_uri, language_code, audio_seconds=None):
+        seed = zlib.crc32(f"{gcs_uri}|{language_code}".encode("utf-8"))
+        rng = random.Random(seed)
+        latency_ms = int(self.sample_latency(rng) * 1000)
+        audio_ms = int((audio_seconds or self.audio_seconds) * 1000)
+        submitted_ms = int(self.clock() * 1000)
+        if self.quota:
+            if self.running_operations() >= self.quota:
+                raise ResourceExhausted(f"Concurrent operation quota of {self.quota} exceeded")
+            with self._running_lock:
+                self._running.append(submitted_ms + latency_ms)
+        return f"local-{seed:x}-{submitted_ms}-{latency_ms}-{audio_ms}"
+
+    @staticmethod
+    def _decode(operation_id):
+        _, seed, submitted_ms, latency_ms, audio_ms = operation_id.split("-")
+        return int(seed, 16), int(submitted_ms), int(latency_ms), int(audio_ms)
+
+    def poll(self, operation_id):
+        if self.poll_latency:
+            time.sleep(self.poll_latency)
+        return self._status(operation_id)
+
+    async def poll_async(self, operation_id):
+        if self.poll_latency:
+            await asyncio.sleep(self.poll_latency)
+        return self._status(operation_id)
+
+    def _status(self, operation_id):
+        seed, submitted_ms, latency_ms, _ = self._decode(operation_id)
+        if self.clock() * 1000 < submitted_ms + latency_ms:
+            return {"done": False, "error": None, "completed_at": None}
+        completed_at = datetime.fromtimestamp((submitted_ms + latency_ms) / 1000)
+        if random.Random(seed ^ 0x5EED).random() < self.error_rate:
+            return {"done": True, "error": "Synthetic recognition failure", "completed_at": completed_at}
+        return {"done": True, "error": None, "completed_at": completed_at}
+
+    def fetch_results(self, operation_id):
+        if not self._status(operation_id)["done"]:
+            return None
+        seed, _, _, audio_ms = self._decode(operation_id)
+        rng = random.Random(seed)
+
+        results = []
+        position = 0.0
+        audio_seconds = audio_ms / 1000.0
+        while position < audio_seconds:
+            words = []
+            for _ in range(rng.randint(6, 14)):
+                duration = rng.uniform(0.15, 0.6)
+                if position + duration > audio_seconds:
+                    break
+                words.append({
+                    "word": rng.choice(LOCAL_VOCABULARY),
+                    "start_time": round(position, 3),
+                    "end_time": round(position + duration, 3),
+                })
+                position += duration + rng.uniform(0.0, 0.2)
+            if not words:
+                break
+            results.append({
+                "transcript": " ".join(word["word"] for word in words),
+                "confidence": round(rng.uniform(0.8, 0.99), 3),
+                "words": words,
+            })
+            position += rng.uniform(0.3, 1.0)
+        return results
+
+    def identify_language(self, content, language_code, alternative_language_codes, sample_rate=16000):
+        rng = random.Random(zlib.crc32(content))
+        candidates = [language_code, *alternative_language_codes]
+        spoken = next(
+            (code for code in candidates if self.spoken_language
+             and code.lower().split("-")[0] == self.spoken_language.lower().split("-")[0]),
+            None
+        )
+        if self.spoken_language and spoken is None:
+            # None of the candidates: the engine transcribes noise in the primary language.
+            return [{"language_code": language_code.lower(), "confidence": round(rng.uniform(0.2, 0.4), 3),
+                     "words": rng.randint(0, 3)}]
+        seconds = len(content) / (2.0 * sample_rate)
+        return [{
+            "language_code": (spoken or language_code).lower(),
+            "confidence": round(rng.uniform(0.8, 0.99), 3),
+            "words": max(1, int(seconds * rng.uniform(1.8, 2.8))),
+        }]
+
+
+def get_recognizer(speech_client=None, backend=RECOGNIZER_BACKEND, async_client_factory=None):
+    """Build the recognizer selected by RECOGNIZER_BACKEND ("gcp" or "local")."""
+    if backend == "local":
+        logger.info("Using local synthetic recognizer")
+        return LocalRecognizer()
+    if backend == "gcp":
+        return GcpRecognizer(speech_client, async_client_factory=async_client_factory)
+    raise ValueError(f"Unknown recognizer backend: {backend}")
@@ -0,0 +1,320 @@
+import os
+import time
+import asyncio
+import random
+import logging
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from google.api_core import exceptions as api_exceptions
+
+logger = logging.getLogger(__name__)
+
+RETRY_ATTEMPTS = int(os.getenv("RETRY_ATTEMPTS", "4"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.2"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "5"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+HEDGE_WORKERS = int(os.getenv("HEDGE_WORKERS", "16"))
+# Share of hedgeable calls that may send a duplicate, so a slow dependency sees at most this much extra load.
+HEDGE_BUDGET = float(os.getenv("HEDGE_BUDGET", "0.1"))
+
+TRANSIENT_ERRORS = (
+    api_exceptions.TooManyRequests,
+    api_exceptions.InternalServerError,
+    api_exceptions.BadGateway,
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.GatewayTimeout,
+    api_exceptions.DeadlineExceeded,
+    ConnectionError,
+    TimeoutError,
+)
+
+
+class CircuitOpenError(Exception):
+    """Raised when a dependency's circuit breaker is open."""
+
+
+class DeadlineExceededError(Exception):
+    """Raised when the request deadline runs out before a call could be made."""
+
+
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+
+@contextmanager
+def deadline(seconds, restart=False):
+    """
+    Set a deadline for all cloud calls made inside the block.
+    Nested deadlines can only shorten the outer one, unless `restart` replaces it,
+    e.g. for work that carries its remaining budget through a queue.
+    """
+    expires_at = time.monotonic() + seconds
+    outer = _deadline.get()
+    if outer is not None and not restart:
+        expires_at = min(expires_at, outer)
+    token = _deadline.set(expires_at)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time():
+    """Seconds left before the current deadline, or None when there is none."""
+    expires_at = _deadline.get()
+    if expires_at is None:
+        return None
+    return max(expires_at - time.monotonic(), 0.0)
+
+
+class CircuitBreaker:
+    """
+    Per-dependency breaker: opens after `failure_threshold` consecutive transient
+    failures and lets a single trial call through once `reset_seconds` have passed.
+    """
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def before_call(self):
+        with self._lock:
+            state = self.state
+            if state == "open" or (state == "half_open" and self._trial_in_flight):
+                raise CircuitOpenError(f"Circuit for {self.name} is open")
+            if state == "half_open":
+                self._trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.failures >= self.failure_threshold or self.opened_at is not None:
+                if self.opened_at is None:
+                    logger.warning(f"Opening circuit for {self.name} after {self.failures} failures")
+                self.opened_at = time.monotonic()
+
+
+class LatencyTracker:
+    """Rolling window of call latencies used to decide when to hedge."""
+    def __init__(self, size=200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, fraction):
+        with self._lock:
+            if len(self._samples) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class HedgeBudget:
+    """
+    Token bucket for duplicates: every hedgeable call earns `fraction` of a token
+    and a hedge spends a whole one, so at most that share of calls are hedged.
+    """
+    def __init__(self, fraction=HEDGE_BUDGET, max_tokens=10):
+        self.fraction = fraction
+        self.max_tokens = max_tokens
+        self._tokens = 0.0
+        self._lock = threading.Lock()
+
+    def earn(self):
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.fraction)
+
+    def spend(self):
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+_breakers = {}
+_latencies = {}
+_hedge_budgets = {}
+_registry_lock = threading.Lock()
+_hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="hedge")
+
+
+def get_breaker(dependency):
+    with _registry_lock:
+        if dependency not in _breakers:
+            _breakers[dependency] = CircuitBreaker(dependency)
+            _latencies[dependency] = LatencyTracker()
+            _hedge_budgets[dependency] = HedgeBudget()
+        return _breakers[dependency]
+
+
+def _timed_call(dependency, fn, args, kwargs):
+    started = time.monotonic()
+    result = fn(*args, **kwargs)
+    _latencies[dependency].record(time.monotonic() - started)
+    return result
+
+
+def _start_thread(fn, *args):
+    """Run fn on a thread of its own and return a Future for its result."""
+    future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+    threading.Thread(target=run, name="hedge-primary", daemon=True).start()
+    return future
+
+
+def _hedged_call(dependency, fn, args, kwargs):
+    """
+    Run fn; if it outlives the dependency's p95 latency and the hedge budget allows,
+    race a duplicate against it. The primary starts at once on its own thread, so
+    it is never queued behind other calls and the hedge delay measures the call alone.
+    """
+    hedge_after = _latencies[dependency].percentile(HEDGE_PERCENTILE)
+    if hedge_after is None:
+        return _timed_call(dependency, fn, args, kwargs)
+
+    budget = _hedge_budgets[dependency]
+    budget.earn()
+    context = contextvars.copy_context()
+    futures = [_start_thread(context.copy().run, _timed_call, dependency, fn, args, kwargs)]
+    done, _ = wait(futures, timeout=hedge_after)
+    if not done and budget.spend():
+        logger.info(f"Hedging {dependency} call after {hedge_after:.3f}s")
+        futures.append(_hedge_executor.submit(context.copy().run, _timed_call, dependency, fn, args, kwargs))
+
+    error = None
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, timeout=remaining_time(), return_when=FIRST_COMPLETED)
+        if not done:
+            raise DeadlineExceededError(f"Deadline exceeded waiting for {dependency}")
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+def call(dependency, fn, *args, idempotent=False, hedge=False, pass_timeout=False, **kwargs):
+    """
+    Call a cloud dependency through its circuit breaker.
+
+    Idempotent calls are retried on transient errors with full-jitter exponential
+    backoff, bounded by the current deadline. `hedge` races a duplicate request
+    when the call runs past the dependency's p95 latency; use it only for
+    idempotent reads. `pass_timeout` forwards the remaining deadline as `timeout=`.
+    """
+    breaker = get_breaker(dependency)
+    attempts = RETRY_ATTEMPTS if idempotent else 1
+
+    for attempt in range(1, attempts + 1):
+        left = remaining_time()
+        if left is not None and left <= 0:
+            raise DeadlineExceededError(f"Deadline exceeded before calling {dependency}")
+        if pass_timeout and left is not None:
+            kwargs["timeout"] = left
+
+        breaker.before_call()
+        try:
+            if hedge and idempotent:
+                result = _hedged_call(dependency, fn, args, kwargs)
+            else:
+                result = _timed_call(dependency, fn, args, kwargs)
+        except TRANSIENT_ERRORS as e:
+            breaker.record_failure()
+            if attempt == attempts:
+                raise
+            delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** (attempt - 1))))
+            left = remaining_time()
+            if left is not None and delay >= left:
+                raise
+            logger.warning(f"Transient {dependency} error (attempt {attempt}/{attempts}): {e}")
+            time.sleep(delay)
+            continue
+        except Exception:
+            # Non-transient errors (not found, bad request) say nothing about dependency health.
+            breaker.record_success()
+            raise
+        breaker.record_success()
+        return result
+
+
+async def _timed_call_async(dependency, fn, args, kwargs):
+    started = time.monotonic()
+    result = await fn(*args, **kwargs)
+    _latencies[dependency].record(time.monotonic() - started)
+    return result
+
+
+async def call_async(dependency, fn, *args, idempotent=False, pass_timeout=False, **kwargs):
+    """
+    Await a coroutine function of a cloud dependency through its circuit breaker.
+    Same retry, breaker and deadline behaviour as call(); the remaining deadline
+    also bounds the await itself. Hedging is not done on this path.
+    """
+    breaker = get_breaker(dependency)
+    attempts = RETRY_ATTEMPTS if idempotent else 1
+
+    for attempt in range(1, attempts + 1):
+        left = remaining_time()
+        if left is not None and left <= 0:
+            raise DeadlineExceededError(f"Deadline exceeded before calling {dependency}")
+        if pass_timeout and left is not None:
+            kwargs["timeout"] = left
+
+        breaker.before_call()
+        try:
+            result = await asyncio.wait_for(_timed_call_async(dependency, fn, args, kwargs), timeout=left)
+        except asyncio.TimeoutError:
+            breaker.record_failure()
+            raise DeadlineExceededError(f"Deadline exceeded waiting for {dependency}")
+        except TRANSIENT_ERRORS as e:
+            breaker.record_failure()
+            if attempt == attempts:
+                raise
+            delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** (attempt - 1))))
+            left = remaining_time()
+            if left is not None and delay >= left:
+                raise
+            logger.warning(f"Transient {dependency} error (attempt {attempt}/{attempts}): {e}")
+            await asyncio.sleep(delay)
+            continue
+        except Exception:
+            breaker.record_success()
+            raise
+        breaker.record_success()
+        return result
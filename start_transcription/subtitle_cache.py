@@ -0,0 +1,100 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+SUBTITLE_CACHE_MAX_BYTES = int(os.getenv("SUBTITLE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# Kept well below the one-hour lifetime of the signed URLs stored with each entry.
+SUBTITLE_CACHE_TTL_SECONDS = float(os.getenv("SUBTITLE_CACHE_TTL_SECONDS", "900"))
+INLINE_MAX_BYTES = int(os.getenv("INLINE_MAX_BYTES", str(64 * 1024)))
+
+
+class SubtitleCache:
+    """
+    Bounded in-process cache of rendered subtitles keyed by (video_id, src, tgt).
+    Entries hold the subtitle bytes (optional) and metadata such as the signed URL.
+    Eviction is least-recently-used by total size, plus a per-entry TTL.
+    """
+    def __init__(self, max_bytes=SUBTITLE_CACHE_MAX_BYTES, ttl_seconds=SUBTITLE_CACHE_TTL_SECONDS,
+                 clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def _entry_size(content, metadata):
+        return len(content or b"") + sum(len(str(value)) for value in metadata.values())
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._size -= entry["size"]
+
+    def get(self, key):
+        """Return {"content", "metadata"} for a fresh entry, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if self.clock() >= entry["expires_at"]:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return {"content": entry["content"], "metadata": entry["metadata"]}
+
+    def put(self, key, content=None, **metadata):
+        """Insert or replace an entry, evicting least-recently-used entries to fit."""
+        size = self._entry_size(content, metadata)
+        if size > self.max_bytes:
+            return False
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            while self._entries and self._size + size > self.max_bytes:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self._size -= evicted["size"]
+                self.evictions += 1
+                logger.debug(f"Evicted subtitle cache entry {evicted_key}")
+            self._entries[key] = {
+                "content": content,
+                "metadata": metadata,
+                "size": size,
+                "expires_at": self.clock() + self.ttl_seconds,
+            }
+            self._size += size
+        return True
+
+    def invalidate(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+subtitle_cache = SubtitleCache()
@@ -1,13 +1,29 @@
 import json
 import os
 import logging
+import time
+import contextvars
 import yt_dlp
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from google.cloud import storage
 from google.oauth2 import service_account
 from datetime import datetime
 from datetime import timedelta
 from urllib.parse import urlparse, parse_qs
-from helper import convert_audio_to_wav, upload_to_gcs
+from helper import convert_audio_to_wav, upload_to_gcs, probe_audio_duration
+from recognizer import get_recognizer
+from resilience import call
+from subtitle_cache import subtitle_cache
+from object_lifecycle import AccessLog
+from workspace import job_workspace, WORKSPACE_QUOTA_BYTES
+from checkpoints import record_stage, stage_artifacts, stage_reached
+from fingerprint import FINGERPRINT_MIN_COVERAGE, fingerprint_file, index_fingerprints, match_fingerprints, span_coverage
+from stt_scheduler import SttScheduler
+from captions import fetch_caption_results
+from language_detection import LANGUAGE_DETECTION_ENABLED, detect_language, read_samples
+from video_metadata import VideoMetadataCache, VideoRejected, admit_video, video_cost
+from transcript_store import encode_transcript, save_transcript, transcript_blob_name
+from prefetch import PrefetchQueue, PREFETCH_STT_WEIGHT
 from pymongo import MongoClient
 from google.cloud import speech_v1
 from google.cloud import storage, translate_v2 as translate
@@ -24,6 +40,7 @@ SERVICE_ACCOUNT_KEY_FILE = "service-account-key.json"
 credentials = service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_KEY_FILE)
 storage_client = storage.Client(credentials=credentials)
 speech_client = speech_v1.SpeechClient(credentials=credentials)
+recognizer = get_recognizer(speech_client)
 # Add the FFmpeg binary to the PATH environment variable
 bin_path = os.path.abspath("bin")  # Path to the bin directory containing ffmpeg and ffprobe
 os.environ["PATH"] += os.pathsep + bin_path
@@ -41,6 +58,25 @@ COLLECTION_NAME = "SubtitledVideos"
 mongo_client = MongoClient(MONGO_URI)
 db = mongo_client[DB_NAME]
 collection = db[COLLECTION_NAME]
+bulk_collection = db["SubtitleBatches"]
+fingerprint_collection = db["AudioFingerprints"]
+access_log = AccessLog(db["ObjectAccess"])
+prefetch_queue = PrefetchQueue(db["PrefetchQueue"], db["PrefetchStats"])
+fingerprint_collection.create_index("h")
+fingerprint_collection.create_index("v")
+stt_scheduler = SttScheduler(db["SttQueue"], db["SttSlots"], collection, recognizer, users_collection=db.users)
+video_metadata = VideoMetadataCache(db["VideoMetadata"])
+
+# Bulk submission configuration
+BULK_MAX_CONCURRENCY = int(os.getenv("BULK_MAX_CONCURRENCY", "4"))
+BULK_MAX_VIDEOS = int(os.getenv("BULK_MAX_VIDEOS", "50"))
+COINS_PER_VIDEO = 100
+COINS_PER_CACHED_VIDEO = 25
+
+# Download profile: the audio is resampled to 16 kHz mono before STT, so the
+# smallest audio-only format above this bitrate (kbps) carries enough signal.
+AUDIO_MIN_ABR = int(os.getenv("AUDIO_MIN_ABR", "48"))
+FRAGMENT_CONCURRENCY = int(os.getenv("FRAGMENT_CONCURRENCY", "4"))
 
 LANGUAGE_CODE_MAPPING = {
     "en": "en-US",  # English
@@ -98,22 +134,71 @@ def get_video_id(youtube_url):
         logging.error(f"Error parsing URL: {e}")
         return None
 
+def get_playlist_id(youtube_url):
+    """Extract the playlist ID (the `list=` parameter) from a YouTube URL."""
+    try:
+        parsed_url = urlparse(youtube_url)
+        domain = parsed_url.netloc.lower()
+        if 'youtube.com' in domain or 'youtu.be' in domain:
+            return parse_qs(parsed_url.query).get('list', [None])[0]
+        return None
+    except Exception as e:
+        logging.error(f"Error parsing URL: {e}")
+        return None
+
+def expand_playlist(playlist_url, max_videos=BULK_MAX_VIDEOS):
+    """
+    Expand a YouTube playlist into individual watch URLs using yt-dlp's flat extraction.
+    Only the playlist page is fetched; no media is downloaded.
+    """
+    playlist_id = get_playlist_id(playlist_url)
+    if not playlist_id:
+        return []
+
+    ydl_opts = {
+        "extract_flat": "in_playlist",
+        "skip_download": True,
+        "playlistend": max_videos,
+        "logger": MyLogger(),
+    }
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(f"https://www.youtube.com/playlist?list={playlist_id}", download=False)
+    except Exception as e:
+        logger.error(f"Error expanding playlist {playlist_id}: {e}")
+        raise
+
+    video_urls = []
+    for entry in (info or {}).get("entries") or []:
+        if entry and entry.get("id"):
+            video_urls.append(f"https://www.youtube.com/watch?v={entry['id']}")
+    return video_urls[:max_videos]
+
 def check_subtitle_exists(bucket_name, video_id,source_language,target_language):
     """
-    Check if an audio file for the given video ID already exists in the GCS bucket.
+    Check if subtitles for the given video ID and language pair already exist in the GCS bucket.
+    Signed URLs of hits are kept in the in-process subtitle cache.
     """
     try:
-        bucket = storage_client.bucket(bucket_name)
+        key = (video_id, source_language, target_language)
         blob_name = f"subtitles/{video_id}_{source_language}_{target_language}.vtt"
+        cached = subtitle_cache.get(key)
+        if cached:
+            access_log.record(blob_name)
+            return cached["metadata"]["downloadUrl"]
+
+        bucket = storage_client.bucket(bucket_name)
         blob = bucket.blob(blob_name)
 
-        if blob.exists():
+        if call("gcs", blob.exists, idempotent=True, hedge=True, pass_timeout=True):
+            access_log.record(blob_name)
             # Generate a signed URL valid for 1 hour
             signed_url = blob.generate_signed_url(
                 credentials=credentials,
                 expiration=timedelta(hours=1),
                 method="GET"
             )
+            subtitle_cache.put(key, downloadUrl=signed_url)
             return signed_url
         return None
     except Exception as e:
@@ -130,7 +215,8 @@ def check_audio_exists(bucket_name, video_id,):
         blob = bucket.blob(blob_name)
 
         
-        if blob.exists():
+        if call("gcs", blob.exists, idempotent=True, hedge=True, pass_timeout=True):
+            access_log.record(blob_name)
             return f"gs://{bucket_name}/{blob_name}"
         return None
     except Exception as e:
@@ -139,9 +225,13 @@ def check_audio_exists(bucket_name, video_id,):
 
 
 
-def process_youtube_audio(video_url, bucket_name,source_language,target_language,user_id,task_id):
+def process_youtube_audio(video_url, bucket_name,source_language,target_language,user_id,task_id,
+                          available_coins=None, prefetch=False):
     """
     Downloads YouTube audio, converts it to MP3 using FFmpeg, and uploads to GCS.
+    Videos are admitted and priced from their cached metadata before any media is
+    downloaded; `available_coins`, when given, must cover the price.
+    Prefetch tasks queue for recognition behind user tasks.
     """
     try:
         # Extract video ID
@@ -149,6 +239,12 @@ def process_youtube_audio(video_url, bucket_name,source_language,target_language
         if not video_id:
             return {"error": "Invalid YouTube URL."}
 
+        # A video an earlier task detected as another language is looked up in that language,
+        # so repeat requests hit the stored subtitles and transcript instead of re-running STT.
+        requested_language = source_language
+        detected_language = find_detected_language(video_id, requested_language) if LANGUAGE_DETECTION_ENABLED else None
+        source_language = detected_language or source_language
+
         # Check if audio already exists
         existing_signed_url = check_subtitle_exists(bucket_name, video_id,source_language,target_language)
         user_object_id = ObjectId(user_id)
@@ -164,51 +260,165 @@ def process_youtube_audio(video_url, bucket_name,source_language,target_language
             "created_at": datetime.now(),
         }
         if existing_signed_url:
+            if not prefetch:
+                try:
+                    prefetch_queue.record_hit(video_id, source_language, target_language)
+                except Exception as e:
+                    logger.error(f"Error recording prefetch hit for {video_id}: {e}")
             return {"message": "Audio already exists.", "task": task_details, "tokens_used":25}
         
 
-        gcs_uri = check_audio_exists(bucket_name, video_id)
+        # Resume from the task's checkpoints when this is a retry
+        task = collection.find_one({"task_id": task_id}) or {}
+        if stage_reached(task, "submitted"):
+            logger.info(f"Task {task_id} was already submitted, not resubmitting")
+            task.pop("_id", None)
+            return {"message": "Subtitle generation processing", "task": task, "tokens_used":0}
 
-        # Temporary paths
-        temp_video_path = f"/tmp/{video_id}.m4a"
-        temp_audio_path = f"/tmp/{video_id}.wav"
+        # Metadata stage: reject or price the video before fetching any media
+        try:
+            metadata, info = video_metadata.get(video_url, video_id)
+            admission = admit_video(metadata, quota_bytes=WORKSPACE_QUOTA_BYTES)
+        except VideoRejected as e:
+            logger.info(f"Rejected {video_id}: {e.reason}")
+            return {"error": e.reason, "rejected": True}
+        except Exception as e:
+            logger.error(f"Error reading metadata for {video_id}: {e}")
+            return {"error": "Could not read video details from YouTube."}
+        cost = video_cost(metadata, COINS_PER_VIDEO)
+        if available_coins is not None and cost > available_coins:
+            return {"error": "Insufficient coins for this video.", "coins_required": cost}
 
-        # yt-dlp options
-        ydl_opts = {
-            "format": "bestaudio/best",
-            "outtmpl": temp_video_path,
-            "logger": MyLogger(),  # Custom logger for yt-dlp
-        }
-        
-        if not gcs_uri:
-            yt_dlp_download(video_url, ydl_opts)
-            convert_audio_to_wav(temp_video_path, temp_audio_path)
+        collection.update_one(
+            {"task_id": task_id},
+            {"$setOnInsert": {
+                "task_id": task_id,
+                "video_url": video_url,
+                "video_id": video_id,
+                "user_id": user_id,
+                "source_language": source_language,
+                "target_language": target_language,
+                "status": "processing",
+                "url_type": 'youtube',
+                "created_at": datetime.now(),
+                "audio_seconds": admission["duration"],
+                "prefetch": prefetch,
+            }, "$set": {
+                "title": metadata.get("title"),
+                "duration": admission["duration"],
+                "audio_only_source": admission["audio_only"],
+            }},
+            upsert=True
+        )
 
-            bucket_name = bucket_name
-            destination_blob_name = f"audio/{video_id}.wav"
-            gcs_uri = upload_to_gcs(bucket_name, temp_audio_path, destination_blob_name)
+        # Fast paths: a transcript stored by an earlier task for another target language,
+        # or a usable caption track, replaces download, ffmpeg and STT.
+        if not stage_reached(task, "uploaded"):
+            transcript_source, transcript_uri = "stored_transcript", find_stored_transcript(
+                bucket_name, video_id, source_language
+            )
+            if transcript_uri:
+                record_stage(collection, task_id, "transcribed", transcript_uri=transcript_uri,
+                             transcript_source=transcript_source)
+            else:
+                captions = fetch_caption_results(video_url, source_language, info=metadata)
+                if captions:
+                    kind, results = captions
+                    transcript_source = f"{kind}_captions"
+                    transcript_uri = save_caption_transcript(bucket_name, task_id, video_id, source_language,
+                                                             results, transcript_source)
+            if transcript_uri:
+                task_details = {
+                    "task_id": task_id,
+                    "video_url": video_url,
+                    "video_id": video_id,
+                    "user_id": user_id,
+                    "source_language": source_language,
+                    "requested_language": requested_language,
+                    "target_language": target_language,
+                    "status": "in_progress",
+                    "transcript_source": transcript_source,
+                    "transcript_uri": transcript_uri,
+                    "url_type": 'youtube',
+                    "downloadUrl": "",
+                }
+                if detected_language:
+                    task_details["detected_language"] = detected_language
+                collection.update_one({"task_id": task_id}, {"$set": task_details})
+                return {"message": "Subtitle generation processing", "task": task_details, "tokens_used":cost}
 
+        if stage_reached(task, "detected"):
+            source_language = stage_artifacts(task, "detected").get("chosen") or source_language
+        audio_seconds = stage_artifacts(task, "converted").get("audio_seconds") or admission["duration"]
+        gcs_uri = stage_artifacts(task, "uploaded").get("audio_uri") or check_audio_exists(bucket_name, video_id)
+        if gcs_uri and not audio_seconds:
+            audio_seconds = find_audio_seconds(video_id)
+        if gcs_uri and not stage_reached(task, "uploaded"):
+            record_stage(collection, task_id, "uploaded", audio_uri=gcs_uri)
 
+        fingerprints = None
+        reuse = None
+        download_stats = DownloadStats()
+        workspace_metrics = None
         if not gcs_uri:
-            return {"error": "Failed to upload audio to GCS."}
-        
-        audio = speech_v1.RecognitionAudio(uri=gcs_uri)
- 
-        config = speech_v1.RecognitionConfig(
-            encoding=speech_v1.RecognitionConfig.AudioEncoding.LINEAR16,
-            sample_rate_hertz=16000,
-            language_code=LANGUAGE_CODE_MAPPING.get(source_language, "en-US"),
-            enable_automatic_punctuation=True,
-            enable_word_time_offsets=True,
-            model='video'
-        )
-        operation = speech_client.long_running_recognize(config=config, audio=audio)
-        operation_id = operation.operation.name
-        
+            with job_workspace(task_id) as workspace:
+                # Temporary paths
+                temp_video_path = workspace.path(f"{video_id}.m4a")
+                temp_audio_path = workspace.path(f"{video_id}.wav")
 
-        logger.info(f"Generated async operation: {operation_id}")   
-             
-        print("Waiting for operation to complete...")
+                # yt-dlp options
+                ydl_opts = build_download_opts(temp_video_path, download_stats,
+                                               audio_only=admission["audio_only"])
+                ydl_opts["max_filesize"] = workspace.quota_bytes
+                ydl_opts["progress_hooks"].append(lambda status: workspace.sample())
+
+                yt_dlp_download(video_url, ydl_opts, info=info)
+                workspace.sample()
+                record_stage(collection, task_id, "downloaded", bytes=download_stats.bytes_fetched)
+
+                convert_audio_to_wav(temp_video_path, temp_audio_path)
+                workspace.remove(f"{video_id}.m4a")
+                audio_seconds = probe_audio_duration(temp_audio_path)
+                record_stage(collection, task_id, "converted", audio_seconds=audio_seconds)
+                source_language = detect_source_language(task_id, temp_audio_path, source_language)
+                fingerprints, reuse = fingerprint_and_match(temp_audio_path, video_id, source_language)
+
+                if not reuse:
+                    bucket_name = bucket_name
+                    destination_blob_name = f"audio/{video_id}.wav"
+                    gcs_uri = upload_to_gcs(bucket_name, temp_audio_path, destination_blob_name)
+                    if gcs_uri:
+                        record_stage(collection, task_id, "uploaded", audio_uri=gcs_uri)
+            workspace_metrics = workspace.metrics()
+
+        if reuse:
+            operation_id = reuse["operation_id"]
+            logger.info(f"Reusing transcript of {reuse['video_id']} at offset {reuse['offset']:.2f}s for {video_id}")
+            record_stage(collection, task_id, "submitted", operation_id=operation_id, reused_from=reuse["video_id"])
+        else:
+            if not gcs_uri:
+                return {"error": "Failed to upload audio to GCS."}
+
+            # The scheduler submits now if a slot is free, otherwise when one frees up.
+            user = db.users.find_one({"_id": ObjectId(user_id)}, {"issubscribed": 1}) or {}
+            stt_scheduler.enqueue(
+                task_id, user_id, gcs_uri, LANGUAGE_CODE_MAPPING.get(source_language, "en-US"),
+                audio_seconds=audio_seconds, subscribed=bool(user.get("issubscribed")),
+                weight=PREFETCH_STT_WEIGHT if prefetch else None, cost=0 if prefetch else cost
+            )
+            stt_scheduler.dispatch()
+            operation_id = stage_artifacts(collection.find_one({"task_id": task_id}), "submitted").get("operation_id")
+            if fingerprints:
+                try:
+                    index_fingerprints(fingerprint_collection, video_id, fingerprints[0], fingerprints[1])
+                except Exception as e:
+                    logger.error(f"Error indexing fingerprints for {video_id}: {e}")
+
+        if operation_id:
+            logger.info(f"Generated async operation: {operation_id}")
+            print("Waiting for operation to complete...")
+        else:
+            logger.info(f"Task {task_id} queued for recognition")
 
         task_details = {
             "task_id": task_id,
@@ -216,35 +426,398 @@ def process_youtube_audio(video_url, bucket_name,source_language,target_language
             "video_id":video_id,
             "user_id": user_id,
             "source_language":source_language,
+            "requested_language": requested_language,
             "target_language":target_language,
-            "operation_id": operation_id,
-            "status": "in_progress",
             "url_type": 'youtube',  
             "downloadUrl":"",
-            "created_at": datetime.now(),
+            "transcript_source": "fingerprint_reuse" if reuse else "speech_to_text",
         }
-        
-        collection.insert_one(task_details)
+        if audio_seconds:
+            task_details["audio_seconds"] = audio_seconds
+        detection = stage_artifacts(collection.find_one({"task_id": task_id}, {"stages": 1}), "detected")
+        if detection:
+            task_details["detected_language"] = detection.get("detected")
+            task_details["language_share"] = detection.get("share")
+        elif detected_language:
+            task_details["detected_language"] = detected_language
+        if download_stats.bytes_fetched:
+            task_details["download"] = download_stats.to_dict()
+        if workspace_metrics:
+            task_details["workspace"] = workspace_metrics
+        if reuse:
+            task_details["reused_from"] = reuse["video_id"]
+            task_details["time_offset"] = reuse["offset"]
+            task_details["clip_duration"] = reuse["duration"]
 
-        # Clean up temporary files
-        if os.path.exists(temp_video_path):
-            os.remove(temp_video_path)
-        if os.path.exists(temp_audio_path):
-            os.remove(temp_audio_path)
-        
-        return {"message": "Subtitle generation processing", "task": task_details, "tokens_used":100}
+        # A queued task's status and operation id are left to the scheduler,
+        # since another instance may submit it at any moment.
+        if operation_id:
+            task_details["operation_id"] = operation_id
+            task_details["status"] = "in_progress"
+        collection.update_one({"task_id": task_id}, {"$set": task_details})
+        if not operation_id:
+            task_details["status"] = "queued"
+            task_details["queue_position"] = stt_scheduler.queue_position(task_id)
+
+        return {"message": "Subtitle generation processing", "task": task_details, "tokens_used":cost}
        
     except Exception as e:
         logger.error(f"Error processing YouTube audio: {e}")
         return {"error": str(e)}
 
-def yt_dlp_download(url: str, ydl_opts: dict):
+def find_stored_transcript(bucket_name, video_id, source_language):
+    """gs:// URI of the video's stored transcript in the source language, or None."""
+    blob_name = transcript_blob_name(video_id, source_language)
+    try:
+        if call("gcs", storage_client.bucket(bucket_name).blob(blob_name).exists,
+                idempotent=True, hedge=True, pass_timeout=True):
+            return f"gs://{bucket_name}/{blob_name}"
+    except Exception as e:
+        logger.error(f"Error checking for a stored transcript of {video_id}: {e}")
+    return None
+
+def save_caption_transcript(bucket_name, task_id, video_id, source_language, results, transcript_source):
+    """
+    Store a parsed caption track as the video's transcript, exactly where STT
+    output would go, and mark the task transcribed so rendering can start.
+    """
+    content = encode_transcript(results)
+    transcript_uri = save_transcript(storage_client.bucket(bucket_name), video_id, source_language, content)
+    record_stage(collection, task_id, "transcribed", transcript_uri=transcript_uri,
+                 transcript_source=transcript_source)
+    logger.info(f"Using {transcript_source} for {video_id} ({len(results)} cues), skipping STT")
+    return transcript_uri
+
+def detect_source_language(task_id, wav_path, source_language):
+    """
+    Detection stage: recognize a few short samples of the converted audio with
+    candidate languages and return the source language to transcribe in.
+    """
+    if not LANGUAGE_DETECTION_ENABLED:
+        return source_language
+    try:
+        samples, sample_rate = read_samples(wav_path)
+        detection = detect_language(recognizer, samples, source_language, LANGUAGE_CODE_MAPPING,
+                                    sample_rate=sample_rate)
+    except Exception as e:
+        logger.error(f"Error detecting the language of task {task_id}: {e}")
+        return source_language
+    record_stage(collection, task_id, "detected", **detection)
+    if detection["chosen"] != source_language:
+        logger.info(f"Task {task_id} requested {source_language} but the audio is {detection['chosen']} "
+                    f"(share {detection['share']}), transcribing in {detection['chosen']}")
+    return detection["chosen"]
+
+def find_detected_language(video_id, requested_language):
+    """Language chosen by an earlier task's detection stage for the same video and request, if any."""
+    previous = collection.find_one(
+        {"video_id": video_id, "requested_language": requested_language, "detected_language": {"$ne": None}},
+        {"source_language": 1}
+    )
+    return previous["source_language"] if previous else None
+
+def find_audio_seconds(video_id):
+    """Audio duration recorded by an earlier task for the same video, if any."""
+    previous = collection.find_one(
+        {"video_id": video_id, "audio_seconds": {"$exists": True}},
+        {"audio_seconds": 1}
+    )
+    return previous["audio_seconds"] if previous else None
+
+def find_reference_task(video_id, source_language):
+    """Latest transcription task for a video in the given source language."""
+    return collection.find_one(
+        {
+            "video_id": video_id,
+            "source_language": source_language,
+            "operation_id": {"$exists": True},
+            "reused_from": {"$exists": False},
+        },
+        sort=[("created_at", -1)]
+    )
+
+def fingerprint_and_match(wav_path, video_id, source_language):
+    """
+    Fingerprint converted audio and look for the same content under another video ID.
+    Returns (fingerprints, reuse) where reuse carries the reference operation and the
+    time offset of this audio inside it, or None when the audio must be transcribed.
+    Only audio lying almost entirely inside the reference recording is reused; a
+    longer upload or a compilation that merely contains part of it is transcribed
+    in full. Fingerprinting problems never block transcription.
+    """
+    try:
+        hashes, anchors, duration = fingerprint_file(wav_path)
+        match = match_fingerprints(fingerprint_collection, hashes, anchors, exclude_video_id=video_id)
+    except Exception as e:
+        logger.error(f"Error fingerprinting audio for {video_id}: {e}")
+        return None, None
+
+    if not match:
+        return (hashes, anchors), None
+
+    reference = find_reference_task(match["video_id"], source_language)
+    if not reference:
+        return (hashes, anchors), None
+    reference_seconds = reference.get("audio_seconds") or stage_artifacts(reference, "converted").get("audio_seconds")
+    coverage = span_coverage(match["offset"], duration, reference_seconds)
+    if coverage < FINGERPRINT_MIN_COVERAGE:
+        logger.info(f"Partial fingerprint match for {video_id} ({coverage:.0%} inside {match['video_id']}), "
+                    f"transcribing in full")
+        return (hashes, anchors), None
+
+    logger.info(f"Fingerprint match for {video_id}: {match}")
+    return (hashes, anchors), {
+        "video_id": match["video_id"],
+        "operation_id": reference["operation_id"],
+        "offset": match["offset"],
+        "duration": duration,
+    }
+
+def plan_bulk_job(video_urls, bucket_name, source_language, target_language):
+    """
+    Resolve the videos of a bulk request and split them into cached and pending items.
+    Duplicate and invalid URLs are dropped so each video is processed and billed once.
+    """
+    items = []
+    seen = set()
+    for video_url in video_urls:
+        video_id = get_video_id(video_url)
+        if not video_id or video_id in seen:
+            continue
+        seen.add(video_id)
+        video_language = (find_detected_language(video_id, source_language) if LANGUAGE_DETECTION_ENABLED
+                          else None) or source_language
+        signed_url = check_subtitle_exists(bucket_name, video_id, video_language, target_language)
+        items.append({
+            "video_url": video_url,
+            "video_id": video_id,
+            "status": "cached" if signed_url else "pending",
+            "downloadUrl": signed_url or "",
+        })
+
+    # Admit and price the pending videos from their metadata before anything is billed
+    pending = [item for item in items if item["status"] == "pending"]
+    if pending:
+        with ThreadPoolExecutor(max_workers=min(BULK_MAX_CONCURRENCY, len(pending))) as executor:
+            for item, admission in zip(pending, executor.map(
+                contextvars.copy_context().run, [_admit_bulk_item] * len(pending), pending
+            )):
+                item.update(admission)
+    return items
+
+def _admit_bulk_item(item):
+    try:
+        metadata, _ = video_metadata.get(item["video_url"], item["video_id"])
+        admission = admit_video(metadata, quota_bytes=WORKSPACE_QUOTA_BYTES)
+    except VideoRejected as e:
+        return {"status": "rejected", "error": e.reason}
+    except Exception as e:
+        logger.error(f"Error reading metadata for {item['video_id']}: {e}")
+        return {"status": "rejected", "error": "Could not read video details from YouTube."}
+    return {"duration": admission["duration"], "cost": video_cost(metadata, COINS_PER_VIDEO)}
+
+def bulk_job_cost(items):
+    """Total coins charged for a planned bulk job; rejected videos are free."""
+    cost = 0
+    for item in items:
+        if item["status"] == "cached":
+            cost += COINS_PER_CACHED_VIDEO
+        elif item["status"] == "pending":
+            cost += item.get("cost", COINS_PER_VIDEO)
+    return cost
+
+def create_bulk_job(task_id, user_id, source_language, target_language, items):
+    """
+    Insert the parent job document that tracks the progress of each child task.
+    """
+    children = []
+    for index, item in enumerate(items):
+        children.append({
+            "task_id": f"{task_id}_{index}",
+            "video_id": item["video_id"],
+            "video_url": item["video_url"],
+            "status": item["status"],
+            "downloadUrl": item["downloadUrl"],
+            "duration": item.get("duration"),
+            "cost": bulk_job_cost([item]),
+        })
+        if item.get("error"):
+            children[-1]["error"] = item["error"]
+    cached = sum(1 for child in children if child["status"] == "cached")
+    rejected = sum(1 for child in children if child["status"] == "rejected")
+    job = {
+        "task_id": task_id,
+        "user_id": ObjectId(user_id),
+        "source_language": source_language,
+        "target_language": target_language,
+        "status": "in_progress" if cached + rejected < len(children) else "completed",
+        "total": len(children),
+        "cached": cached,
+        "rejected": rejected,
+        "submitted": 0,
+        "completed": 0,
+        "failed": 0,
+        "refunded": 0,
+        "children": children,
+        "created_at": datetime.now(),
+    }
+    bulk_collection.insert_one(job)
+    return job
+
+def _update_bulk_child(job, index, result):
+    """
+    Record the outcome of one child on the parent job document and refund the
+    user whatever the child was billed for but did not use.
+    Returns (child status, refunded coins).
+    """
+    child = job["children"][index]
+    if "error" in result:
+        child_status, charged = "failed", 0
+    elif result.get("message") == "Audio already exists.":
+        child_status, charged = "completed", result.get("tokens_used", COINS_PER_CACHED_VIDEO)
+    else:
+        child_status, charged = "submitted", result.get("tokens_used", child.get("cost", 0))
+    refund = max(0, child.get("cost", 0) - charged)
+
+    child_update = {f"children.{index}.status": child_status}
+    if "error" in result:
+        child_update[f"children.{index}.error"] = result["error"]
+    if child_status == "completed":
+        child_update[f"children.{index}.downloadUrl"] = result["task"]["downloadUrl"]
+    bulk_collection.update_one(
+        {"task_id": job["task_id"]},
+        {"$set": child_update, "$inc": {child_status: 1, "refunded": refund}}
+    )
+    if refund:
+        db.users.update_one({"_id": job["user_id"]}, {"$inc": {"coins": refund}})
+    return child_status, refund
+
+def process_bulk_youtube_audio(job, bucket_name, max_concurrency=BULK_MAX_CONCURRENCY):
+    """
+    Fan the pending children of a bulk job out through process_youtube_audio
+    with at most `max_concurrency` videos in flight at once, shortest videos first.
+    Children that fail, including those cut off by the request deadline, are refunded.
+    """
+    task_id = job["task_id"]
+    pending = sorted(
+        ((index, child) for index, child in enumerate(job["children"]) if child["status"] == "pending"),
+        key=lambda entry: entry[1].get("duration") or 0
+    )
+    results = []
+    refunded = 0
+    if pending:
+        max_workers = max(1, min(max_concurrency, len(pending)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(
+                    contextvars.copy_context().run,
+                    process_youtube_audio,
+                    child["video_url"],
+                    bucket_name,
+                    job["source_language"],
+                    job["target_language"],
+                    str(job["user_id"]),
+                    child["task_id"],
+                ): (index, child)
+                for index, child in pending
+            }
+            for future in as_completed(futures):
+                index, child = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {"error": str(e)}
+                child["status"], child_refund = _update_bulk_child(job, index, result)
+                refunded += child_refund
+                if child["status"] == "completed":
+                    child["downloadUrl"] = result["task"]["downloadUrl"]
+                results.append({"task_id": child["task_id"], "video_id": child["video_id"], **result})
+
+    failed = sum(1 for result in results if "error" in result)
+    submitted = sum(1 for child in job["children"] if child["status"] == "submitted")
+    status = "failed" if pending and failed == len(pending) else "in_progress"
+    if not submitted and status != "failed":
+        status = "completed"
+    if status != "in_progress":
+        # In-progress jobs are completed by the status function as their children finish.
+        bulk_collection.update_one({"task_id": task_id}, {"$set": {"status": status}})
+
+    return {
+        "message": "Bulk subtitle generation processing",
+        "task_id": task_id,
+        "status": status,
+        "total": job["total"],
+        "cached": job["cached"],
+        "rejected": job.get("rejected", 0),
+        "submitted": submitted,
+        "failed": failed,
+        "refunded": refunded,
+        "children": [
+            {key: child[key] for key in ("task_id", "video_id", "status", "downloadUrl", "error") if key in child}
+            for child in job["children"]
+        ],
+    }
+
+class DownloadStats:
+    """
+    yt-dlp progress hook that records how many bytes a download fetched and how fast.
+    """
+    def __init__(self):
+        self.bytes_fetched = 0
+        self.elapsed = 0.0
+        self.format_id = None
+        self._started_at = None
+
+    def __call__(self, status):
+        if self._started_at is None:
+            self._started_at = time.monotonic()
+        if status.get("status") == "finished":
+            self.bytes_fetched += status.get("total_bytes") or status.get("downloaded_bytes") or 0
+            self.elapsed = status.get("elapsed") or (time.monotonic() - self._started_at)
+            info = status.get("info_dict") or {}
+            self.format_id = info.get("format_id", self.format_id)
+
+    def to_dict(self):
+        throughput = self.bytes_fetched / self.elapsed if self.elapsed else None
+        return {
+            "bytes": self.bytes_fetched,
+            "seconds": round(self.elapsed, 3),
+            "throughput_bps": round(throughput) if throughput else None,
+            "format_id": self.format_id,
+        }
+
+def build_download_opts(output_path, download_stats=None, min_abr=AUDIO_MIN_ABR,
+                        fragment_concurrency=FRAGMENT_CONCURRENCY, audio_only=True):
+    """
+    yt-dlp options for the audio download profile.
+    Picks the smallest audio-only format with at least `min_abr` kbps, falling back
+    to the best audio when none qualifies, and downloads fragments concurrently.
+    Videos known to have no audio-only format take the smallest muxed format instead.
+    """
+    audio_format = f"worstaudio[abr>={min_abr}]/bestaudio/best"
+    if not audio_only:
+        audio_format = "worst[acodec!=none]/best"
+    ydl_opts = {
+        "format": audio_format,
+        "outtmpl": output_path,
+        "concurrent_fragment_downloads": fragment_concurrency,
+        "logger": MyLogger(),  # Custom logger for yt-dlp
+    }
+    if download_stats is not None:
+        ydl_opts["progress_hooks"] = [download_stats]
+    return ydl_opts
+
+def yt_dlp_download(url: str, ydl_opts: dict, info: dict = None):
     """
     Download media using yt-dlp and save it to a local file.
+    With `info` from an earlier extract_info(download=False), the page is not extracted again.
     """
     try:
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([url])
+            if info:
+                ydl.process_ie_result(info, download=True)
+            else:
+                ydl.download([url])
     except Exception as e:
         logger.error(f"Error in yt_dlp_download: {e}")
         raise
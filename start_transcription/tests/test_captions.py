@@ -0,0 +1,90 @@
+import json
+
+import pytest
+
+from captions import parse_json3, parse_vtt
+
+VTT = """WEBVTT
+Kind: captions
+Language: en
+
+1
+00:00:01.000 --> 00:00:03.500 align:start position:0%
+<c>Hello</c> <00:00:01.500><c>there</c> &amp; welcome
+
+00:00:03.500 --> 00:00:03.510
+Hello there &amp; welcome
+
+00:00:03.510 --> 00:00:06.000
+Hello there &amp; welcome
+to the show
+
+01:02:03.250 --> 01:02:04.250
+[Music]
+"""
+
+
+def test_parse_vtt_strips_tags_and_entities():
+    results = parse_vtt(VTT)
+
+    assert results[0]["transcript"] == "Hello there & welcome"
+    assert (results[0]["start_time"], results[0]["end_time"]) == (1.0, 3.5)
+    assert results[0]["confidence"] == 1.0
+
+
+def test_parse_vtt_drops_lines_repeated_by_scrolling_cues():
+    results = parse_vtt(VTT)
+
+    assert [result["transcript"] for result in results] == ["Hello there & welcome", "to the show", "[Music]"]
+    assert (results[1]["start_time"], results[1]["end_time"]) == (3.51, 6.0)
+
+
+def test_parse_vtt_reads_hours_and_spreads_words_over_the_cue():
+    results = parse_vtt(VTT, confidence=0.7)
+
+    assert results[-1]["start_time"] == pytest.approx(3723.25)
+    words = results[1]["words"]
+    assert [word["word"] for word in words] == ["to", "the", "show"]
+    assert words[0]["start_time"] == 3.51 and words[-1]["end_time"] == pytest.approx(6.0, abs=0.001)
+    assert all(result["confidence"] == 0.7 for result in results)
+
+
+def test_parse_vtt_handles_crlf():
+    content = "WEBVTT\r\n\r\n00:00.000 --> 00:02.000\r\nshort form\r\n"
+
+    assert [result["transcript"] for result in parse_vtt(content)] == ["short form"]
+
+
+JSON3 = {
+    "events": [
+        {"tStartMs": 0, "dDurationMs": 5000, "id": 1, "wWinId": 1},
+        {"tStartMs": 1000, "dDurationMs": 2000, "segs": [{"utf8": "manual  caption\nline"}]},
+        {"tStartMs": 3000, "dDurationMs": 3000, "wWinId": 1, "segs": [
+            {"utf8": "auto"}, {"utf8": " timed", "tOffsetMs": 800}, {"utf8": " words", "tOffsetMs": 1600},
+        ]},
+        {"tStartMs": 6000, "dDurationMs": 10, "aAppend": 1, "segs": [{"utf8": "\n"}]},
+        {"tStartMs": 7000, "dDurationMs": 1000, "segs": [{"utf8": " "}]},
+    ]
+}
+
+
+def test_parse_json3_skips_empty_and_append_events():
+    results = parse_json3(json.dumps(JSON3))
+
+    assert [result["transcript"] for result in results] == ["manual caption line", "auto timed words"]
+    assert (results[0]["start_time"], results[0]["end_time"]) == (1.0, 3.0)
+
+
+def test_parse_json3_uses_word_offsets_from_automatic_tracks():
+    words = parse_json3(json.dumps(JSON3))[1]["words"]
+
+    assert [(word["word"], word["start_time"], word["end_time"]) for word in words] == [
+        ("auto", 3.0, 3.8), ("timed", 3.8, 4.6), ("words", 4.6, 6.0)
+    ]
+
+
+def test_parse_json3_spreads_words_of_manual_cues():
+    words = parse_json3(json.dumps(JSON3))[0]["words"]
+
+    assert [word["word"] for word in words] == ["manual", "caption", "line"]
+    assert words[0]["start_time"] == 1.0 and words[-1]["end_time"] == pytest.approx(3.0, abs=0.001)
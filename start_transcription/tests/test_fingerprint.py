@@ -0,0 +1,88 @@
+import wave
+
+import mongomock
+import numpy as np
+import pytest
+
+import fingerprint
+
+SAMPLE_RATE = fingerprint.SAMPLE_RATE
+
+
+def _tones(seconds, seed=0):
+    """Quarter-second random tones over light noise, distinctive enough to fingerprint."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(SAMPLE_RATE // 4) / SAMPLE_RATE
+    signal = np.concatenate([np.sin(2 * np.pi * rng.uniform(200, 4000) * t) for _ in range(seconds * 4)])
+    return signal + 0.05 * rng.standard_normal(len(signal))
+
+
+def _write_wav(path, samples):
+    with wave.open(str(path), "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(SAMPLE_RATE)
+        wav_file.writeframes((samples / np.abs(samples).max() * 20000).astype("<i2").tobytes())
+    return str(path)
+
+
+@pytest.fixture
+def indexed_reference(tmp_path):
+    reference = _tones(40)
+    collection = mongomock.MongoClient().db.fingerprints
+    hashes, anchors, duration = fingerprint.fingerprint_file(_write_wav(tmp_path / "reference.wav", reference))
+    fingerprint.index_fingerprints(collection, "reference", hashes, anchors)
+    return reference, collection, duration
+
+
+def test_fingerprint_file_reports_duration_and_caps_hashes(indexed_reference):
+    _, collection, duration = indexed_reference
+    assert duration == pytest.approx(40.0)
+    assert collection.count_documents({}) <= 40 * fingerprint.FINGERPRINT_HASHES_PER_SECOND
+
+
+def test_clip_matches_reference_at_its_offset(tmp_path, indexed_reference):
+    reference, collection, _ = indexed_reference
+    start = SAMPLE_RATE * 12 + 1234  # not aligned to the analysis hop
+    clip = reference[start:start + SAMPLE_RATE * 15]
+    hashes, anchors, duration = fingerprint.fingerprint_file(_write_wav(tmp_path / "clip.wav", clip))
+
+    match = fingerprint.match_fingerprints(collection, hashes, anchors, exclude_video_id="clip")
+
+    assert match["video_id"] == "reference"
+    assert match["offset"] == pytest.approx(start / SAMPLE_RATE, abs=fingerprint.frames_to_seconds(1))
+    assert match["ratio"] >= fingerprint.FINGERPRINT_MIN_MATCH_RATIO
+    assert fingerprint.span_coverage(match["offset"], duration, 40.0) == pytest.approx(1.0, abs=0.01)
+
+
+def test_unrelated_audio_does_not_match(tmp_path, indexed_reference):
+    _, collection, _ = indexed_reference
+    hashes, anchors, _ = fingerprint.fingerprint_file(_write_wav(tmp_path / "other.wav", _tones(15, seed=1)))
+
+    assert fingerprint.match_fingerprints(collection, hashes, anchors) is None
+
+
+def test_own_video_is_excluded(indexed_reference):
+    reference, collection, _ = indexed_reference
+    hashes = np.array([doc["h"] for doc in collection.find()], dtype=np.int64)
+    anchors = np.array([doc["t"] for doc in collection.find()], dtype=np.int64)
+
+    assert fingerprint.match_fingerprints(collection, hashes, anchors, exclude_video_id="reference") is None
+
+
+def test_span_coverage_of_audio_running_past_the_reference():
+    assert fingerprint.span_coverage(30.0, 20.0, 40.0) == pytest.approx(0.5)
+    assert fingerprint.span_coverage(-5.0, 10.0, 40.0) == pytest.approx(0.5)
+    assert fingerprint.span_coverage(0.0, 10.0, None) == 0.0
+
+
+def test_cap_hashes_keeps_the_same_hashes_on_both_sides():
+    hashes = np.arange(1000, dtype=np.int64)
+    anchors = np.zeros(1000, dtype=np.int64)
+    kept, kept_anchors = fingerprint.cap_hashes(hashes, anchors, per_second=10)
+    assert len(kept) == 10 and (kept_anchors == 0).all()
+
+    # A subset that still contains the chosen hashes picks exactly those again.
+    subset = np.concatenate([kept, hashes[::7]])
+    again, _ = fingerprint.cap_hashes(np.unique(subset), np.zeros(len(np.unique(subset)), dtype=np.int64), per_second=10)
+    assert set(again.tolist()) == set(kept.tolist())
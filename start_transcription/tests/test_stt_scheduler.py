@@ -0,0 +1,123 @@
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+from bson import ObjectId
+
+import stt_scheduler
+from stt_scheduler import SttScheduler
+
+
+class StubRecognizer:
+    def __init__(self, error=None):
+        self.error = error
+        self.submitted = []
+
+    def submit(self, gcs_uri, language_code, audio_seconds=None):
+        if self.error:
+            raise self.error
+        self.submitted.append(gcs_uri)
+        return f"operation-{len(self.submitted)}"
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient().db
+
+
+def make_scheduler(db, recognizer=None, max_inflight=10):
+    return SttScheduler(db.SttQueue, db.SttSlots, db.SubtitledVideos, recognizer or StubRecognizer(),
+                        max_inflight=max_inflight, users_collection=db.users)
+
+
+def add_job(db, task_id, user_id, minutes_ago, state="queued", weight=1.0, priority=0):
+    db.SttQueue.insert_one({
+        "task_id": task_id, "user_id": user_id, "gcs_uri": f"gs://bucket/{task_id}.wav",
+        "language_code": "en-US", "weight": weight, "priority": priority, "state": state,
+        "attempts": 0, "enqueued_at": datetime.now() - timedelta(minutes=minutes_ago),
+    })
+
+
+def planned(scheduler):
+    return [job["task_id"] for job in scheduler._plan()]
+
+
+def test_user_with_fewer_running_jobs_goes_first(db):
+    scheduler = make_scheduler(db)
+    add_job(db, "heavy-running-1", "heavy", 60, state="inflight")
+    add_job(db, "heavy-running-2", "heavy", 59, state="submitting")
+    for index in range(3):
+        add_job(db, f"heavy-{index}", "heavy", 50 - index)
+    add_job(db, "light-0", "light", 5)
+    add_job(db, "light-1", "light", 4)
+
+    # Shares: heavy (2 + 1) / 1 = 3 against light (0 + 1) / 1 = 1, then (1 + 1) / 1 = 2.
+    assert planned(scheduler) == ["light-0", "light-1", "heavy-0", "heavy-1", "heavy-2"]
+
+
+def test_equal_shares_go_to_the_older_job(db):
+    scheduler = make_scheduler(db)
+    add_job(db, "a-0", "a", 10)
+    add_job(db, "a-1", "a", 9)
+    add_job(db, "b-0", "b", 8)
+    add_job(db, "b-1", "b", 7)
+
+    assert planned(scheduler) == ["a-0", "b-0", "a-1", "b-1"]
+
+
+def test_bulk_upload_does_not_starve_other_users(db):
+    scheduler = make_scheduler(db)
+    for index in range(20):
+        add_job(db, f"bulk-{index}", "bulk", 100 - index)
+    add_job(db, "single", "single", 1)
+
+    assert planned(scheduler).index("single") <= 1
+
+
+def test_weight_gives_a_larger_share(db):
+    scheduler = make_scheduler(db)
+    for index in range(4):
+        add_job(db, f"subscribed-{index}", "subscribed", 10 - index, weight=2.0)
+        add_job(db, f"free-{index}", "free", 20 - index)
+
+    order = planned(scheduler)[:6]
+    assert sum(task_id.startswith("subscribed") for task_id in order) == 4
+
+
+def test_priority_orders_jobs_within_a_user(db):
+    scheduler = make_scheduler(db)
+    add_job(db, "old-long", "user", 30)
+    add_job(db, "new-short", "user", 1, priority=1)
+
+    assert planned(scheduler) == ["new-short", "old-long"]
+
+
+def test_dispatch_stops_at_max_inflight(db):
+    recognizer = StubRecognizer()
+    scheduler = make_scheduler(db, recognizer, max_inflight=2)
+    for index in range(3):
+        scheduler.enqueue(f"task-{index}", "user", f"gs://bucket/{index}.wav", "en-US")
+
+    assert scheduler.dispatch() == ["task-0", "task-1"]
+    assert db.SttQueue.find_one({"task_id": "task-2"})["state"] == "queued"
+
+
+def test_failed_submission_refunds_the_charged_coins(db, monkeypatch):
+    monkeypatch.setattr(stt_scheduler, "STT_MAX_SUBMIT_ATTEMPTS", 2)
+    user_id = ObjectId()
+    db.users.insert_one({"_id": user_id, "coins": 900})
+    db.SubtitledVideos.insert_one({"task_id": "task", "status": "queued"})
+    scheduler = make_scheduler(db, StubRecognizer(error=RuntimeError("boom")))
+    scheduler.enqueue("task", user_id, "gs://bucket/task.wav", "en-US", cost=100)
+
+    scheduler.dispatch()
+    assert db.SttQueue.find_one({"task_id": "task"})["state"] == "queued"
+    assert db.users.find_one({"_id": user_id})["coins"] == 900
+
+    scheduler.dispatch()
+    scheduler.dispatch()
+    assert db.SttQueue.find_one({"task_id": "task"})["state"] == "failed"
+    task = db.SubtitledVideos.find_one({"task_id": "task"})
+    assert task["status"] == "failed" and task["refunded"] == 100
+    assert db.users.find_one({"_id": user_id})["coins"] == 1000
+    assert db.SttSlots.find_one({"_id": stt_scheduler.SLOTS_ID})["count"] == 0
@@ -0,0 +1,76 @@
+from subtitle_cache import SubtitleCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_get_returns_content_and_metadata():
+    cache = SubtitleCache(max_bytes=1000, ttl_seconds=60)
+    cache.put(("vid", "en", "hi"), b"WEBVTT", downloadUrl="https://example/vid.vtt")
+
+    assert cache.get(("vid", "en", "hi")) == {
+        "content": b"WEBVTT", "metadata": {"downloadUrl": "https://example/vid.vtt"}
+    }
+    assert cache.get(("vid", "en", "fr")) is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = SubtitleCache(max_bytes=30, ttl_seconds=60)
+    cache.put("a", b"x" * 10)
+    cache.put("b", b"x" * 10)
+    cache.put("c", b"x" * 10)
+    cache.get("a")  # "b" is now the least recently used
+
+    cache.put("d", b"x" * 10)
+
+    assert cache.get("b") is None
+    assert all(cache.get(key) is not None for key in ("a", "c", "d"))
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] == 30
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = SubtitleCache(max_bytes=1000, ttl_seconds=10, clock=clock)
+    cache.put("a", b"vtt")
+
+    clock.now = 9.9
+    assert cache.get("a") is not None
+    clock.now = 10.0
+    assert cache.get("a") is None
+
+    stats = cache.stats()
+    assert stats["expirations"] == 1 and stats["entries"] == 0 and stats["bytes"] == 0
+
+
+def test_replacing_an_entry_keeps_the_size_accurate():
+    cache = SubtitleCache(max_bytes=100, ttl_seconds=60)
+    cache.put("a", b"x" * 40)
+    cache.put("a", b"x" * 10)
+
+    assert cache.stats()["bytes"] == 10
+
+
+def test_oversized_entry_is_not_cached():
+    cache = SubtitleCache(max_bytes=10, ttl_seconds=60)
+    cache.put("small", b"x" * 5)
+
+    assert cache.put("big", b"x" * 11) is False
+    assert cache.get("big") is None
+    assert cache.get("small") is not None
+
+
+def test_invalidate_and_hit_rate():
+    cache = SubtitleCache(max_bytes=100, ttl_seconds=60)
+    cache.put("a", b"vtt")
+    cache.get("a")
+    cache.invalidate("a")
+    cache.invalidate("a")
+
+    assert cache.get("a") is None
+    assert cache.stats()["hit_rate"] == 0.5
@@ -0,0 +1,132 @@
+import os
+
+import pytest
+
+import transcript_store
+from transcript_store import TranscriptReader, encode_transcript, load_transcript, transcript_blob_name
+
+RESULTS = [
+    {
+        "transcript": "hello world",
+        "confidence": 0.91,
+        "words": [
+            {"word": "hello", "start_time": 0.5, "end_time": 0.9, "confidence": 0.8},
+            {"word": "world", "start_time": 1.0, "end_time": 1.4},
+        ],
+    },
+    {"alternatives": []},  # results without a transcript are skipped
+    {
+        "transcript": "नमस्ते hello",
+        "confidence": 0.5,
+        "words": [
+            {"word": "नमस्ते", "start_time": 2.0, "end_time": 2.6},
+            {"word": "hello", "start_time": 2.6, "end_time": 3.0},
+        ],
+    },
+    # A caption cue: its own timing, no words.
+    {"transcript": "[music]", "confidence": 1.0, "words": [], "start_time": 4.0, "end_time": 6.25},
+]
+
+
+def test_round_trip_segments():
+    reader = TranscriptReader(encode_transcript(RESULTS))
+
+    segments = reader.segments()
+    assert [segment["text"] for segment in segments] == ["hello world", "नमस्ते hello", "[music]"]
+    assert [(segment["start_time"], segment["end_time"]) for segment in segments] == [
+        (0.5, 1.4), (2.0, 3.0), (4.0, 6.25)
+    ]
+    assert segments[0]["confidence"] == pytest.approx(0.91, abs=1 / 255)
+
+
+def test_round_trip_words():
+    reader = TranscriptReader(encode_transcript(RESULTS))
+
+    assert reader.n_words == 4 and reader.n_segments == 3
+    assert [word["word"] for word in reader.segment_words(1)] == ["नमस्ते", "hello"]
+    assert reader.segment_words(2) == []
+    first = next(reader.words())
+    assert first == {"word": "hello", "start_ms": 500, "end_ms": 900, "confidence": pytest.approx(0.8, abs=1 / 255)}
+    assert [word["start_ms"] for word in reader.words(1000, 2600)] == [1000, 2000]
+
+
+def test_reader_rejects_other_data():
+    with pytest.raises(ValueError):
+        TranscriptReader(b"XXXX" + bytes(16))
+
+
+def test_close_is_idempotent():
+    reader = TranscriptReader(encode_transcript(RESULTS))
+    with reader:
+        assert len(reader.segments()) == 3
+    reader.close()
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+
+    def exists(self, timeout=None):
+        return self.name in self.bucket.objects
+
+    def download_to_filename(self, path, timeout=None):
+        self.bucket.downloads += 1
+        with open(path, "wb") as target:
+            target.write(self.bucket.objects[self.name])
+
+
+class FakeBucket:
+    name = "bucket"
+
+    def __init__(self):
+        self.objects = {}
+        self.downloads = 0
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(transcript_store, "TRANSCRIPT_CACHE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_load_transcript_caches_locally(cache_dir):
+    bucket = FakeBucket()
+    bucket.objects[transcript_blob_name("vid", "en")] = encode_transcript(RESULTS)
+
+    for _ in range(3):
+        with load_transcript(bucket, "vid", "en") as reader:
+            assert reader.segments()[0]["text"] == "hello world"
+    assert bucket.downloads == 1
+    assert load_transcript(bucket, "missing", "en") is None
+    assert sorted(os.listdir(cache_dir)) == ["vid_en.tsw"]
+
+
+def test_expired_copy_is_fetched_again(cache_dir, monkeypatch):
+    bucket = FakeBucket()
+    bucket.objects[transcript_blob_name("vid", "en")] = encode_transcript(RESULTS)
+    load_transcript(bucket, "vid", "en").close()
+
+    bucket.objects[transcript_blob_name("vid", "en")] = encode_transcript(RESULTS[:1])
+    monkeypatch.setattr(transcript_store, "TRANSCRIPT_CACHE_TTL_SECONDS", -1)
+    with load_transcript(bucket, "vid", "en") as reader:
+        assert reader.n_segments == 1
+    assert bucket.downloads == 2
+
+
+def test_cache_evicts_least_recently_used(cache_dir, monkeypatch):
+    content = encode_transcript(RESULTS)
+    monkeypatch.setattr(transcript_store, "TRANSCRIPT_CACHE_MAX_BYTES", 2 * len(content))
+    bucket = FakeBucket()
+    for video_id in ("a", "b", "c"):
+        bucket.objects[transcript_blob_name(video_id, "en")] = content
+
+    load_transcript(bucket, "a", "en").close()
+    load_transcript(bucket, "b", "en").close()
+    os.utime(cache_dir / "a_en.tsw", (0, os.stat(cache_dir / "a_en.tsw").st_mtime))  # "a" is least recently used
+    load_transcript(bucket, "c", "en").close()
+
+    assert sorted(os.listdir(cache_dir)) == ["b_en.tsw", "c_en.tsw"]
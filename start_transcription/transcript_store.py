@@ -0,0 +1,279 @@
+import os
+import sys
+import mmap
+import time
+import struct
+import bisect
+import logging
+import tempfile
+from array import array
+from resilience import call
+
+logger = logging.getLogger(__name__)
+
+# Binary layout (little-endian):
+#   header           "TSW1", n_words, n_segments, n_strings, string_bytes
+#   word_start_ms    uint32 * n_words
+#   word_end_ms      uint32 * n_words
+#   word_text        uint32 * n_words       (index into the string table)
+#   seg_start_ms     uint32 * n_segments
+#   seg_end_ms       uint32 * n_segments
+#   seg_first_word   uint32 * (n_segments + 1)
+#   seg_text         uint32 * n_segments
+#   string_offsets   uint32 * (n_strings + 1)
+#   word_confidence  uint8  * n_words       (confidence * 255)
+#   seg_confidence   uint8  * n_segments
+#   string_blob      utf-8
+MAGIC = b"TSW1"
+HEADER = struct.Struct("<4sIIII")
+TRANSCRIPT_CACHE_DIR = os.getenv("TRANSCRIPT_CACHE_DIR", "/tmp/transcripts")
+TRANSCRIPT_CACHE_MAX_BYTES = int(os.getenv("TRANSCRIPT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+TRANSCRIPT_CACHE_TTL_SECONDS = int(os.getenv("TRANSCRIPT_CACHE_TTL_SECONDS", "3600"))
+
+
+def transcript_blob_name(video_id, source_language):
+    return f"transcripts/{video_id}_{source_language}.tsw"
+
+
+def _to_ms(seconds):
+    return max(int(round(float(seconds) * 1000)), 0)
+
+
+def _to_byte(confidence):
+    return min(max(int(round(float(confidence or 0.0) * 255)), 0), 255)
+
+
+def encode_transcript(results):
+    """
+    Encode recognizer results ({"transcript", "confidence", "words"}, plus optional
+    "start_time"/"end_time" for caption cues) into the columnar transcript format.
+    Word and segment texts share one string table.
+    """
+    strings = {}
+
+    def intern(text):
+        if text not in strings:
+            strings[text] = len(strings)
+        return strings[text]
+
+    word_start, word_end, word_text, word_conf = array("I"), array("I"), array("I"), array("B")
+    seg_start, seg_end, seg_first, seg_text, seg_conf = array("I"), array("I"), array("I"), array("I"), array("B")
+
+    for result in results:
+        if "transcript" not in result:
+            continue
+        words = result.get("words", [])
+        seg_first.append(len(word_start))
+        for word in words:
+            word_start.append(_to_ms(word["start_time"]))
+            word_end.append(_to_ms(word["end_time"]))
+            word_text.append(intern(word["word"]))
+            word_conf.append(_to_byte(word.get("confidence")))
+        if "start_time" in result:
+            # Caption cues carry their own timing.
+            seg_start.append(_to_ms(result["start_time"]))
+            seg_end.append(_to_ms(result["end_time"]))
+        elif words:
+            seg_start.append(_to_ms(words[0]["start_time"]))
+            seg_end.append(_to_ms(words[-1]["end_time"]))
+        else:
+            seg_start.append(0)
+            seg_end.append(5000)
+        seg_text.append(intern(result["transcript"]))
+        seg_conf.append(_to_byte(result.get("confidence")))
+    seg_first.append(len(word_start))
+
+    encoded = [text.encode("utf-8") for text in strings]
+    string_offsets = array("I", [0])
+    for text in encoded:
+        string_offsets.append(string_offsets[-1] + len(text))
+    blob = b"".join(encoded)
+
+    columns = [word_start, word_end, word_text, seg_start, seg_end, seg_first, seg_text, string_offsets,
+               word_conf, seg_conf]
+    if sys.byteorder != "little":
+        for column in columns:
+            column.byteswap()
+
+    header = HEADER.pack(MAGIC, len(word_start), len(seg_start), len(strings), len(blob))
+    return header + b"".join(column.tobytes() for column in columns) + blob
+
+
+class TranscriptReader:
+    """
+    Lazy view over an encoded transcript held in bytes or an mmap.
+    Columns are memoryview slices, so only the parts that are touched are read.
+    """
+    def __init__(self, buffer):
+        if sys.byteorder != "little":
+            raise RuntimeError("TranscriptReader requires a little-endian host.")
+        view = memoryview(buffer)
+        magic, n_words, n_segments, n_strings, string_bytes = HEADER.unpack_from(view, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a transcript file.")
+        self.n_words = n_words
+        self.n_segments = n_segments
+        self._buffer = buffer
+
+        offset = HEADER.size
+
+        def take(count, fmt):
+            nonlocal offset
+            size = count * struct.calcsize(fmt)
+            column = view[offset:offset + size].cast(fmt)
+            offset += size
+            return column
+
+        self.word_start_ms = take(n_words, "I")
+        self.word_end_ms = take(n_words, "I")
+        self._word_text = take(n_words, "I")
+        self.segment_start_ms = take(n_segments, "I")
+        self.segment_end_ms = take(n_segments, "I")
+        self._segment_first_word = take(n_segments + 1, "I")
+        self._segment_text = take(n_segments, "I")
+        self._string_offsets = take(n_strings + 1, "I")
+        self._word_confidence = take(n_words, "B")
+        self._segment_confidence = take(n_segments, "B")
+        self._strings = view[offset:offset + string_bytes]
+        self._view = view
+
+    def close(self):
+        """Release the column views and close the underlying mmap, if any."""
+        if self._buffer is None:
+            return
+        for column in (self.word_start_ms, self.word_end_ms, self._word_text,
+                       self.segment_start_ms, self.segment_end_ms, self._segment_first_word,
+                       self._segment_text, self._string_offsets, self._word_confidence,
+                       self._segment_confidence, self._strings, self._view):
+            column.release()
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+        self._buffer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def string(self, index):
+        start, end = self._string_offsets[index], self._string_offsets[index + 1]
+        return bytes(self._strings[start:end]).decode("utf-8")
+
+    def _word(self, i):
+        return {
+            "word": self.string(self._word_text[i]),
+            "start_ms": self.word_start_ms[i],
+            "end_ms": self.word_end_ms[i],
+            "confidence": self._word_confidence[i] / 255.0,
+        }
+
+    def words(self, start_ms=0, end_ms=None):
+        """Words whose start falls in [start_ms, end_ms), as dicts with millisecond offsets."""
+        first = bisect.bisect_left(self.word_start_ms, start_ms)
+        last = self.n_words if end_ms is None else bisect.bisect_left(self.word_start_ms, end_ms)
+        for i in range(first, last):
+            yield self._word(i)
+
+    def segments(self):
+        """Segments in the shape translate_segments and generate_vtt_content consume."""
+        segments = []
+        for i in range(self.n_segments):
+            segments.append({
+                "text": self.string(self._segment_text[i]),
+                "start_time": self.segment_start_ms[i] / 1000.0,
+                "end_time": self.segment_end_ms[i] / 1000.0,
+                "confidence": self._segment_confidence[i] / 255.0,
+            })
+        return segments
+
+    def segment_words(self, index):
+        """Words of one segment."""
+        first, last = self._segment_first_word[index], self._segment_first_word[index + 1]
+        return [self._word(i) for i in range(first, last)]
+
+
+def save_transcript(bucket, video_id, source_language, content):
+    """
+    Persist an encoded transcript once per (video_id, source_language).
+    Returns its gs:// URI.
+    """
+    blob_name = transcript_blob_name(video_id, source_language)
+    blob = bucket.blob(blob_name)
+    call("gcs", blob.upload_from_string, content, content_type="application/octet-stream",
+         idempotent=True, pass_timeout=True)
+    logger.info(f"Transcript stored at gs://{bucket.name}/{blob_name}")
+    return f"gs://{bucket.name}/{blob_name}"
+
+
+def _prune_cache(keep):
+    """
+    Drop expired cache entries, then the least recently used ones until the
+    directory fits TRANSCRIPT_CACHE_MAX_BYTES. Mapped files stay readable after unlink.
+    """
+    now = time.time()
+    entries = []
+    for name in os.listdir(TRANSCRIPT_CACHE_DIR):
+        path = os.path.join(TRANSCRIPT_CACHE_DIR, name)
+        if not name.endswith(".tsw") or path == keep:
+            continue
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        if now - stat.st_mtime > TRANSCRIPT_CACHE_TTL_SECONDS:
+            _remove(path)
+        else:
+            entries.append((stat.st_atime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    if os.path.exists(keep):
+        total += os.path.getsize(keep)
+    for _, size, path in sorted(entries):
+        if total <= TRANSCRIPT_CACHE_MAX_BYTES:
+            break
+        _remove(path)
+        total -= size
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def load_transcript(bucket, video_id, source_language):
+    """
+    Open the stored transcript for (video_id, source_language), or return None.
+    The object is cached on local disk and memory-mapped; close the reader when done.
+    Cached copies older than TRANSCRIPT_CACHE_TTL_SECONDS are fetched again.
+    """
+    blob_name = transcript_blob_name(video_id, source_language)
+    local_path = os.path.join(TRANSCRIPT_CACHE_DIR, os.path.basename(blob_name))
+    try:
+        downloaded_at = os.stat(local_path).st_mtime
+    except FileNotFoundError:
+        downloaded_at = None
+
+    if downloaded_at is None or time.time() - downloaded_at > TRANSCRIPT_CACHE_TTL_SECONDS:
+        blob = bucket.blob(blob_name)
+        if not call("gcs", blob.exists, idempotent=True, hedge=True, pass_timeout=True):
+            _remove(local_path)
+            return None
+        os.makedirs(TRANSCRIPT_CACHE_DIR, exist_ok=True)
+        fd, partial_path = tempfile.mkstemp(dir=TRANSCRIPT_CACHE_DIR, prefix=f"{os.path.basename(blob_name)}.", suffix=".part")
+        os.close(fd)
+        try:
+            call("gcs", blob.download_to_filename, partial_path, idempotent=True, pass_timeout=True)
+            os.replace(partial_path, local_path)
+        finally:
+            _remove(partial_path)
+        _prune_cache(keep=local_path)
+    else:
+        # Access time orders LRU eviction; the modification time stays the download time.
+        os.utime(local_path, (time.time(), downloaded_at))
+
+    with open(local_path, "rb") as transcript_file:
+        content = mmap.mmap(transcript_file.fileno(), 0, access=mmap.ACCESS_READ)
+    return TranscriptReader(content)
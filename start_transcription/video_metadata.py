@@ -0,0 +1,156 @@
+import os
+import math
+import time
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import yt_dlp
+from resilience import call
+
+logger = logging.getLogger(__name__)
+
+# Caption URLs in the metadata carry a signature that expires after a few hours.
+VIDEO_METADATA_TTL_SECONDS = int(os.getenv("VIDEO_METADATA_TTL_SECONDS", "10800"))
+VIDEO_METADATA_MEMORY_ENTRIES = int(os.getenv("VIDEO_METADATA_MEMORY_ENTRIES", "1024"))
+
+# Admission limits, checked before any media is downloaded.
+MAX_VIDEO_SECONDS = int(os.getenv("MAX_VIDEO_SECONDS", str(4 * 3600)))
+# Coins are charged per started billing block of audio.
+COIN_BILLING_BLOCK_SECONDS = int(os.getenv("COIN_BILLING_BLOCK_SECONDS", "3600"))
+# 16 kHz mono 16-bit WAV, the format the audio is converted to.
+WAV_BYTES_PER_SECOND = 32000
+
+FORMAT_FIELDS = ("format_id", "ext", "acodec", "vcodec", "abr", "filesize", "filesize_approx", "protocol")
+
+
+class VideoRejected(Exception):
+    """The video cannot be processed; `reason` is safe to show to the user."""
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def summarize_info(info):
+    """The parts of a yt-dlp info dict the pipeline uses, small enough to cache."""
+    return {
+        "video_id": info.get("id"),
+        "title": info.get("title"),
+        "duration": info.get("duration"),
+        "is_live": bool(info.get("is_live")),
+        "live_status": info.get("live_status"),
+        "availability": info.get("availability"),
+        "formats": [
+            {field: fmt.get(field) for field in FORMAT_FIELDS}
+            for fmt in info.get("formats") or []
+        ],
+        "subtitles": info.get("subtitles") or {},
+        "automatic_captions": info.get("automatic_captions") or {},
+    }
+
+
+class VideoMetadataCache:
+    """
+    Per-video yt-dlp metadata with a TTL, kept in Mongo so every instance shares
+    it and in a small in-process LRU in front of that. Repeat requests for a video
+    skip page extraction entirely.
+
+    get() also returns the full info dict when it extracted one during this call,
+    so the download can reuse it instead of extracting the page a second time.
+    """
+    def __init__(self, collection, ttl_seconds=VIDEO_METADATA_TTL_SECONDS,
+                 memory_entries=VIDEO_METADATA_MEMORY_ENTRIES):
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    def _remember(self, video_id, metadata):
+        with self._lock:
+            self._memory[video_id] = (time.monotonic() + self.ttl_seconds, metadata)
+            self._memory.move_to_end(video_id)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def cached(self, video_id):
+        """Cached metadata for a video, or None. Never extracts."""
+        with self._lock:
+            entry = self._memory.get(video_id)
+            if entry and entry[0] > time.monotonic():
+                self._memory.move_to_end(video_id)
+                return entry[1]
+        document = self.collection.find_one({"_id": video_id, "expires_at": {"$gt": datetime.now()}})
+        if not document:
+            return None
+        self._remember(video_id, document["metadata"])
+        return document["metadata"]
+
+    def get(self, video_url, video_id):
+        """Return (metadata, info); info is None when the metadata came from the cache."""
+        metadata = self.cached(video_id)
+        if metadata is not None:
+            return metadata, None
+
+        with yt_dlp.YoutubeDL({"skip_download": True, "quiet": True}) as ydl:
+            info = call("youtube", ydl.extract_info, video_url, download=False, idempotent=True)
+        metadata = summarize_info(info)
+        now = datetime.now()
+        self.collection.update_one(
+            {"_id": video_id},
+            {"$set": {
+                "metadata": metadata,
+                "fetched_at": now,
+                "expires_at": now + timedelta(seconds=self.ttl_seconds),
+            }},
+            upsert=True
+        )
+        self._remember(video_id, metadata)
+        return metadata, info
+
+
+def audio_formats(metadata):
+    return [fmt for fmt in metadata.get("formats") or [] if fmt.get("acodec") not in (None, "none")]
+
+
+def admit_video(metadata, quota_bytes=None):
+    """
+    Decide before downloading whether a video can be processed.
+    Returns a plan {"duration", "audio_only", "estimated_bytes"}; raises VideoRejected.
+    """
+    live_status = metadata.get("live_status")
+    if metadata.get("is_live") or live_status in ("is_live", "is_upcoming"):
+        raise VideoRejected("Live streams and upcoming premieres are not supported.")
+    if metadata.get("availability") in ("needs_auth", "premium_only", "subscriber_only"):
+        raise VideoRejected("This video requires a sign-in and cannot be processed.")
+
+    duration = metadata.get("duration")
+    if duration and duration > MAX_VIDEO_SECONDS:
+        raise VideoRejected(
+            f"Video is {duration / 3600:.1f} hours long; the limit is {MAX_VIDEO_SECONDS / 3600:.1f} hours."
+        )
+
+    formats = audio_formats(metadata)
+    if metadata.get("formats") and not formats:
+        raise VideoRejected("Video has no audio stream.")
+    audio_only = [fmt for fmt in formats if fmt.get("vcodec") in (None, "none")]
+
+    # The download profile picks the smallest audio-only stream, or failing that the
+    # smallest muxed stream (worst[acodec!=none]), which brings the video down with it.
+    candidates = audio_only or formats
+    sizes = [fmt.get("filesize") or fmt.get("filesize_approx") for fmt in candidates]
+    sizes = [size for size in sizes if size]
+    estimated_bytes = min(sizes, default=0)
+    if duration:
+        estimated_bytes += int(duration * WAV_BYTES_PER_SECOND)
+    if quota_bytes and estimated_bytes > quota_bytes:
+        raise VideoRejected("Video is too large to process.")
+
+    return {"duration": duration, "audio_only": bool(audio_only), "estimated_bytes": estimated_bytes}
+
+
+def video_cost(metadata, coins_per_block):
+    """Coins for transcribing one video: `coins_per_block` per started billing block of audio."""
+    duration = (metadata or {}).get("duration") or 0
+    return coins_per_block * max(1, math.ceil(duration / COIN_BILLING_BLOCK_SECONDS))
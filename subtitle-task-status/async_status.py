@@ -0,0 +1,151 @@
+import os
+import asyncio
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import AsyncMongoClient
+from task_process import (
+    DB_NAME,
+    COLLECTION_NAME,
+    MONGO_URI,
+    get_cached_subtitles,
+    get_completed_subtitles,
+    process_video,
+    recognizer,
+    stt_scheduler,
+    timings_collection,
+)
+from eta import DEFAULT_AUDIO_SECONDS, estimate_eta, get_model, peek_model
+from checkpoints import stage_reached
+from resilience import deadline, remaining_time
+
+logger = logging.getLogger(__name__)
+
+# Longest a client may ask the async handler to hold a poll open ("wait" seconds).
+LONG_POLL_MAX_SECONDS = float(os.getenv("LONG_POLL_MAX_SECONDS", "25"))
+LONG_POLL_INTERVAL_SECONDS = float(os.getenv("LONG_POLL_INTERVAL_SECONDS", "2"))
+# Blocking work (GCS misses, renders, scheduler dispatch) runs on threads, at most this many at once.
+ASYNC_BLOCKING_CONCURRENCY = int(os.getenv("ASYNC_BLOCKING_CONCURRENCY", "16"))
+# How long a request may wait for one of those threads before it is turned away with a 503.
+ASYNC_BLOCKING_QUEUE_SECONDS = float(os.getenv("ASYNC_BLOCKING_QUEUE_SECONDS", "2"))
+
+_async_client = None
+_blocking = None
+_executor = ThreadPoolExecutor(max_workers=ASYNC_BLOCKING_CONCURRENCY, thread_name_prefix="status-blocking")
+_renders = {}
+
+
+class StatusOverloaded(Exception):
+    """Raised when no blocking slot frees up within ASYNC_BLOCKING_QUEUE_SECONDS."""
+    def __init__(self, retry_after):
+        super().__init__("Too many status checks in progress, retry later")
+        self.retry_after = retry_after
+
+
+def get_async_collection():
+    """The tasks collection on an async client, created inside the running event loop."""
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncMongoClient(MONGO_URI)
+    return _async_client[DB_NAME][COLLECTION_NAME]
+
+
+def _run_with_budget(budget, fn, args, kwargs):
+    if budget is None:
+        return fn(*args, **kwargs)
+    with deadline(budget, restart=True):
+        return fn(*args, **kwargs)
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """
+    Run sync code (google-cloud-storage has no asyncio API) on this module's own
+    threads, bounded so thousands of parked polls cannot turn into thousands of
+    threads. Time spent waiting for a thread does not count against the request
+    deadline; a request that waits longer than ASYNC_BLOCKING_QUEUE_SECONDS gets
+    StatusOverloaded instead.
+    """
+    global _blocking
+    if _blocking is None:
+        _blocking = asyncio.Semaphore(ASYNC_BLOCKING_CONCURRENCY)
+    budget = remaining_time()
+    try:
+        await asyncio.wait_for(_blocking.acquire(), timeout=ASYNC_BLOCKING_QUEUE_SECONDS)
+    except asyncio.TimeoutError:
+        raise StatusOverloaded(retry_after=max(1, round(ASYNC_BLOCKING_QUEUE_SECONDS)))
+    try:
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            _executor, context.run, _run_with_budget, budget, fn, args, kwargs
+        )
+    finally:
+        _blocking.release()
+
+
+async def estimate_eta_async(task):
+    model = peek_model(task.get("source_language"), task.get("audio_seconds") or DEFAULT_AUDIO_SECONDS)
+    if model is None:
+        model = await run_blocking(
+            get_model, timings_collection, task.get("source_language"),
+            task.get("audio_seconds") or DEFAULT_AUDIO_SECONDS
+        )
+    return estimate_eta(timings_collection, task, model=model)
+
+
+async def completed_subtitles(bucket_name, task, inline):
+    """Cache hits are answered on the event loop; misses read GCS on a thread."""
+    args = (task.get("video_id"), task.get("source_language"), task.get("target_language"))
+    return get_cached_subtitles(*args, inline=inline) or await run_blocking(
+        get_completed_subtitles, bucket_name, *args, inline=inline
+    )
+
+
+async def render(bucket_name, task):
+    """
+    Turn a finished operation into subtitles via the sync pipeline. Concurrent
+    polls of the same task in this process share one render.
+    """
+    task_id = task["task_id"]
+    pending = _renders.get(task_id)
+    if pending is None:
+        pending = asyncio.ensure_future(run_blocking(
+            process_video,
+            bucket_name, task_id, task.get("operation_id"), task.get("video_id"),
+            task.get("source_language"), task.get("target_language"),
+            time_offset=task.get("time_offset", 0.0),
+            clip_duration=task.get("clip_duration"),
+            transcript_video_id=task.get("reused_from"),
+            task=task,
+        ))
+        _renders[task_id] = pending
+        pending.add_done_callback(lambda _: _renders.pop(task_id, None))
+    return await asyncio.shield(pending)
+
+
+async def poll_task(bucket_name, task, inline=False):
+    """
+    One status check without blocking the event loop: the operation is polled
+    through the async recognizer and only a finished one is rendered on a thread.
+    """
+    if task.get("status") == "completed" or stage_reached(task, "rendered"):
+        result = await completed_subtitles(bucket_name, task, inline)
+        if result:
+            return result
+
+    if not task.get("operation_id") and task.get("status") == "queued":
+        await run_blocking(stt_scheduler.dispatch)
+        task = await get_async_collection().find_one({"task_id": task["task_id"]})
+        if not task.get("operation_id"):
+            return {
+                "status": "queued",
+                "message": "Waiting for transcription capacity",
+                "queue_position": await run_blocking(stt_scheduler.queue_position, task["task_id"]),
+            }
+    if not task.get("operation_id") and not stage_reached(task, "transcribed"):
+        return {"error": "Operation ID not found in task details."}
+
+    if not stage_reached(task, "transcribed"):
+        operation = await recognizer.poll_async(task["operation_id"])
+        if not operation["done"]:
+            return {"status": "in_progress", "message": "Transcription still in progress"}
+    return await render(bucket_name, task)
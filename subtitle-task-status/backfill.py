@@ -0,0 +1,281 @@
+"""
+Re-translate and re-render stored subtitles in bulk.
+
+Tasks are selected from SubtitledVideos by a Mongo query; each distinct
+(video, source language, target language) is rendered once from the stored
+transcript and written to subtitles/{video_id}_{src}_{tgt}.vtt. Work is spread
+over a process pool, each process rendering a chunk of videos on a few threads
+since the time goes into Translate and GCS round trips.
+
+Progress is checkpointed in BackfillRuns after every batch; running again with
+the same --run-id resumes after the last checkpointed task.
+
+    python backfill.py --run-id vtt-v2 --processes 8
+    python backfill.py --run-id add-fr --query '{"source_language": "en"}' --target-languages fr,de
+    python backfill.py --run-id vtt-v2 --reuse-translations   # formatting change only
+"""
+import os
+import json
+import time
+import logging
+import argparse
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BUCKET_NAME = os.getenv("BACKFILL_BUCKET_NAME", "tube_genius")
+BACKFILL_PROCESSES = int(os.getenv("BACKFILL_PROCESSES", str(os.cpu_count() or 1)))
+BACKFILL_THREADS = int(os.getenv("BACKFILL_THREADS", "8"))
+BACKFILL_CHUNK_SIZE = int(os.getenv("BACKFILL_CHUNK_SIZE", "25"))
+BACKFILL_BATCH_SIZE = int(os.getenv("BACKFILL_BATCH_SIZE", "2000"))
+BACKFILL_PROGRESS_SECONDS = float(os.getenv("BACKFILL_PROGRESS_SECONDS", "10"))
+# gRPC and pymongo clients do not survive fork(), so workers start fresh by default.
+BACKFILL_START_METHOD = os.getenv("BACKFILL_START_METHOD", "spawn")
+BACKFILL_MAX_ERRORS_KEPT = 100
+
+# Tasks whose transcript is stored; anything earlier has nothing to re-render.
+TRANSCRIBED_STAGES = ["transcribed", "translated", "rendered"]
+
+_task_process = None
+
+
+def _pipeline():
+    """task_process, imported once per worker process."""
+    global _task_process
+    if _task_process is None:
+        import task_process
+        _task_process = task_process
+    return _task_process
+
+
+def render_unit(bucket_name, unit, reuse_translation=False):
+    """
+    Render one (video, source, target) from its stored transcript.
+    Returns "rendered", or "missing" when the transcript is gone.
+    """
+    tp = _pipeline()
+    video_id, source_language, target_language = unit["video_id"], unit["source_language"], unit["target_language"]
+
+    translated_segments = None
+    if reuse_translation:
+        translated_segments = tp.load_translated_segments(
+            f"gs://{bucket_name}/{tp.translation_blob_name(video_id, source_language, target_language)}"
+        )
+    if translated_segments is None:
+        bucket = tp.storage_client.bucket(bucket_name)
+        transcript = tp.load_transcript(bucket, unit["transcript_video_id"], source_language)
+        if transcript is None:
+            return "missing"
+        with transcript:
+            segments = transcript.segments()
+        if unit["time_offset"] or unit["clip_duration"] is not None:
+            segments = tp.apply_time_offset(segments, unit["time_offset"], unit["clip_duration"])
+        if not segments:
+            return "missing"
+        translated_segments = tp.translate_segments(segments, source_language, target_language, tp.credentials)
+        tp.save_translated_segments(bucket_name, video_id, source_language, target_language, translated_segments)
+
+    vtt_content = tp.generate_vtt_content(translated_segments)
+    if not vtt_content:
+        raise ValueError("Failed to generate VTT content")
+    blob = tp.storage_client.bucket(bucket_name).blob(f"subtitles/{video_id}_{source_language}_{target_language}.vtt")
+    tp.call(
+        "gcs", blob.upload_from_string, vtt_content,
+        content_type="text/vtt; charset=utf-8", idempotent=True, pass_timeout=True
+    )
+    return "rendered"
+
+
+def render_chunk(bucket_name, units, reuse_translation=False, threads=BACKFILL_THREADS):
+    """Render a chunk of units on a thread pool. Returns [(unit, status, error)]."""
+    def render(unit):
+        try:
+            return unit, render_unit(bucket_name, unit, reuse_translation), None
+        except Exception as e:
+            logger.error(f"Backfill of {unit['video_id']} ({unit['source_language']}->{unit['target_language']}) failed: {e}")
+            return unit, "failed", str(e)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(threads, len(units)))) as executor:
+        return list(executor.map(render, units))
+
+
+def task_units(task, target_languages=None):
+    """The (video, source, target) renders one task contributes."""
+    for target_language in target_languages or [task.get("target_language")]:
+        if not target_language:
+            continue
+        yield {
+            "video_id": task["video_id"],
+            "transcript_video_id": task.get("reused_from") or task["video_id"],
+            "source_language": task.get("source_language", "en"),
+            "target_language": target_language,
+            "time_offset": task.get("time_offset", 0.0),
+            "clip_duration": task.get("clip_duration"),
+        }
+
+
+class Progress:
+    """Counts and throughput of a run, printed every `interval` seconds."""
+    def __init__(self, run, total_tasks, interval=BACKFILL_PROGRESS_SECONDS):
+        self.counts = {key: run.get(key, 0) for key in ("tasks", "rendered", "missing", "failed")}
+        self.start_counts = dict(self.counts)
+        self.total_tasks = total_tasks
+        self.interval = interval
+        self.started = time.monotonic()
+        self.reported = self.started
+
+    def add(self, key, amount=1):
+        self.counts[key] += amount
+
+    def report(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.reported < self.interval:
+            return None
+        self.reported = now
+        elapsed = max(now - self.started, 1e-9)
+        tasks_done = self.counts["tasks"] - self.start_counts["tasks"]
+        renders = sum(self.counts[key] - self.start_counts[key] for key in ("rendered", "missing", "failed"))
+        remaining = max(self.total_tasks - tasks_done, 0)
+        task_rate = tasks_done / elapsed
+        line = {
+            "tasks": f"{tasks_done}/{self.total_tasks}",
+            "rendered": self.counts["rendered"],
+            "missing": self.counts["missing"],
+            "failed": self.counts["failed"],
+            "renders_per_second": round(renders / elapsed, 2),
+            "tasks_per_second": round(task_rate, 2),
+            "eta_seconds": round(remaining / task_rate) if task_rate else None,
+            "elapsed_seconds": round(elapsed, 1),
+        }
+        print(json.dumps(line), flush=True)
+        return line
+
+
+def load_run(runs, run_id, query, target_languages, restart=False):
+    """The checkpoint document of a run, created on first use."""
+    run = runs.find_one({"_id": run_id})
+    if run and not restart:
+        if run["query"] != json.dumps(query, sort_keys=True) or run.get("target_languages") != target_languages:
+            raise SystemExit(f"Run {run_id} was started with a different query or targets; use --restart")
+        return run
+    run = {
+        "_id": run_id,
+        "query": json.dumps(query, sort_keys=True),
+        "target_languages": target_languages,
+        "cursor": None,
+        "tasks": 0, "rendered": 0, "missing": 0, "failed": 0,
+        "errors": [],
+        "started_at": datetime.now(),
+    }
+    runs.replace_one({"_id": run_id}, run, upsert=True)
+    return run
+
+
+def run_backfill(collection, runs, run_id, query, bucket_name=BACKFILL_BUCKET_NAME, target_languages=None,
+                 processes=BACKFILL_PROCESSES, threads=BACKFILL_THREADS, chunk_size=BACKFILL_CHUNK_SIZE,
+                 batch_size=BACKFILL_BATCH_SIZE, reuse_translation=False, restart=False, limit=None,
+                 start_method=BACKFILL_START_METHOD):
+    """
+    Render every unit selected by `query`, checkpointing the task cursor after each
+    batch. With processes=0 chunks run on threads in this process.
+    """
+    run = load_run(runs, run_id, query, target_languages, restart=restart)
+    selection = {"$and": [query, {"video_id": {"$exists": True}, "stage": {"$in": TRANSCRIBED_STAGES}}]}
+    if run.get("cursor") is not None:
+        selection["$and"].append({"_id": {"$gt": run["cursor"]}})
+    total = collection.count_documents(selection)
+    if limit:
+        total = min(total, limit)
+    progress = Progress(run, total)
+    print(json.dumps({"run_id": run_id, "resume_after": str(run.get("cursor")), "tasks": total}), flush=True)
+
+    if processes:
+        executor = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context(start_method))
+    else:
+        # Two chunks in flight so the next one starts while the last renders of a chunk finish.
+        executor = ThreadPoolExecutor(max_workers=2)
+    seen = set()
+    tasks = collection.find(selection, {
+        "_id": 1, "video_id": 1, "reused_from": 1, "source_language": 1, "target_language": 1,
+        "time_offset": 1, "clip_duration": 1,
+    }).sort("_id", 1)
+    if limit:
+        tasks = tasks.limit(limit)
+
+    def flush(batch_units, batch_tasks, cursor):
+        """Render one batch, keeping every worker busy, then checkpoint past it."""
+        chunks = [batch_units[i:i + chunk_size] for i in range(0, len(batch_units), chunk_size)]
+        pending = {executor.submit(render_chunk, bucket_name, chunk, reuse_translation, threads) for chunk in chunks}
+        errors = []
+        while pending:
+            done, pending = wait(pending, timeout=progress.interval, return_when=FIRST_COMPLETED)
+            for future in done:
+                for unit, status, error in future.result():
+                    progress.add(status)
+                    if error:
+                        errors.append({"video_id": unit["video_id"], "target_language": unit["target_language"],
+                                       "error": error})
+            progress.report()
+        progress.add("tasks", batch_tasks)
+        runs.update_one({"_id": run_id}, {
+            "$set": {"cursor": cursor, "updated_at": datetime.now(),
+                     **{key: progress.counts[key] for key in ("tasks", "rendered", "missing", "failed")}},
+            "$push": {"errors": {"$each": errors, "$slice": -BACKFILL_MAX_ERRORS_KEPT}},
+        })
+        progress.report()
+
+    try:
+        batch_units, batch_tasks, cursor = [], 0, None
+        for task in tasks:
+            batch_tasks += 1
+            cursor = task["_id"]
+            for unit in task_units(task, target_languages):
+                key = (unit["video_id"], unit["source_language"], unit["target_language"])
+                if key not in seen:
+                    seen.add(key)
+                    batch_units.append(unit)
+            if batch_tasks >= batch_size:
+                flush(batch_units, batch_tasks, cursor)
+                batch_units, batch_tasks = [], 0
+        if batch_tasks:
+            flush(batch_units, batch_tasks, cursor)
+    finally:
+        executor.shutdown(wait=True)
+
+    runs.update_one({"_id": run_id}, {"$set": {"finished_at": datetime.now()}})
+    return progress.report(force=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--run-id", required=True, help="checkpoint name; rerun with the same id to resume")
+    parser.add_argument("--query", default="{}", help="Mongo query over SubtitledVideos (JSON)")
+    parser.add_argument("--target-languages", help="comma-separated targets to render instead of each task's own")
+    parser.add_argument("--bucket", default=BACKFILL_BUCKET_NAME)
+    parser.add_argument("--processes", type=int, default=BACKFILL_PROCESSES, help="0 runs everything in-process")
+    parser.add_argument("--threads", type=int, default=BACKFILL_THREADS, help="renders in flight per process")
+    parser.add_argument("--chunk-size", type=int, default=BACKFILL_CHUNK_SIZE)
+    parser.add_argument("--batch-size", type=int, default=BACKFILL_BATCH_SIZE, help="tasks per checkpoint")
+    parser.add_argument("--reuse-translations", action="store_true",
+                        help="re-render from stored translations, translating only where none exist")
+    parser.add_argument("--limit", type=int, help="stop after this many tasks")
+    parser.add_argument("--restart", action="store_true", help="discard the run's checkpoint")
+    parser.add_argument("--start-method", default=BACKFILL_START_METHOD, choices=["spawn", "fork", "forkserver"])
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    tp = _pipeline()
+    target_languages = [language for language in (args.target_languages or "").split(",") if language] or None
+    return run_backfill(
+        tp.collection, tp.db["BackfillRuns"], args.run_id, json.loads(args.query),
+        bucket_name=args.bucket, target_languages=target_languages, processes=args.processes,
+        threads=args.threads, chunk_size=args.chunk_size, batch_size=args.batch_size,
+        reuse_translation=args.reuse_translations, restart=args.restart, limit=args.limit,
+        start_method=args.start_method,
+    )
+
+
+if __name__ == "__main__":
+    main()
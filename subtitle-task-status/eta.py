@@ -0,0 +1,119 @@
+import os
+import math
+import time
+import logging
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# STT real-time factor (processing seconds per audio second) used until enough history exists.
+DEFAULT_STT_REALTIME_FACTOR = float(os.getenv("DEFAULT_STT_REALTIME_FACTOR", "0.5"))
+DEFAULT_AUDIO_SECONDS = float(os.getenv("DEFAULT_AUDIO_SECONDS", "600"))
+ETA_HISTORY_SIZE = int(os.getenv("ETA_HISTORY_SIZE", "200"))
+ETA_MIN_SAMPLES = int(os.getenv("ETA_MIN_SAMPLES", "5"))
+ETA_MODEL_TTL_SECONDS = float(os.getenv("ETA_MODEL_TTL_SECONDS", "300"))
+RETRY_AFTER_MIN_SECONDS = int(os.getenv("RETRY_AFTER_MIN_SECONDS", "2"))
+RETRY_AFTER_MAX_SECONDS = int(os.getenv("RETRY_AFTER_MAX_SECONDS", "60"))
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def length_bucket(audio_seconds):
+    """Power-of-two audio length bucket, so short clips and long lectures are modelled apart."""
+    return int(math.log2(max(audio_seconds, 1.0)))
+
+
+def _median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2.0
+
+
+def record_pipeline_timing(timings_collection, task, stt_seconds, translate_seconds):
+    """Store the measured STT and translation time of a finished task."""
+    audio_seconds = task.get("audio_seconds")
+    if not audio_seconds or stt_seconds is None:
+        return
+    timings_collection.insert_one({
+        "source_language": task.get("source_language"),
+        "target_language": task.get("target_language"),
+        "audio_seconds": audio_seconds,
+        "length_bucket": length_bucket(audio_seconds),
+        "stt_seconds": stt_seconds,
+        "stt_realtime_factor": stt_seconds / audio_seconds,
+        "translate_seconds": translate_seconds,
+        "created_at": datetime.now(),
+    })
+
+
+def _load_model(timings_collection, source_language, bucket):
+    """Median STT real-time factor and translation time from recent history."""
+    history = list(timings_collection.find(
+        {"source_language": source_language, "length_bucket": {"$gte": bucket - 1, "$lte": bucket + 1}},
+        {"_id": 0, "stt_realtime_factor": 1, "translate_seconds": 1},
+        sort=[("created_at", -1)],
+        limit=ETA_HISTORY_SIZE,
+    ))
+    if len(history) < ETA_MIN_SAMPLES:
+        return {"stt_realtime_factor": DEFAULT_STT_REALTIME_FACTOR, "translate_seconds": 0.0, "samples": len(history)}
+    return {
+        "stt_realtime_factor": _median([row["stt_realtime_factor"] for row in history]),
+        "translate_seconds": _median([row.get("translate_seconds") or 0.0 for row in history]),
+        "samples": len(history),
+    }
+
+
+def peek_model(source_language, audio_seconds):
+    """The cached model if it is still fresh, else None. Never touches the database."""
+    key = (source_language, length_bucket(audio_seconds))
+    with _models_lock:
+        cached = _models.get(key)
+    if cached and time.monotonic() - cached[0] < ETA_MODEL_TTL_SECONDS:
+        return cached[1]
+    return None
+
+
+def get_model(timings_collection, source_language, audio_seconds):
+    """Per-(language, length bucket) model, cached in-process so polling stays cheap."""
+    key = (source_language, length_bucket(audio_seconds))
+    now = time.monotonic()
+    with _models_lock:
+        cached = _models.get(key)
+        if cached and now - cached[0] < ETA_MODEL_TTL_SECONDS:
+            return cached[1]
+    try:
+        model = _load_model(timings_collection, source_language, key[1])
+    except Exception as e:
+        logger.error(f"Error loading ETA history: {e}")
+        model = {"stt_realtime_factor": DEFAULT_STT_REALTIME_FACTOR, "translate_seconds": 0.0, "samples": 0}
+    with _models_lock:
+        _models[key] = (now, model)
+    return model
+
+
+def submitted_at(task):
+    stage = ((task.get("stages") or {}).get("submitted") or {})
+    return stage.get("completed_at") or task.get("created_at")
+
+
+def estimate_eta(timings_collection, task, now=None, model=None):
+    """
+    Seconds until the task's subtitles should be ready, and the matching Retry-After.
+    Returns (eta_seconds, retry_after_seconds).
+    """
+    now = now or datetime.now()
+    audio_seconds = task.get("audio_seconds") or DEFAULT_AUDIO_SECONDS
+    model = model or get_model(timings_collection, task.get("source_language"), audio_seconds)
+    expected = model["stt_realtime_factor"] * audio_seconds + model["translate_seconds"]
+
+    started = submitted_at(task)
+    elapsed = (now - started).total_seconds() if started else 0.0
+    eta_seconds = max(expected - elapsed, 0.0)
+
+    # Poll again about halfway to the estimate; overdue tasks poll at the minimum rate.
+    retry_after = int(min(max(eta_seconds / 2.0, RETRY_AFTER_MIN_SECONDS), RETRY_AFTER_MAX_SECONDS))
+    return round(eta_seconds, 1), retry_after
@@ -1,8 +1,12 @@
 import os
+import uuid
 from datetime import timedelta
 import logging
 import subprocess
+import wave
 from google.cloud import storage
+from google.api_core.exceptions import NotFound
+from resilience import call
 from google.cloud import speech_v1p1beta1 as speech
 from google.cloud import translate_v2 as translate
 from google.oauth2 import service_account
@@ -51,6 +55,12 @@ LANGUAGE_CODE_MAPPING = {
     "ko": "ko-KR",  # Korean
     "tr": "tr-TR",  # Turkish
 }
+
+# Synchronous recognize only accepts about a minute of audio; anything longer
+# goes through GCS and long_running_recognize.
+SYNC_RECOGNIZE_MAX_SECONDS = float(os.getenv("SYNC_RECOGNIZE_MAX_SECONDS", "55"))
+LONG_RUNNING_TIMEOUT_SECONDS = int(os.getenv("LONG_RUNNING_TIMEOUT_SECONDS", "3600"))
+TRANSCRIBE_BUCKET_NAME = os.getenv("GCS_BUCKET_NAME", "tube_genius")
 def upload_to_gcs(bucket_name, source_file_path, destination_blob_name):
     """
     Uploads a file to Google Cloud Storage.
@@ -58,7 +68,7 @@ def upload_to_gcs(bucket_name, source_file_path, destination_blob_name):
     try:
         bucket = storage_client.bucket(bucket_name)
         blob = bucket.blob(destination_blob_name)
-        blob.upload_from_filename(source_file_path)
+        call("gcs", blob.upload_from_filename, source_file_path, idempotent=True, pass_timeout=True)
         logger.info(f"File uploaded to gs://{bucket_name}/{destination_blob_name}")
         return f"gs://{bucket_name}/{destination_blob_name}"
     except Exception as e:
@@ -72,7 +82,7 @@ def upload_subtitles_to_gcp(bucket_name,subtitles, destination_blob_name, creden
     try:
         
         blob = storage_client.bucket(bucket_name).blob(destination_blob_name)
-        blob.upload_from_string(subtitles, content_type="text/vtt")
+        call("gcs", blob.upload_from_string, subtitles, content_type="text/vtt", idempotent=True, pass_timeout=True)
 
         logger.info(f"File uploaded to gs://{bucket_name}/{destination_blob_name}")
 
@@ -107,22 +117,50 @@ def convert_audio_to_wav(input_path, output_path):
         logger.error(f"FFmpeg error: {e}")
         raise RuntimeError("FFmpeg conversion failed.")
 
-def transcribe_audio(audio_path, source_language="en"):
-    with open(audio_path, "rb") as audio_file:
-        content = audio_file.read()
+def probe_audio_duration(audio_path):
+    """
+    Return the duration of an audio file in seconds.
+    Reads only the WAV header when possible and falls back to ffprobe.
+    """
+    try:
+        with wave.open(audio_path, "rb") as wav_file:
+            frame_rate = wav_file.getframerate()
+            if frame_rate:
+                return wav_file.getnframes() / float(frame_rate)
+    except (wave.Error, EOFError) as e:
+        logger.info(f"WAV header probe failed for {audio_path}, using ffprobe: {e}")
 
-    audio = speech.RecognitionAudio(content=content)
-    config = speech.RecognitionConfig(
+    command = [
+        "ffprobe",
+        "-v", "error",
+        "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        audio_path
+    ]
+    try:
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        return float(output.strip())
+    except (subprocess.CalledProcessError, OSError, ValueError) as e:
+        logger.error(f"FFprobe error: {e}")
+        raise RuntimeError("Could not determine audio duration.")
+
+
+def _recognition_config(source_language):
+    return speech.RecognitionConfig(
         encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
         sample_rate_hertz=16000,
         language_code=LANGUAGE_CODE_MAPPING.get(source_language, "en-US"),
         enable_automatic_punctuation=True,  # Add punctuation for sentence detection
+        enable_word_time_offsets=True,
     )
 
-    response = speech_client.recognize(config=config, audio=audio)
+
+def _segments_from_response(response):
     transcript_with_timestamps = []
     for result in response.results:
         for alternative in result.alternatives:
+            if not alternative.words:
+                continue
             transcript_with_timestamps.append({
                 "text": alternative.transcript,
                 "start_time": alternative.words[0].start_time.total_seconds(),  # Start time of the first word
@@ -131,11 +169,51 @@ def transcribe_audio(audio_path, source_language="en"):
     return transcript_with_timestamps
 
 
+def transcribe_audio(audio_path, source_language="en", bucket_name=TRANSCRIBE_BUCKET_NAME):
+    """
+    Transcribe a local audio file into timed segments.
+    Clips up to SYNC_RECOGNIZE_MAX_SECONDS are read and sent inline to `recognize`,
+    which bounds the bytes held in memory; longer audio is uploaded to GCS and sent
+    to `long_running_recognize` so it is never read into memory. The uploaded copy
+    is deleted once recognition finishes.
+    """
+    duration = probe_audio_duration(audio_path)
+    config = _recognition_config(source_language)
+
+    if duration <= SYNC_RECOGNIZE_MAX_SECONDS:
+        logger.info(f"Transcribing {duration:.1f}s clip with synchronous recognize")
+        with open(audio_path, "rb") as audio_file:
+            audio = speech.RecognitionAudio(content=audio_file.read())
+        response = call("speech", speech_client.recognize, config=config, audio=audio, pass_timeout=True)
+        return _segments_from_response(response)
+
+    logger.info(f"Transcribing {duration:.1f}s audio with long_running_recognize")
+    # A per-call name so concurrent jobs with the same file name do not overwrite each other.
+    destination_blob_name = f"audio/transcribe/{uuid.uuid4().hex}-{os.path.basename(audio_path)}"
+    try:
+        gcs_uri = upload_to_gcs(bucket_name, audio_path, destination_blob_name)
+        if not gcs_uri:
+            raise RuntimeError("Failed to upload audio for long-running recognition.")
+
+        audio = speech.RecognitionAudio(uri=gcs_uri)
+        operation = call("speech", speech_client.long_running_recognize, config=config, audio=audio)
+        response = operation.result(timeout=LONG_RUNNING_TIMEOUT_SECONDS)
+        return _segments_from_response(response)
+    finally:
+        blob = storage_client.bucket(bucket_name).blob(destination_blob_name)
+        try:
+            call("gcs", blob.delete, idempotent=True, pass_timeout=True)
+        except NotFound:
+            pass
+        except Exception as e:
+            logger.warning(f"Could not delete temporary audio {destination_blob_name}: {e}")
+
+
 def translate_text(text, target_language):
     """
     Translate text using Google Translate API.
     """
-    result = translate_client.translate(text, target_language=target_language)
+    result = call("translate", translate_client.translate, text, target_language=target_language, idempotent=True)
     return result["translatedText"]
 
 
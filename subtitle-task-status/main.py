@@ -1,9 +1,26 @@
+import hmac
 import logging
 import os
+import time
+import asyncio
 import functions_framework
+import functions_framework.aio
 import json
 from pymongo import MongoClient
-from task_process import process_video
+from task_process import process_video, get_completed_subtitles, timings_collection, stt_scheduler
+from eta import estimate_eta
+from subtitle_cache import subtitle_cache
+from resilience import deadline
+from checkpoints import stage_reached
+from profiling import profiled
+from async_status import (
+    LONG_POLL_INTERVAL_SECONDS,
+    LONG_POLL_MAX_SECONDS,
+    StatusOverloaded,
+    estimate_eta_async,
+    get_async_collection,
+    poll_task,
+)
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -13,6 +30,10 @@ logger = logging.getLogger(__name__)
 MONGO_URI = os.getenv("MONGO_URI")
 DB_NAME = os.getenv("DB_NAME", "tubeai")
 COLLECTION_NAME = "SubtitledVideos"
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "50"))
+# {"cache_stats": true} is only answered for requests sending "X-Cache-Stats: <CACHE_STATS_TOKEN>".
+CACHE_STATS_TOKEN = os.getenv("CACHE_STATS_TOKEN", "")
+CACHE_STATS_HEADER = "X-Cache-Stats"
 
 # Initialize MongoDB Client
 mongo_client = MongoClient(MONGO_URI)
@@ -20,8 +41,25 @@ db = mongo_client[DB_NAME]
 collection = db[COLLECTION_NAME]
 
 
+def cache_stats_allowed(request, request_json):
+    if not (request_json and request_json.get("cache_stats") and CACHE_STATS_TOKEN):
+        return False
+    header = request.headers.get(CACHE_STATS_HEADER) if getattr(request, "headers", None) else None
+    return bool(header) and hmac.compare_digest(header, CACHE_STATS_TOKEN)
+
+
+def cors_headers():
+    return {
+        "Access-Control-Allow-Origin": "*",
+        "Access-Control-Allow-Methods": "GET, OPTIONS",
+        "Access-Control-Allow-Headers": f"Content-Type, X-Profile, {CACHE_STATS_HEADER}",
+        "Content-Type": "application/json",
+        "Access-Control-Expose-Headers": "Retry-After, X-Subtitle-Cache",
+    }
+
 
 @functions_framework.http
+@profiled("subtitle_task_status")
 def subtitle_task_status(request):
     """
     Cloud Function to check the status of a task from Pub/Sub.
@@ -29,12 +67,7 @@ def subtitle_task_status(request):
     """
     try:
         # Set CORS headers
-        headers = {
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "GET, OPTIONS",
-            "Access-Control-Allow-Headers": "Content-Type",
-            "Content-Type": "application/json",
-        }
+        headers = cors_headers()
 
         # Handle preflight OPTIONS request
         if request.method == "OPTIONS":
@@ -42,30 +75,69 @@ def subtitle_task_status(request):
 
         # Parse JSON request
         request_json = request.get_json(silent=True)
+        if cache_stats_allowed(request, request_json):
+            return json.dumps(subtitle_cache.stats()), 200, headers
+
         if not request_json or "task_id" not in request_json:
             return json.dumps({"error": "task_id is required"}), 400, headers
-        
-        
 
         task_id = request_json["task_id"]
         task = collection.find_one({"task_id": task_id})
+
+        if not task:
+            return {"error": "Task not found."}, 404, headers
+
         video_id = task.get("video_id")
         source_language = task.get("source_language")
         target_language = task.get("target_language")
-       
-        if not task:
-            return {"error": "Task not found."}, 404, headers
-        
+        BUCKET_NAME = "tube_genius"
+
+        if task.get("status") == "completed" or stage_reached(task, "rendered"):
+            with deadline(REQUEST_DEADLINE_SECONDS):
+                result = get_completed_subtitles(
+                    BUCKET_NAME, video_id, source_language, target_language,
+                    inline=bool(request_json.get("inline"))
+                )
+            if result:
+                headers["X-Subtitle-Cache"] = result["cache"]
+                return json.dumps(result, indent=2), 200, headers
+
         operation_id = task.get("operation_id")
-        if not operation_id:
+        if not operation_id and task.get("status") == "queued":
+            # Polling a queued task also moves the queue along.
+            with deadline(REQUEST_DEADLINE_SECONDS):
+                stt_scheduler.dispatch()
+            task = collection.find_one({"task_id": task_id})
+            operation_id = task.get("operation_id")
+            if not operation_id:
+                eta_seconds, retry_after = estimate_eta(timings_collection, task)
+                headers["Retry-After"] = str(retry_after)
+                result = {
+                    "status": "queued",
+                    "message": "Waiting for transcription capacity",
+                    "queue_position": stt_scheduler.queue_position(task_id),
+                    "eta_seconds": eta_seconds,
+                }
+                return json.dumps(result, indent=2), 200, headers
+        if not operation_id and not stage_reached(task, "transcribed"):
             return {"error": "Operation ID not found in task details."}, 400,headers
-       
-        BUCKET_NAME = "tube_genius"
-        
+
 
         print("\nFinal Result:")
      
-        result = process_video(BUCKET_NAME,task_id,operation_id,video_id,source_language,target_language)
+        with deadline(REQUEST_DEADLINE_SECONDS):
+            result = process_video(
+                BUCKET_NAME, task_id, operation_id, video_id, source_language, target_language,
+                time_offset=task.get("time_offset", 0.0),
+                clip_duration=task.get("clip_duration"),
+                transcript_video_id=task.get("reused_from"),
+                task=task,
+            )
+        if result.get("status") == "in_progress":
+            eta_seconds, retry_after = estimate_eta(timings_collection, task)
+            result["eta_seconds"] = eta_seconds
+            headers["Retry-After"] = str(retry_after)
+
         # Return the response
         if "error" in result:
             return json.dumps(result), 400, headers
@@ -75,4 +147,72 @@ def subtitle_task_status(request):
        
     except Exception as e:
         return json.dumps({"error": str(e)}), 500, headers
-    
\ No newline at end of file
+    
+
+
+@functions_framework.aio.http
+async def subtitle_task_status_async(request):
+    """
+    Asyncio variant of subtitle_task_status with the same JSON contract.
+    Mongo and Speech polling are awaited instead of holding a worker thread, so
+    one instance can keep thousands of polls open. With "wait": N in the body the
+    request long-polls for up to N seconds until the task changes state.
+    """
+    from starlette.responses import Response
+
+    headers = cors_headers()
+
+    def respond(result, status_code):
+        return Response(json.dumps(result, indent=2), status_code=status_code, headers=headers)
+
+    try:
+        if request.method == "OPTIONS":
+            return Response("", status_code=204, headers=headers)
+
+        try:
+            request_json = await request.json()
+        except ValueError:
+            request_json = None
+        if cache_stats_allowed(request, request_json):
+            return respond(subtitle_cache.stats(), 200)
+
+        if not request_json or "task_id" not in request_json:
+            return respond({"error": "task_id is required"}, 400)
+
+        task_id = request_json["task_id"]
+        tasks = get_async_collection()
+        task = await tasks.find_one({"task_id": task_id})
+        if not task:
+            return respond({"error": "Task not found."}, 404)
+
+        BUCKET_NAME = "tube_genius"
+        wait_seconds = min(float(request_json.get("wait") or 0), LONG_POLL_MAX_SECONDS, REQUEST_DEADLINE_SECONDS)
+        with deadline(REQUEST_DEADLINE_SECONDS):
+            give_up_at = time.monotonic() + wait_seconds
+            while True:
+                result = await poll_task(BUCKET_NAME, task, inline=bool(request_json.get("inline")))
+                if result.get("status") not in ("in_progress", "queued"):
+                    break
+                left = give_up_at - time.monotonic()
+                if left <= 0:
+                    break
+                await asyncio.sleep(min(LONG_POLL_INTERVAL_SECONDS, left))
+                task = await tasks.find_one({"task_id": task_id})
+
+        if "cache" in result:
+            headers["X-Subtitle-Cache"] = result["cache"]
+        if result.get("status") in ("in_progress", "queued"):
+            eta_seconds, retry_after = await estimate_eta_async(task)
+            result["eta_seconds"] = eta_seconds
+            headers["Retry-After"] = str(retry_after)
+
+        if "error" in result:
+            return respond(result, 400)
+        return respond(result, 200)
+
+    except StatusOverloaded as e:
+        headers["Retry-After"] = str(e.retry_after)
+        return respond({"error": str(e)}, 503)
+    except Exception as e:
+        logger.error(f"Error in subtitle_task_status_async: {e}")
+        return respond({"error": str(e)}, 500)
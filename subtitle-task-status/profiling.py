@@ -0,0 +1,131 @@
+import io
+import os
+import hmac
+import time
+import marshal
+import pstats
+import random
+import cProfile
+import logging
+import functools
+import threading
+import tracemalloc
+import re
+from datetime import datetime
+from helper import storage_client
+
+logger = logging.getLogger(__name__)
+
+# Profiling is opt-in: every request when PROFILING_ENABLED=1 (subject to the
+# sample rate), or a single request sending "X-Profile: <PROFILING_TOKEN>".
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0.01"))
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+PROFILING_MAX_PER_MINUTE = int(os.getenv("PROFILING_MAX_PER_MINUTE", "2"))
+PROFILING_OUTPUT = os.getenv("PROFILING_OUTPUT", "/tmp/profiles")  # local dir or gs://bucket/prefix
+PROFILING_TOP_ALLOCATIONS = int(os.getenv("PROFILING_TOP_ALLOCATIONS", "25"))
+PROFILE_HEADER = "X-Profile"
+
+# tracemalloc is process-wide, so only one request is profiled at a time.
+_profile_lock = threading.Lock()
+_recent_profiles = []
+_rate_lock = threading.Lock()
+
+
+def _allow_by_rate():
+    now = time.monotonic()
+    with _rate_lock:
+        while _recent_profiles and now - _recent_profiles[0] > 60:
+            _recent_profiles.pop(0)
+        if len(_recent_profiles) >= PROFILING_MAX_PER_MINUTE:
+            return False
+        _recent_profiles.append(now)
+        return True
+
+
+def should_profile(request):
+    """Whether this request asks to be profiled, by token or by sampling. The rate limit is applied separately."""
+    header = request.headers.get(PROFILE_HEADER) if getattr(request, "headers", None) else None
+    if header and PROFILING_TOKEN and hmac.compare_digest(header.encode("utf-8"), PROFILING_TOKEN.encode("utf-8")):
+        return True
+    if PROFILING_ENABLED:
+        return random.random() < PROFILING_SAMPLE_RATE
+    return False
+
+
+def _write_artifact(name, content):
+    if PROFILING_OUTPUT.startswith("gs://"):
+        bucket_name, _, prefix = PROFILING_OUTPUT[len("gs://"):].partition("/")
+        blob_name = f"{prefix.rstrip('/')}/{name}" if prefix else name
+        storage_client.bucket(bucket_name).blob(blob_name).upload_from_string(content)
+        return f"gs://{bucket_name}/{blob_name}"
+    path = os.path.join(PROFILING_OUTPUT, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as artifact:
+        artifact.write(content if isinstance(content, bytes) else content.encode("utf-8"))
+    return path
+
+
+def save_profile(function_name, task_id, profiler, snapshot, elapsed):
+    """Write the raw profile, a readable summary and the top allocations under the task_id."""
+    stamp = datetime.now().strftime("%Y%m%dT%H%M%S%f")
+    safe_task_id = re.sub(r"[^A-Za-z0-9_.-]", "_", str(task_id or "no-task")).lstrip(".")
+    base = f"{safe_task_id}/{function_name}-{stamp}"
+
+    profiler.create_stats()
+    raw = marshal.dumps(profiler.stats)
+
+    summary = io.StringIO()
+    summary.write(f"{function_name} task_id={task_id} wall={elapsed:.3f}s\n\n")
+    pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(40)
+
+    allocations = io.StringIO()
+    top = snapshot.statistics("lineno")[:PROFILING_TOP_ALLOCATIONS]
+    total = sum(stat.size for stat in snapshot.statistics("filename"))
+    allocations.write(f"Top {len(top)} allocations, {total} bytes traced\n")
+    for stat in top:
+        allocations.write(f"{stat}\n")
+
+    stats_path = _write_artifact(f"{base}.prof", raw)
+    _write_artifact(f"{base}.txt", summary.getvalue())
+    _write_artifact(f"{base}.alloc.txt", allocations.getvalue())
+    logger.info(f"Profile for {function_name} task {task_id} written to {stats_path}")
+    return stats_path
+
+
+def profiled(function_name):
+    """
+    Wrap an HTTP handler with opt-in cProfile and tracemalloc profiling.
+    Requests that are not selected run the handler untouched.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(request):
+            if not should_profile(request) or not _profile_lock.acquire(blocking=False):
+                return handler(request)
+            # Only a request that actually gets the profiler uses up a rate-limit slot.
+            if not _allow_by_rate():
+                _profile_lock.release()
+                return handler(request)
+            try:
+                payload = request.get_json(silent=True) or {}
+                task_id = payload.get("task_id") if isinstance(payload, dict) else None
+                profiler = cProfile.Profile()
+                tracemalloc.start()
+                started = time.perf_counter()
+                profiler.enable()
+                try:
+                    return handler(request)
+                finally:
+                    profiler.disable()
+                    elapsed = time.perf_counter() - started
+                    snapshot = tracemalloc.take_snapshot()
+                    tracemalloc.stop()
+                    try:
+                        save_profile(function_name, task_id, profiler, snapshot, elapsed)
+                    except Exception as e:
+                        logger.error(f"Error saving profile: {e}")
+            finally:
+                _profile_lock.release()
+        return wrapper
+    return decorator
@@ -0,0 +1,236 @@
+import os
+import logging
+from datetime import datetime, timedelta
+from google.api_core.exceptions import TooManyRequests
+from bson import ObjectId
+from pymongo import ReturnDocument
+from checkpoints import record_stage
+
+logger = logging.getLogger(__name__)
+
+# Global cap on running long_running_recognize operations, kept below the
+# project's Speech concurrent-operation quota.
+STT_MAX_INFLIGHT = int(os.getenv("STT_MAX_INFLIGHT", "50"))
+# Fair-share weight of subscribed users relative to everyone else.
+STT_SUBSCRIBED_WEIGHT = float(os.getenv("STT_SUBSCRIBED_WEIGHT", "2"))
+# Subscribed users' audio up to this length jumps ahead within their share.
+STT_SHORT_AUDIO_SECONDS = float(os.getenv("STT_SHORT_AUDIO_SECONDS", "600"))
+STT_SUBMIT_LEASE_SECONDS = int(os.getenv("STT_SUBMIT_LEASE_SECONDS", "120"))
+STT_REAP_AFTER_SECONDS = int(os.getenv("STT_REAP_AFTER_SECONDS", "300"))
+STT_MAX_SUBMIT_ATTEMPTS = int(os.getenv("STT_MAX_SUBMIT_ATTEMPTS", "5"))
+STT_SCHEDULER_SCAN = int(os.getenv("STT_SCHEDULER_SCAN", "1000"))
+
+SLOTS_ID = "inflight"
+ACTIVE_STATES = ["submitting", "inflight"]
+
+
+class SttScheduler:
+    """
+    Queue of audio ready for speech recognition, submitted as capacity frees up.
+
+    Jobs live in `queue_collection` with state queued -> submitting -> inflight
+    -> done (or failed). A counter document in `slots_collection` holds the
+    number of running operations and is only incremented below `max_inflight`,
+    so concurrent function instances never exceed the limit together.
+
+    Each dispatch round gives the next slot to the user with the smallest share,
+    (running + already picked) / weight, so one user's bulk upload cannot starve
+    others. Within a user, subscribed short audio goes first, then oldest first.
+    Both functions call dispatch(): start_transcription after enqueueing and
+    subtitle_task_status after an operation finishes or while a task is queued.
+    A job that is never submitted is refunded its `cost` in `users_collection`.
+    """
+    def __init__(self, queue_collection, slots_collection, tasks_collection, recognizer,
+                 max_inflight=STT_MAX_INFLIGHT, users_collection=None):
+        self.queue = queue_collection
+        self.slots = slots_collection
+        self.tasks = tasks_collection
+        self.users = users_collection
+        self.recognizer = recognizer
+        self.max_inflight = max_inflight
+        self.queue.create_index([("state", 1), ("enqueued_at", 1)])
+        self.queue.create_index("task_id", unique=True)
+        self.queue.create_index("operation_id")
+
+    def enqueue(self, task_id, user_id, gcs_uri, language_code, audio_seconds=None, subscribed=False, weight=None,
+                cost=0):
+        """
+        Add a task's audio to the queue; enqueueing the same task again is a no-op.
+        `weight` overrides the fair-share weight derived from `subscribed`; `cost`
+        is the coins the user was charged, refunded if submission finally fails.
+        """
+        now = datetime.now()
+        short = audio_seconds is not None and audio_seconds <= STT_SHORT_AUDIO_SECONDS
+        self.queue.update_one(
+            {"task_id": task_id},
+            {"$setOnInsert": {
+                "task_id": task_id,
+                "user_id": str(user_id),
+                "gcs_uri": gcs_uri,
+                "language_code": language_code,
+                "audio_seconds": audio_seconds,
+                "weight": weight or (STT_SUBSCRIBED_WEIGHT if subscribed else 1.0),
+                "priority": 1 if subscribed and short else 0,
+                "state": "queued",
+                "attempts": 0,
+                "cost": cost,
+                "enqueued_at": now,
+            }},
+            upsert=True
+        )
+        self.tasks.update_one({"task_id": task_id, "operation_id": {"$exists": False}}, {"$set": {"status": "queued"}})
+
+    def _acquire_slot(self):
+        self.slots.update_one({"_id": SLOTS_ID}, {"$setOnInsert": {"count": 0}}, upsert=True)
+        return self.slots.find_one_and_update(
+            {"_id": SLOTS_ID, "count": {"$lt": self.max_inflight}},
+            {"$inc": {"count": 1}}
+        ) is not None
+
+    def _release_slot(self):
+        self.slots.update_one({"_id": SLOTS_ID, "count": {"$gt": 0}}, {"$inc": {"count": -1}})
+
+    def _plan(self):
+        """Queued jobs in fair-share order for this dispatch round."""
+        active = {}
+        for row in self.queue.aggregate([
+            {"$match": {"state": {"$in": ACTIVE_STATES}}},
+            {"$group": {"_id": "$user_id", "count": {"$sum": 1}}},
+        ]):
+            active[row["_id"]] = row["count"]
+
+        per_user = {}
+        queued = self.queue.find({"state": "queued"}).sort("enqueued_at", 1).limit(STT_SCHEDULER_SCAN)
+        for job in queued:
+            per_user.setdefault(job["user_id"], []).append(job)
+        for jobs in per_user.values():
+            jobs.sort(key=lambda job: (-job["priority"], job["enqueued_at"]))
+
+        order = []
+        while per_user:
+            user_id = min(per_user, key=lambda user: (
+                (active.get(user, 0) + 1) / per_user[user][0]["weight"],
+                -per_user[user][0]["priority"],
+                per_user[user][0]["enqueued_at"],
+            ))
+            order.append(per_user[user_id].pop(0))
+            active[user_id] = active.get(user_id, 0) + 1
+            if not per_user[user_id]:
+                del per_user[user_id]
+        return order
+
+    def dispatch(self):
+        """Submit queued jobs while slots are free. Returns the submitted task ids."""
+        self.reap()
+        submitted = []
+        for job in self._plan():
+            if not self._acquire_slot():
+                break
+            claimed = self.queue.find_one_and_update(
+                {"_id": job["_id"], "state": "queued"},
+                {"$set": {
+                    "state": "submitting",
+                    "lease_until": datetime.now() + timedelta(seconds=STT_SUBMIT_LEASE_SECONDS),
+                }, "$inc": {"attempts": 1}},
+                return_document=ReturnDocument.AFTER
+            )
+            if not claimed:
+                # Another instance took it first.
+                self._release_slot()
+                continue
+            try:
+                operation_id = self.recognizer.submit(
+                    claimed["gcs_uri"], claimed["language_code"], audio_seconds=claimed.get("audio_seconds")
+                )
+            except TooManyRequests as e:
+                logger.warning(f"Speech quota reached with {self.max_inflight} slots, requeueing {claimed['task_id']}: {e}")
+                self.queue.update_one({"_id": claimed["_id"]}, {"$set": {"state": "queued"}, "$inc": {"attempts": -1}})
+                self._release_slot()
+                break
+            except Exception as e:
+                logger.error(f"Error submitting {claimed['task_id']} for recognition: {e}")
+                self._fail_or_requeue(claimed, str(e))
+                self._release_slot()
+                continue
+
+            now = datetime.now()
+            self.queue.update_one(
+                {"_id": claimed["_id"]},
+                {"$set": {"state": "inflight", "operation_id": operation_id, "submitted_at": now, "checked_at": now}}
+            )
+            record_stage(self.tasks, claimed["task_id"], "submitted", operation_id=operation_id)
+            self.tasks.update_one(
+                {"task_id": claimed["task_id"]},
+                {"$set": {"operation_id": operation_id, "status": "in_progress"}}
+            )
+            submitted.append(claimed["task_id"])
+        if submitted:
+            logger.info(f"Submitted {len(submitted)} queued recognition jobs")
+        return submitted
+
+    def _fail_or_requeue(self, job, error):
+        if job["attempts"] >= STT_MAX_SUBMIT_ATTEMPTS:
+            failed = self.queue.update_one(
+                {"_id": job["_id"], "state": "submitting"}, {"$set": {"state": "failed", "error": error}}
+            )
+            if not failed.modified_count:
+                return
+            refund = job.get("cost", 0)
+            task_update = {"status": "failed", "error": error}
+            if refund and self.users is not None:
+                self.users.update_one({"_id": ObjectId(job["user_id"])}, {"$inc": {"coins": refund}})
+                task_update["refunded"] = refund
+            self.tasks.update_one({"task_id": job["task_id"]}, {"$set": task_update})
+        else:
+            self.queue.update_one({"_id": job["_id"]}, {"$set": {"state": "queued", "error": error}})
+
+    def release(self, operation_id):
+        """Free the slot of a finished operation. Safe to call repeatedly or for operations not queued here."""
+        job = self.queue.find_one_and_update(
+            {"operation_id": operation_id, "state": "inflight"},
+            {"$set": {"state": "done", "finished_at": datetime.now()}}
+        )
+        if job:
+            self._release_slot()
+        return job is not None
+
+    def reap(self):
+        """Recover slots from expired submit leases and finished operations nobody polled."""
+        now = datetime.now()
+        for job in self.queue.find({"state": "submitting", "lease_until": {"$lt": now}}):
+            if self.queue.find_one_and_update(
+                {"_id": job["_id"], "state": "submitting"}, {"$set": {"state": "queued"}}
+            ):
+                self._release_slot()
+
+        stale = now - timedelta(seconds=STT_REAP_AFTER_SECONDS)
+        for job in self.queue.find({"state": "inflight", "checked_at": {"$lt": stale}}):
+            try:
+                done = self.recognizer.poll(job["operation_id"])["done"]
+            except Exception as e:
+                logger.warning(f"Could not poll {job['operation_id']} while reaping: {e}")
+                continue
+            if done:
+                self.release(job["operation_id"])
+            else:
+                self.queue.update_one({"_id": job["_id"]}, {"$set": {"checked_at": now}})
+
+    def queue_position(self, task_id):
+        """1-based position of a queued task in the next dispatch order, or None."""
+        for position, job in enumerate(self._plan(), start=1):
+            if job["task_id"] == task_id:
+                return position
+        return None
+
+    def stats(self, user_id=None):
+        """Slot usage and queue length; with `user_id`, also that user's running and queued jobs."""
+        slots = self.slots.find_one({"_id": SLOTS_ID}) or {}
+        stats = {
+            "max_inflight": self.max_inflight,
+            "inflight": slots.get("count", 0),
+            "queued": self.queue.count_documents({"state": "queued"}),
+        }
+        if user_id is not None:
+            stats["user_inflight"] = self.queue.count_documents({"user_id": str(user_id), "state": {"$in": ACTIVE_STATES}})
+            stats["user_queued"] = self.queue.count_documents({"user_id": str(user_id), "state": "queued"})
+        return stats
@@ -1,4 +1,5 @@
 import os
+import time
 import logging
 import json
 from datetime import datetime, timedelta
@@ -6,8 +7,17 @@ from google.oauth2 import service_account
 from google.cloud import speech_v1
 from google.cloud import storage, translate_v2 as translate
 from google.cloud import translate_v2 as translate
-import tempfile
-from pymongo import MongoClient
+from google.api_core.exceptions import NotFound
+from pymongo import MongoClient, ReturnDocument
+from recognizer import get_recognizer
+from resilience import call
+from workspace import job_workspace
+from checkpoints import record_stage, stage_artifacts, stage_reached
+from eta import record_pipeline_timing
+from stt_scheduler import SttScheduler
+from subtitle_cache import subtitle_cache, INLINE_MAX_BYTES
+from object_lifecycle import AccessLog
+from transcript_store import load_transcript, save_transcript, TranscriptReader, encode_transcript, transcript_blob_name
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -22,6 +32,10 @@ try:
         scopes=['https://www.googleapis.com/auth/cloud-platform']
     )
     speech_client = speech_v1.SpeechClient(credentials=credentials)
+    recognizer = get_recognizer(
+        speech_client, async_client_factory=lambda: speech_v1.SpeechAsyncClient(credentials=credentials)
+    )
+    storage_client = storage.Client(credentials=credentials)
 except Exception as e:
     logger.error(f"Error initializing clients: {e}")
     raise
@@ -42,6 +56,10 @@ try:
     mongo_client = MongoClient(MONGO_URI)
     db = mongo_client[DB_NAME]
     collection = db[COLLECTION_NAME]
+    timings_collection = db["PipelineTimings"]
+    bulk_collection = db["SubtitleBatches"]
+    access_log = AccessLog(db["ObjectAccess"])
+    stt_scheduler = SttScheduler(db["SttQueue"], db["SttSlots"], collection, recognizer, users_collection=db.users)
 except Exception as e:
     logger.error(f"Failed to connect to MongoDB: {e}")
     mongo_client = None
@@ -89,10 +107,12 @@ def translate_segments(transcript_segments, source_language, target_language, cr
 
         # Batch translate all segments at once for better efficiency
         texts_to_translate = [segment["text"] for segment in transcript_segments]
-        translations = translate_client.translate(
+        translations = call(
+            "translate", translate_client.translate,
             texts_to_translate,
             target_language=target_language,
-            source_language=source_language
+            source_language=source_language,
+            idempotent=True
         )
 
         # Add translated text to segments
@@ -103,11 +123,10 @@ def translate_segments(transcript_segments, source_language, target_language, cr
         return transcript_segments
 
     except Exception as e:
+        # Retries are exhausted at this point; failing the poll is better than
+        # caching untranslated subtitles under the translated file name.
         logger.error(f"Translation failed: {str(e)}")
-        # Fallback to original text if translation fails
-        for segment in transcript_segments:
-            segment["translated_text"] = segment["text"]
-        return transcript_segments
+        raise
     
 
 
@@ -118,93 +137,259 @@ def fetch_transcription_results(operation_id):
     :return: Processed transcript segments.
     """
     try:
-        operation = speech_client.get_operation(name=operation_id)
-        if not operation.done:
+        status = recognizer.poll(operation_id)
+        if not status["done"]:
             logger.info("Transcription operation is still in progress.")
             return None
+        if status["error"]:
+            logger.error(f"Transcription operation failed: {status['error']}")
+            return None
 
-        response = speech_v1.LongRunningRecognizeResponse()
-        response.ParseFromString(operation.response.value)
-
-        # Process the transcription results
-        transcript_segments = process_transcription_results(response)
+        transcript_segments = []
+        for result in recognizer.fetch_results(operation_id) or []:
+            words = result["words"]
+            if not words:
+                continue
+            transcript_segments.append({
+                "start_time": words[0]["start_time"],
+                "end_time": words[-1]["end_time"],
+                "text": " ".join(word["word"] for word in words)
+            })
         return transcript_segments
     except Exception as e:
         logger.error(f"Error fetching transcription results: {e}")
         return None
     
-def process_video(BUCKET_NAME, task_id, operation_id, video_id, source_language, target_language):
-    try:
-        logger.info(f"Processing video with operation ID: {operation_id}")
+def apply_time_offset(transcript_segments, time_offset, clip_duration=None):
+    """
+    Shift segments of a reused reference transcript onto the timeline of a
+    re-upload or clip that starts `time_offset` seconds into the reference.
+    Segments outside the clip are dropped.
+    """
+    shifted = []
+    for segment in transcript_segments:
+        start_time = segment["start_time"] - time_offset
+        end_time = segment["end_time"] - time_offset
+        if end_time <= 0 or (clip_duration is not None and start_time >= clip_duration):
+            continue
+        shifted.append({
+            **segment,
+            "start_time": max(start_time, 0.0),
+            "end_time": min(end_time, clip_duration) if clip_duration is not None else end_time,
+        })
+    return shifted
+
+def completed_subtitles_response(cache_status, content, metadata, inline=False):
+    result = {
+        "status": "completed",
+        "message": "Subtitles generated successfully",
+        "downloadUrl": metadata["downloadUrl"],
+        "cache": cache_status,
+    }
+    if inline and content is not None:
+        result["content"] = content.decode("utf-8")
+    return result
+
+def get_cached_subtitles(video_id, source_language, target_language, inline=False):
+    """Completed-task response from the in-process cache only, or None on a miss. Does no I/O."""
+    cached = subtitle_cache.get((video_id, source_language, target_language))
+    if not cached:
+        return None
+    return completed_subtitles_response("hit", cached["content"], cached["metadata"], inline)
 
-        # Get operation status and result
-        operation_result = get_operation_result(operation_id)
+def get_completed_subtitles(BUCKET_NAME, video_id, source_language, target_language, inline=False):
+    """
+    Serve the finished subtitles of a completed task from the in-process cache,
+    falling back to GCS on a miss. With `inline`, small subtitle files are
+    returned in the response as `content`. Returns None if the file is missing.
+    """
+    result = get_cached_subtitles(video_id, source_language, target_language, inline)
+    if result:
+        return result
 
-        if operation_result is None:
-            return {
-                "status": "error",
-                "message": "Failed to get operation result"
-            }
+    blob = storage_client.bucket(BUCKET_NAME).blob(f"subtitles/{video_id}_{source_language}_{target_language}.vtt")
+    try:
+        content = call("gcs", blob.download_as_bytes, idempotent=True, hedge=True, pass_timeout=True)
+    except NotFound:
+        return None
+    access_log.record(blob.name)
+    metadata = {
+        "downloadUrl": blob.generate_signed_url(
+            version="v4",
+            expiration=timedelta(hours=1),
+            method="GET"
+        ),
+        "size": len(content),
+    }
+    if len(content) > INLINE_MAX_BYTES:
+        content = None
+    subtitle_cache.put((video_id, source_language, target_language), content, **metadata)
+    return completed_subtitles_response("miss", content, metadata, inline)
+
+def release_recognition_slot(operation_id):
+    """Hand a finished operation's slot back to the scheduler and submit the next queued job."""
+    try:
+        if stt_scheduler.release(operation_id):
+            stt_scheduler.dispatch()
+    except Exception as e:
+        logger.error(f"Error releasing recognition slot for {operation_id}: {e}")
 
-        logger.info(f"Operation result: {json.dumps(operation_result, indent=2)}")
+def complete_bulk_child(task_id, download_url):
+    """
+    Mark a finished task on the bulk job it belongs to, if any, and complete the
+    job once none of its children is still being processed.
+    """
+    try:
+        job = bulk_collection.find_one({"children.task_id": task_id}, {"children.task_id": 1})
+        if not job:
+            return
+        index = next(index for index, child in enumerate(job["children"]) if child["task_id"] == task_id)
+        job = bulk_collection.find_one_and_update(
+            {"_id": job["_id"], f"children.{index}.status": "submitted"},
+            {"$set": {f"children.{index}.status": "completed", f"children.{index}.downloadUrl": download_url},
+             "$inc": {"submitted": -1, "completed": 1}},
+            return_document=ReturnDocument.AFTER
+        )
+        if job and all(child["status"] not in ("pending", "submitted") for child in job["children"]):
+            bulk_collection.update_one(
+                {"task_id": job["task_id"], "status": "in_progress"},
+                {"$set": {"status": "completed", "completed_at": datetime.now()}}
+            )
+    except Exception as e:
+        logger.error(f"Error updating bulk job of {task_id}: {e}")
 
-        if not operation_result.get("done", False):
-            return {
-                "status": "in_progress",
-                "message": "Transcription still in progress"
-            }
+def get_transcript(BUCKET_NAME, operation_id, transcript_video_id, source_language):
+    """
+    Return (transcript, status_response, stt_completed_at) for a task.
+    The stored word-level transcript for (video_id, source_language) is used when it
+    exists; otherwise the finished STT operation is fetched once and persisted, so
+    later renders never need the operation again. status_response is set when the
+    operation is not finished or failed. stt_completed_at is when the operation
+    itself finished, if it was fetched and the engine reports it.
+    """
+    bucket = storage_client.bucket(BUCKET_NAME)
+    transcript = load_transcript(bucket, transcript_video_id, source_language)
+    if transcript is not None:
+        logger.info(f"Using stored transcript for {transcript_video_id} ({source_language})")
+        return transcript, None, None
 
-        if "error" in operation_result:
-            return {
-                "status": "error",
-                "message": str(operation_result["error"])
-            }
+    # Get operation status and result
+    operation_result = get_operation_result(operation_id)
 
-        response = operation_result.get("response", {})
-        results = response.get("results", [])
+    if operation_result is None:
+        return None, {
+            "status": "error",
+            "message": "Failed to get operation result"
+        }, None
+
+    if not operation_result.get("done", False):
+        return None, {
+            "status": "in_progress",
+            "message": "Transcription still in progress"
+        }, None
+    release_recognition_slot(operation_id)
+
+    if "error" in operation_result:
+        return None, {
+            "status": "error",
+            "message": str(operation_result["error"])
+        }, None
 
-        if not results:
-            return {
-                "status": "error",
-                "message": "No transcription results found"
-            }
+    results = operation_result.get("response", {}).get("results", [])
+    if not results:
+        return None, {
+            "status": "error",
+            "message": "No transcription results found"
+        }, None
 
-        # Process results into segments
-        transcript_segments = []
-        for result in results:
-            if "transcript" not in result:
-                continue
+    content = encode_transcript(results)
+    try:
+        save_transcript(bucket, transcript_video_id, source_language, content)
+    except Exception as e:
+        logger.error(f"Error storing transcript for {transcript_video_id}: {e}")
+    return TranscriptReader(content), None, operation_result.get("completed_at")
+
+def translation_blob_name(video_id, source_language, target_language):
+    return f"translations/{video_id}_{source_language}_{target_language}.json"
+
+def save_translated_segments(BUCKET_NAME, video_id, source_language, target_language, segments):
+    """Checkpoint translated segments so a retried render does not call Translate again."""
+    blob_name = translation_blob_name(video_id, source_language, target_language)
+    blob = storage_client.bucket(BUCKET_NAME).blob(blob_name)
+    call(
+        "gcs", blob.upload_from_string,
+        json.dumps(segments, ensure_ascii=False),
+        content_type="application/json; charset=utf-8",
+        idempotent=True, pass_timeout=True
+    )
+    return f"gs://{BUCKET_NAME}/{blob_name}"
 
-            words = result.get("words", [])
-            if words:
-                start_time = float(words[0]["start_time"])
-                end_time = float(words[-1]["end_time"])
-            else:
-                start_time = 0
-                end_time = 5
-
-            segment = {
-                "text": result["transcript"],
-                "start_time": start_time,
-                "end_time": end_time,
-                "confidence": result.get("confidence", 0.0)
-            }
-            transcript_segments.append(segment)
+def load_translated_segments(translation_uri):
+    """Read checkpointed translated segments, or None if they are gone."""
+    bucket_name, _, blob_name = translation_uri[len("gs://"):].partition("/")
+    blob = storage_client.bucket(bucket_name).blob(blob_name)
+    try:
+        content = call("gcs", blob.download_as_bytes, idempotent=True, hedge=True, pass_timeout=True)
+    except NotFound:
+        return None
+    return json.loads(content.decode("utf-8"))
 
-        if not transcript_segments:
-            return {
-                "status": "error",
-                "message": "Failed to process transcript segments"
-            }
+def process_video(BUCKET_NAME, task_id, operation_id, video_id, source_language, target_language,
+                  time_offset=0.0, clip_duration=None, transcript_video_id=None, task=None):
+    try:
+        logger.info(f"Processing video with operation ID: {operation_id}")
 
-        # Translate if needed
-        translated_segments = translate_segments(
-            transcript_segments,
-            source_language,
-            target_language,
-            credentials
+        transcript_video_id = transcript_video_id or video_id
+        transcript, status_response, stt_completed_at = get_transcript(
+            BUCKET_NAME, operation_id, transcript_video_id, source_language
         )
-        print(transcript_segments,"i am transcript segment")
+        if status_response:
+            return status_response
+
+        transcript_uri = f"gs://{BUCKET_NAME}/{transcript_blob_name(transcript_video_id, source_language)}"
+        # When the operation finished, not when a poll first noticed it, so poll spacing
+        # does not leak into the STT timings the ETA model learns from.
+        stt_completed_at = stage_artifacts(task, "transcribed").get("stt_completed_at") or stt_completed_at
+        if not stage_reached(task, "transcribed"):
+            artifacts = {"stt_completed_at": stt_completed_at} if stt_completed_at else {}
+            record_stage(collection, task_id, "transcribed", transcript_uri=transcript_uri, **artifacts)
+        translate_seconds = None
+
+        translated_segments = None
+        translation_uri = stage_artifacts(task, "translated").get("translation_uri")
+        if translation_uri:
+            translated_segments = load_translated_segments(translation_uri)
+
+        if translated_segments is not None:
+            transcript.close()
+
+        if translated_segments is None:
+            with transcript:
+                transcript_segments = transcript.segments()
+
+            if time_offset or clip_duration is not None:
+                transcript_segments = apply_time_offset(transcript_segments, time_offset, clip_duration)
+
+            if not transcript_segments:
+                return {
+                    "status": "error",
+                    "message": "Failed to process transcript segments"
+                }
+
+            # Translate if needed
+            translate_started = time.monotonic()
+            translated_segments = translate_segments(
+                transcript_segments,
+                source_language,
+                target_language,
+                credentials
+            )
+            translate_seconds = time.monotonic() - translate_started
+            translation_uri = save_translated_segments(
+                BUCKET_NAME, video_id, source_language, target_language, translated_segments
+            )
+            record_stage(collection, task_id, "translated", translation_uri=translation_uri)
+
         # Generate VTT content
         vtt_content = generate_vtt_content(translated_segments)
         if not vtt_content:
@@ -212,23 +397,41 @@ def process_video(BUCKET_NAME, task_id, operation_id, video_id, source_language,
 
         # Save VTT file
         filename = f"subtitles/{video_id}_{source_language}_{target_language}.vtt"
-        signed_url = save_vtt_file(vtt_content, filename, BUCKET_NAME,credentials)
+        with job_workspace(task_id) as workspace:
+            signed_url = save_vtt_file(vtt_content, filename, BUCKET_NAME, credentials, workspace)
 
         if not signed_url:
             return {
                 "status": "error",
                 "message": "Failed to upload subtitles"
             }
+        record_stage(collection, task_id, "rendered", subtitles_uri=f"gs://{BUCKET_NAME}/{filename}")
+        if task and not task.get("reused_from") and task.get("stages", {}).get("submitted") and stt_completed_at:
+            stt_seconds = (stt_completed_at - task["stages"]["submitted"]["completed_at"]).total_seconds()
+            try:
+                record_pipeline_timing(timings_collection, task, stt_seconds, translate_seconds)
+            except Exception as e:
+                logger.error(f"Error recording pipeline timing: {e}")
+        vtt_bytes = vtt_content.encode("utf-8")
+        subtitle_cache.put(
+            (video_id, source_language, target_language),
+            vtt_bytes if len(vtt_bytes) <= INLINE_MAX_BYTES else None,
+            downloadUrl=signed_url,
+            size=len(vtt_bytes),
+        )
         collection.update_one(
             {"task_id": task_id},
             {
                 "$set": {
                     "status": "completed",
                     "downloadUrl": signed_url,
+                    "render_workspace": workspace.metrics(),
+                    "transcript_uri": transcript_uri,
                     "completed_at": datetime.now()
                 }
             }
         )
+        complete_bulk_child(task_id, signed_url)
         return {
             "status": "completed",
             "message": "Subtitles generated successfully",
@@ -272,15 +475,20 @@ def generate_vtt_content(transcript_segments):
         logger.error(f"Error generating VTT content: {e}")
         return None
 
-def save_vtt_file(vtt_content, filename, bucket_name,credentials):
+def save_vtt_file(vtt_content, filename, bucket_name,credentials, workspace=None):
     """
     Save VTT content to a file in GCS with proper encoding.
+    The file is written inside a job workspace that is removed even if the upload fails.
     """
+    if workspace is None:
+        with job_workspace("vtt") as workspace:
+            return save_vtt_file(vtt_content, filename, bucket_name, credentials, workspace)
+
     try:
-        # Create a temporary file with proper encoding
-        with tempfile.NamedTemporaryFile(mode='w', encoding='utf-8', delete=False) as temp_file:
+        temp_file_path = workspace.path(os.path.basename(filename))
+        with open(temp_file_path, 'w', encoding='utf-8') as temp_file:
             temp_file.write(vtt_content)
-            temp_file_path = temp_file.name
+        workspace.sample()
 
         # Upload the file to GCS with content type and encoding
         storage_client = storage.Client(credentials=credentials)
@@ -288,13 +496,13 @@ def save_vtt_file(vtt_content, filename, bucket_name,credentials):
         blob = bucket.blob(filename)
 
         # Upload with proper content type
-        blob.upload_from_filename(
+        call(
+            "gcs", blob.upload_from_filename,
             temp_file_path,
-            content_type='text/vtt; charset=utf-8'
+            content_type='text/vtt; charset=utf-8',
+            idempotent=True, pass_timeout=True
         )
 
-        # Clean up the temporary file
-        os.unlink(temp_file_path)
         signed_url = blob.generate_signed_url(
             version="v4",
             expiration=timedelta(hours=1),
@@ -334,7 +542,7 @@ def upload_subtitles_to_gcp(bucket_name, content, destination_blob_name, credent
         blob = bucket.blob(destination_blob_name)
 
         # Upload content
-        blob.upload_from_string(content, content_type='text/vtt')
+        call("gcs", blob.upload_from_string, content, content_type='text/vtt', idempotent=True, pass_timeout=True)
 
         # Generate signed URL valid for 1 hour
         signed_url = blob.generate_signed_url(
@@ -437,34 +645,29 @@ def get_operation_result(operation_id):
     """Get the result of a Speech-to-Text operation"""
     try:
         logger.info(f"Fetching operation: {operation_id}")
-        operation = speech_client.transport.operations_client.get_operation(operation_id)
+        status = recognizer.poll(operation_id)
 
-        if not operation:
-            logger.error("Operation not found")
-            return None
-
-        if not operation.done:
+        if not status["done"]:
             return {"done": False}
 
-        if not hasattr(operation, 'response') or not operation.response:
-            logger.error("No response in operation")
-            return None
-
-        # Parse the binary response
-        parsed_result = parse_binary_response(str(operation.response))
-
-        if parsed_result:
+        if status["error"]:
             return {
                 "done": True,
-                "response": {
-                    "results": [parsed_result]
-                }
+                "error": status["error"]
             }
-        else:
-            return {
-                "done": True,
-                "error": "Failed to parse response"
+
+        results = recognizer.fetch_results(operation_id)
+        if results is None:
+            logger.error("No response in operation")
+            return None
+
+        return {
+            "done": True,
+            "completed_at": status.get("completed_at"),
+            "response": {
+                "results": results
             }
+        }
 
     except Exception as e:
         logger.error(f"Error getting operation result: {str(e)}")
@@ -0,0 +1,96 @@
+import os
+import re
+import shutil
+import logging
+import resource
+import tempfile
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# On Cloud Functions /tmp is an in-memory filesystem, so workspace bytes count
+# against the instance memory limit.
+WORKSPACE_ROOT = os.getenv("WORKSPACE_ROOT", tempfile.gettempdir())
+WORKSPACE_QUOTA_BYTES = int(os.getenv("WORKSPACE_QUOTA_BYTES", str(1024 * 1024 * 1024)))
+
+
+class WorkspaceQuotaError(Exception):
+    """Raised when a job's workspace grows past its byte quota."""
+
+
+def _current_rss_bytes():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is in kilobytes on Linux.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Workspace:
+    """A job's private temp directory with a byte quota and peak usage tracking."""
+    def __init__(self, directory, quota_bytes):
+        self.directory = directory
+        self.quota_bytes = quota_bytes
+        self.peak_disk_bytes = 0
+        self.peak_rss_bytes = _current_rss_bytes()
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def disk_usage(self):
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    continue
+        return total
+
+    def sample(self, pending_bytes=0):
+        """Update peak disk and memory use; raise WorkspaceQuotaError past the quota."""
+        usage = self.disk_usage() + pending_bytes
+        self.peak_disk_bytes = max(self.peak_disk_bytes, usage)
+        self.peak_rss_bytes = max(self.peak_rss_bytes, _current_rss_bytes())
+        if usage > self.quota_bytes:
+            raise WorkspaceQuotaError(
+                f"Workspace {self.directory} uses {usage} bytes, quota is {self.quota_bytes}"
+            )
+        return usage
+
+    def remove(self, name):
+        """Delete a file early once it is no longer needed."""
+        self.sample()
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
+
+    def metrics(self):
+        return {
+            "peak_disk_bytes": self.peak_disk_bytes,
+            "peak_rss_bytes": self.peak_rss_bytes,
+            "quota_bytes": self.quota_bytes,
+        }
+
+
+@contextmanager
+def job_workspace(job_id, quota_bytes=WORKSPACE_QUOTA_BYTES):
+    """
+    Give a job a unique directory under WORKSPACE_ROOT and delete it on every exit path.
+    Concurrent jobs for the same video each get their own directory. The job id comes
+    from the client, so it is reduced to a safe file name before use.
+    """
+    safe_job_id = re.sub(r"[^A-Za-z0-9_.-]", "_", str(job_id)).lstrip(".")[:100]
+    directory = tempfile.mkdtemp(prefix=f"{safe_job_id}-", dir=WORKSPACE_ROOT)
+    workspace = Workspace(directory, quota_bytes)
+    try:
+        yield workspace
+    finally:
+        try:
+            workspace.sample()
+        except WorkspaceQuotaError:
+            pass
+        shutil.rmtree(directory, ignore_errors=True)
+        logger.info(f"Cleaned up workspace {directory}: {workspace.metrics()}")